@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Benchmark the OpenAI images shim against the simulated InvokeAI in `fake_invokeai.py`.
+
+Starts the fake upstream and `shim/openai_images_shim.py` (uvicorn) on free local ports, then, for
+each concurrency level, sends `--requests` generations from that many concurrent clients and reports:
+
+  - throughput (images/s) and p50/p95/p99 end-to-end latency
+  - shim overhead p50/p95/p99: latency minus the time the request's queue items spent in the
+    fake InvokeAI (enqueue -> completed), i.e. what the shim adds on top of the GPU work
+  - upstream calls per image, with the 404 probes and the busiest routes broken out
+  - errors by HTTP status
+
+Every prompt carries a `bench-<hex>` tag so the fake can attribute queue items to requests.
+By default one untimed warm-up request runs first, so route probing, OpenAPI discovery and the
+model registry are primed; `--no-warmup` includes them in the first level.
+
+CI-style gate: `--max-overhead-p95-ms` and `--max-calls-per-image` make the run exit 1 when exceeded.
+
+Examples:
+  python bench_shim.py
+  python bench_shim.py --concurrency 1 4 16 --requests 64 --exec lognormal:1.0:0.4 --workers 2
+  python bench_shim.py --events --shim-env SHIM_AFFINITY_MAX_WAIT_S=0 --json /tmp/bench.json
+  python bench_shim.py --exec const:0.2 --max-overhead-p95-ms 150 --max-calls-per-image 6
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_SHIM_DIR = os.path.join(os.path.dirname(_HERE), "shim")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+async def _wait_ready(client: httpx.AsyncClient, url: str, proc: subprocess.Popen, timeout_s: float = 30) -> None:
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"{proc.args[0:3]} exited with {proc.returncode} before becoming ready")
+        try:
+            if (await client.get(url, timeout=2)).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"Timed out waiting for {url}")
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.fake_url = ""
+        self.shim_url = ""
+        self.procs: List[subprocess.Popen] = []
+        self.tmp = tempfile.TemporaryDirectory(prefix="shim-bench-")
+
+    def start(self) -> None:
+        a = self.args
+        fake_port = a.fake_port or _free_port()
+        shim_port = a.shim_port or _free_port()
+        self.fake_url = f"http://127.0.0.1:{fake_port}"
+        self.shim_url = f"http://127.0.0.1:{shim_port}"
+
+        fake_cmd = [
+            sys.executable,
+            os.path.join(_HERE, "fake_invokeai.py"),
+            "--port", str(fake_port),
+            "--exec", a.exec,
+            "--workers", str(a.workers),
+            "--fail-rate", str(a.fail_rate),
+            "--http-error-rate", str(a.http_error_rate),
+            "--api-latency-ms", str(a.api_latency_ms),
+        ]
+        if a.events:
+            fake_cmd.append("--events")
+
+        env = dict(os.environ)
+        env.update(
+            {
+                "SHIM_MODE": "invokeai_queue",
+                "INVOKEAI_BASE_URL": self.fake_url,
+                "SHIM_GRAPH_TEMPLATE_PATH": a.template,
+                "SHIM_ROUTE_TABLE_PATH": os.path.join(self.tmp.name, "routes.json"),
+                "SHIM_RESULT_CACHE_DIR": "",
+                "SHIM_QUEUE_EVENTS": "auto" if a.events else "off",
+                "SHIM_MAX_INFLIGHT": "0",
+                "SHIM_MAX_QUEUE_DEPTH": "0",
+            }
+        )
+        for kv in a.shim_env:
+            key, _, value = kv.partition("=")
+            env[key] = value
+        shim_cmd = [
+            sys.executable, "-m", "uvicorn", "openai_images_shim:app",
+            "--host", "127.0.0.1", "--port", str(shim_port), "--log-level", "warning",
+        ]
+        log = open(os.path.join(self.tmp.name, "shim.log"), "wb")
+        self.procs.append(subprocess.Popen(fake_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT))
+        self.procs.append(subprocess.Popen(shim_cmd, cwd=_SHIM_DIR, env=env, stdout=log, stderr=subprocess.STDOUT))
+
+    def stop(self) -> None:
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        if self.args.keep_logs:
+            print(f"shim log kept in {self.tmp.name}/shim.log", file=sys.stderr)
+        else:
+            self.tmp.cleanup()
+
+    async def _one(self, client: httpx.AsyncClient) -> Dict[str, Any]:
+        tag = f"bench-{uuid.uuid4().hex}"
+        body: Dict[str, Any] = {"prompt": f"{self.args.prompt} {tag}", "n": self.args.n, "size": self.args.size}
+        if self.args.model:
+            body["model"] = self.args.model
+        started = time.perf_counter()
+        try:
+            resp = await client.post(f"{self.shim_url}/v1/images/generations", json=body, timeout=self.args.timeout)
+            status = resp.status_code
+            images = len(resp.json().get("data") or []) if status == 200 else 0
+        except httpx.HTTPError as e:
+            status, images = type(e).__name__, 0
+        return {"tag": tag, "status": status, "images": images, "latency_s": time.perf_counter() - started}
+
+    async def run_level(self, client: httpx.AsyncClient, concurrency: int) -> Dict[str, Any]:
+        await client.post(f"{self.fake_url}/_fake/reset")
+        queue: "asyncio.Queue[int]" = asyncio.Queue()
+        for i in range(self.args.requests):
+            queue.put_nowait(i)
+        results: List[Dict[str, Any]] = []
+
+        async def _client() -> None:
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results.append(await self._one(client))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(_client() for _ in range(concurrency)))
+        wall_s = time.perf_counter() - started
+
+        stats = (await client.get(f"{self.fake_url}/_fake/stats")).json()
+        items = (await client.get(f"{self.fake_url}/_fake/items")).json()
+        by_tag: Dict[str, List[Dict[str, Any]]] = collections.defaultdict(list)
+        for item in items:
+            if item.get("tag"):
+                by_tag[item["tag"]].append(item)
+
+        ok = [r for r in results if r["status"] == 200]
+        overheads: List[float] = []
+        for r in ok:
+            tagged = by_tag.get(r["tag"]) or []
+            if tagged and all(i.get("completed_at") for i in tagged):
+                upstream_s = max(i["completed_at"] for i in tagged) - min(i["created_at"] for i in tagged)
+                overheads.append(max(0.0, r["latency_s"] - upstream_s))
+        latencies = [r["latency_s"] for r in ok]
+        images = sum(r["images"] for r in ok)
+        calls: Dict[str, int] = stats["calls"]
+        total_calls = sum(calls.values())
+        probes = sum(n for route, n in calls.items() if route.endswith(" 404"))
+        return {
+            "concurrency": concurrency,
+            "requests": len(results),
+            "ok": len(ok),
+            "errors": dict(collections.Counter(str(r["status"]) for r in results if r["status"] != 200)),
+            "images": images,
+            "wall_s": round(wall_s, 3),
+            "throughput_images_per_s": round(images / wall_s, 3) if wall_s > 0 else None,
+            "latency_s": {f"p{p}": _percentile(latencies, p) for p in (50, 95, 99)},
+            "overhead_s": {f"p{p}": _percentile(overheads, p) for p in (50, 95, 99)},
+            "upstream_calls": total_calls,
+            "upstream_calls_per_image": round(total_calls / images, 2) if images else None,
+            "upstream_probe_misses": probes,
+            "upstream_calls_by_route": dict(sorted(calls.items(), key=lambda kv: -kv[1])),
+            "queue_items": stats["items"],
+        }
+
+    async def run(self) -> List[Dict[str, Any]]:
+        async with httpx.AsyncClient() as client:
+            await _wait_ready(client, f"{self.fake_url}/api/v1/app/version", self.procs[0])
+            await _wait_ready(client, f"{self.shim_url}/healthz", self.procs[1])
+            if not self.args.no_warmup:
+                warm = await self._one(client)
+                if warm["status"] != 200:
+                    print(f"warning: warm-up request returned {warm['status']}", file=sys.stderr)
+            return [await self.run_level(client, c) for c in self.args.concurrency]
+
+
+def _report(levels: List[Dict[str, Any]]) -> None:
+    header = (
+        f"{'conc':>4} {'ok':>5} {'img/s':>7} {'p50':>6} {'p95':>6} {'p99':>6}"
+        f" {'ovh50':>6} {'ovh95':>6} {'ovh99':>6} {'calls/img':>9} {'404s':>5}  errors"
+    )
+    print(header)
+    print("-" * len(header))
+    for lv in levels:
+        lat, ovh = lv["latency_s"], lv["overhead_s"]
+        print(
+            f"{lv['concurrency']:>4} {lv['ok']:>5} {lv['throughput_images_per_s'] or 0:>7.2f}"
+            f" {_ms(lat['p50']):>6} {_ms(lat['p95']):>6} {_ms(lat['p99']):>6}"
+            f" {_ms(ovh['p50']):>6} {_ms(ovh['p95']):>6} {_ms(ovh['p99']):>6}"
+            f" {lv['upstream_calls_per_image'] or 0:>9.2f} {lv['upstream_probe_misses']:>5}  {lv['errors'] or ''}"
+        )
+    print("(latency and overhead in ms)")
+    busiest = levels[-1]["upstream_calls_by_route"] if levels else {}
+    if busiest:
+        print(f"\nupstream calls at concurrency {levels[-1]['concurrency']}:")
+        for route, n in list(busiest.items())[:10]:
+            print(f"  {n:>6}  {route}")
+
+
+def _check(args: argparse.Namespace, levels: List[Dict[str, Any]]) -> List[str]:
+    failures: List[str] = []
+    for lv in levels:
+        p95 = lv["overhead_s"]["p95"]
+        if args.max_overhead_p95_ms is not None and p95 is not None and p95 * 1000 > args.max_overhead_p95_ms:
+            failures.append(
+                f"concurrency {lv['concurrency']}: overhead p95 {p95 * 1000:.0f}ms > {args.max_overhead_p95_ms:.0f}ms"
+            )
+        cpi = lv["upstream_calls_per_image"]
+        if args.max_calls_per_image is not None and cpi is not None and cpi > args.max_calls_per_image:
+            failures.append(
+                f"concurrency {lv['concurrency']}: {cpi:.2f} upstream calls/image > {args.max_calls_per_image}"
+            )
+        if lv["ok"] == 0:
+            failures.append(f"concurrency {lv['concurrency']}: no successful requests")
+    return failures
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Benchmark openai_images_shim.py against a simulated InvokeAI")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--requests", type=int, default=32, help="Requests per concurrency level")
+    p.add_argument("--n", type=int, default=1, help="Images per request")
+    p.add_argument("--size", default="1024x1024")
+    p.add_argument("--model", default=None, help="Model/preset to request (default: the shim's default)")
+    p.add_argument("--prompt", default="a lighthouse at dusk")
+    p.add_argument("--timeout", type=float, default=300)
+    p.add_argument("--no-warmup", action="store_true", help="Include first-request discovery in the first level")
+    # Fake upstream
+    p.add_argument("--exec", default="const:0.5", help="Per-item execution time distribution (see fake_invokeai.py)")
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--fail-rate", type=float, default=0.0)
+    p.add_argument("--http-error-rate", type=float, default=0.0)
+    p.add_argument("--api-latency-ms", type=float, default=0.0)
+    p.add_argument("--events", action="store_true", help="Fake serves socket.io queue events (shim uses them)")
+    # Shim
+    p.add_argument("--template", default=os.path.join(_SHIM_DIR, "graph_template.json"))
+    p.add_argument("--shim-env", action="append", default=[], metavar="KEY=VALUE", help="Extra shim environment")
+    p.add_argument("--fake-port", type=int, default=0)
+    p.add_argument("--shim-port", type=int, default=0)
+    p.add_argument("--keep-logs", action="store_true")
+    # Output / gates
+    p.add_argument("--json", default=None, help="Also write results as JSON to this path")
+    p.add_argument("--max-overhead-p95-ms", type=float, default=None)
+    p.add_argument("--max-calls-per-image", type=float, default=None)
+    return p
+
+
+def main() -> int:
+    args = _build_parser().parse_args()
+    bench = Bench(args)
+    bench.start()
+    try:
+        levels = asyncio.run(bench.run())
+    finally:
+        bench.stop()
+
+    _report(levels)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "levels": levels}, f, indent=2)
+    failures = _check(args, levels)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
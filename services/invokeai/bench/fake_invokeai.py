@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""Simulated InvokeAI upstream for benchmarking the OpenAI images shim without a GPU.
+
+Implements the slice of InvokeAI's API the shim talks to:
+  - GET  /openapi.json                               (v1 queue/images/models paths, flat invocation inputs)
+  - GET  /api/v1/app/version
+  - GET  /api/v1/models/                             (configurable model list)
+  - POST /api/v1/queue/{queue_id}/enqueue_batch      (runs x batch data -> queue items, honours `prepend`)
+  - GET  /api/v1/queue/{queue_id}/i/{item_id}
+  - GET  /api/v1/queue/{queue_id}/status
+  - PUT  /api/v1/queue/{queue_id}/i/{item_id}/cancel
+  - GET  /api/v1/images/i/{image_name}/full
+  - POST /api/v1/images/delete, GET/POST /api/v1/boards/, POST /api/v1/board_images/batch
+  - socket.io queue events on /ws/socket.io          (with --events; needs python-socketio)
+
+Anything else (e.g. the shim's /api/v2 probes) is a 404, as on a real v1-only InvokeAI.
+
+Queue items are executed by `--workers` simulated GPUs in queue order, each taking a duration
+drawn from `--exec` (see `parse_distribution`). `--fail-rate` makes items finish as `failed`,
+`--http-error-rate` answers API calls with 503, and `--api-latency-ms` delays every response.
+
+Bookkeeping for the benchmark driver (not part of InvokeAI's API):
+  - GET  /_fake/stats   call counts per route (including 404s) and item counts by status
+  - GET  /_fake/items   per-item timings, tagged with the `bench-<hex>` token found in the graph
+  - POST /_fake/reset   clear counters and items
+
+Run:
+  python fake_invokeai.py --port 19090 --exec lognormal:2.0:0.3 --workers 1
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import collections
+import datetime
+import itertools
+import json
+import math
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import socketio  # type: ignore
+except Exception:
+    socketio = None
+
+
+# 1x1 PNG (transparent)
+_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mP8/x8AAwMB"
+    "gQWZ8l8AAAAASUVORK5CYII="
+)
+_TAG_RE = re.compile(r"bench-[0-9a-f]{8,32}")
+_TERMINAL = {"completed", "failed", "canceled"}
+
+
+def parse_distribution(spec: str) -> Callable[[], float]:
+    """Parse an execution-time distribution (seconds).
+
+    const:S | uniform:LO:HI | normal:MEAN:STDDEV | lognormal:MEDIAN:SIGMA | exp:MEAN
+    A bare number is `const`. Samples are clipped at 0.
+    """
+    parts = spec.strip().split(":")
+    kind, args = parts[0].lower(), [float(x) for x in parts[1:]]
+    if len(parts) == 1:
+        value = float(parts[0])
+        return lambda: value
+    if kind == "const" and len(args) == 1:
+        return lambda: args[0]
+    if kind == "uniform" and len(args) == 2:
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "normal" and len(args) == 2:
+        return lambda: max(0.0, random.gauss(args[0], args[1]))
+    if kind == "lognormal" and len(args) == 2:
+        mu = math.log(args[0])
+        return lambda: random.lognormvariate(mu, args[1])
+    if kind == "exp" and len(args) == 1:
+        return lambda: random.expovariate(1.0 / args[0])
+    raise ValueError(f"Unknown distribution '{spec}'")
+
+
+def _timestamp(t: Optional[float]) -> Optional[str]:
+    # InvokeAI reports naive UTC timestamps.
+    if t is None:
+        return None
+    return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class FakeInvokeAI:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.exec_time = parse_distribution(args.exec)
+        self.items: Dict[int, Dict[str, Any]] = {}
+        self.pending: Deque[int] = deque()
+        self.calls: "collections.Counter[str]" = collections.Counter()
+        self.deleted: set = set()
+        self.boards: Dict[str, Dict[str, Any]] = {}
+        self.ids = itertools.count(1)
+        self.wakeup = asyncio.Event()
+        self.sio: Any = None
+
+    def reset(self) -> None:
+        self.items.clear()
+        self.pending.clear()
+        self.calls.clear()
+        self.deleted.clear()
+
+    # --- queue simulation -------------------------------------------------
+
+    def enqueue(self, queue_id: str, batch: Dict[str, Any], prepend: bool) -> List[int]:
+        graph = batch.get("graph") or {}
+        runs = max(1, int(batch.get("runs") or 1))
+        width = 1
+        for group in batch.get("data") or []:
+            for field in group or []:
+                width = max(width, len(field.get("items") or []))
+        tag_match = _TAG_RE.search(json.dumps(graph))
+        node_ids = list((graph.get("nodes") or {}).keys())
+        ids: List[int] = []
+        now = time.time()
+        for _ in range(runs * width):
+            item_id = next(self.ids)
+            self.items[item_id] = {
+                "item_id": item_id,
+                "queue_id": queue_id,
+                "status": "pending",
+                "tag": tag_match.group(0) if tag_match else None,
+                "node_ids": node_ids,
+                "created_at": now,
+                "started_at": None,
+                "completed_at": None,
+            }
+            ids.append(item_id)
+        if prepend:
+            self.pending.extendleft(reversed(ids))
+        else:
+            self.pending.extend(ids)
+        self.wakeup.set()
+        return ids
+
+    async def worker(self) -> None:
+        while True:
+            while not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            item = self.items.get(self.pending.popleft())
+            if item is None or item["status"] != "pending":
+                continue
+            item["status"] = "in_progress"
+            item["started_at"] = time.time()
+            await self.emit_status(item)
+            duration = self.exec_time()
+            steps = 4
+            for step in range(steps):
+                await asyncio.sleep(duration / steps)
+                if item["status"] == "canceled":
+                    break
+                await self.emit_progress(item, step + 1, steps)
+            if item["status"] == "canceled":
+                continue
+            item["completed_at"] = time.time()
+            item["status"] = "failed" if random.random() < self.args.fail_rate else "completed"
+            await self.emit_status(item)
+
+    def queue_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "item_id": item["item_id"],
+            "queue_id": item["queue_id"],
+            "status": item["status"],
+            "created_at": _timestamp(item["created_at"]),
+            "started_at": _timestamp(item["started_at"]),
+            "completed_at": _timestamp(item["completed_at"]),
+        }
+        if item["status"] == "failed":
+            out["error_type"] = "SimulatedFailure"
+            out["error_message"] = "fake_invokeai --fail-rate"
+        if item["status"] == "completed":
+            image = {"image_name": f"fake-{item['item_id']}.png"}
+            out["session"] = {
+                "source_prepared_mapping": {node_id: [f"{node_id}-prepared"] for node_id in item["node_ids"]},
+                "results": {f"{node_id}-prepared": {"image": image} for node_id in item["node_ids"]},
+            }
+        return out
+
+    def queue_status(self, queue_id: str) -> Dict[str, Any]:
+        counts = collections.Counter(i["status"] for i in self.items.values() if i["queue_id"] == queue_id)
+        return {
+            "queue": {
+                "queue_id": queue_id,
+                "pending": counts["pending"],
+                "in_progress": counts["in_progress"],
+                "completed": counts["completed"],
+                "failed": counts["failed"],
+                "canceled": counts["canceled"],
+                "total": sum(counts.values()),
+            }
+        }
+
+    # --- events -----------------------------------------------------------
+
+    async def emit_status(self, item: Dict[str, Any]) -> None:
+        if self.sio is not None:
+            payload = {"queue_id": item["queue_id"], "item_id": item["item_id"], "status": item["status"]}
+            await self.sio.emit("queue_item_status_changed", payload, room=item["queue_id"])
+
+    async def emit_progress(self, item: Dict[str, Any], step: int, total: int) -> None:
+        if self.sio is not None:
+            payload = {
+                "queue_id": item["queue_id"],
+                "item_id": item["item_id"],
+                "step": step,
+                "total_steps": total,
+                "percentage": step / total,
+                "message": "Denoising",
+            }
+            await self.sio.emit("invocation_progress", payload, room=item["queue_id"])
+
+
+_OPENAPI = {
+    "openapi": "3.1.0",
+    "info": {"title": "Invoke - Community Edition (simulated)", "version": "1.0.0"},
+    "paths": {
+        "/api/v1/app/version": {"get": {}},
+        "/api/v1/models/": {"get": {}},
+        "/api/v1/queue/{queue_id}/enqueue_batch": {"post": {}},
+        "/api/v1/queue/{queue_id}/i/{item_id}": {"get": {}},
+        "/api/v1/queue/{queue_id}/i/{item_id}/cancel": {"put": {}},
+        "/api/v1/queue/{queue_id}/status": {"get": {}},
+        "/api/v1/images/i/{image_name}/full": {"get": {}},
+        "/api/v1/images/delete": {"post": {}},
+        "/api/v1/boards/": {"get": {}, "post": {}},
+        "/api/v1/board_images/batch": {"post": {}},
+    },
+    "components": {
+        "schemas": {
+            # InvokeAI 4+ invocations carry their fields flat (no `inputs` wrapper).
+            "CompelInvocation": {"properties": {"id": {}, "type": {}, "prompt": {}}},
+        }
+    },
+}
+
+
+def build_app(args: argparse.Namespace) -> Any:
+    fake = FakeInvokeAI(args)
+    app = FastAPI(title="fake InvokeAI")
+    app.state.fake = fake
+
+    @app.middleware("http")
+    async def _bookkeeping(request: Request, call_next: Any) -> Response:
+        path = request.url.path
+        if path.startswith("/_fake/"):
+            return await call_next(request)
+        if args.api_latency_ms > 0:
+            await asyncio.sleep(args.api_latency_ms / 1000.0)
+        if args.http_error_rate > 0 and random.random() < args.http_error_rate:
+            fake.calls[f"{request.method} {path} 503"] += 1
+            return JSONResponse({"detail": "fake_invokeai --http-error-rate"}, status_code=503)
+        response = await call_next(request)
+        route = request.scope.get("route")
+        name = getattr(route, "path", None) if response.status_code != 404 else None
+        fake.calls[f"{request.method} {name or path} {response.status_code}"] += 1
+        return response
+
+    @app.on_event("startup")
+    async def _start_workers() -> None:
+        for _ in range(max(1, args.workers)):
+            asyncio.ensure_future(fake.worker())
+
+    @app.get("/openapi.json", include_in_schema=False)
+    async def openapi() -> Dict[str, Any]:
+        return _OPENAPI
+
+    @app.get("/api/v1/app/version")
+    async def version() -> Dict[str, Any]:
+        return {"version": "6.10.0", "highlights": []}
+
+    @app.get("/api/v1/models/")
+    async def models() -> Dict[str, Any]:
+        return {
+            "models": [
+                {"key": f"fake-{i}", "hash": f"blake3:{i:064x}", "name": name, "base": "sdxl", "type": "main"}
+                for i, name in enumerate(args.models)
+            ]
+        }
+
+    @app.post("/api/v1/queue/{queue_id}/enqueue_batch")
+    async def enqueue_batch(queue_id: str, request: Request) -> Dict[str, Any]:
+        body = await request.json()
+        batch = body.get("batch")
+        if not isinstance(batch, dict) or not isinstance(batch.get("graph"), dict):
+            raise HTTPException(status_code=422, detail="batch.graph is required")
+        ids = fake.enqueue(queue_id, batch, prepend=bool(body.get("prepend")))
+        return {
+            "queue_id": queue_id,
+            "enqueued": len(ids),
+            "requested": len(ids),
+            "batch": {"batch_id": f"batch-{ids[0]}", "runs": batch.get("runs", 1)},
+            "priority": 0,
+            "item_ids": ids,
+        }
+
+    def _item(item_id: int) -> Dict[str, Any]:
+        item = fake.items.get(item_id)
+        if item is None:
+            raise HTTPException(status_code=404, detail=f"Queue item {item_id} not found")
+        return item
+
+    @app.get("/api/v1/queue/{queue_id}/i/{item_id}")
+    async def get_queue_item(queue_id: str, item_id: int) -> Dict[str, Any]:
+        return fake.queue_item(_item(item_id))
+
+    @app.put("/api/v1/queue/{queue_id}/i/{item_id}/cancel")
+    async def cancel_queue_item(queue_id: str, item_id: int) -> Dict[str, Any]:
+        item = _item(item_id)
+        if item["status"] not in _TERMINAL:
+            item["status"] = "canceled"
+            item["completed_at"] = time.time()
+            await fake.emit_status(item)
+        return fake.queue_item(item)
+
+    @app.get("/api/v1/queue/{queue_id}/status")
+    async def queue_status(queue_id: str) -> Dict[str, Any]:
+        return fake.queue_status(queue_id)
+
+    @app.get("/api/v1/images/i/{image_name}/full")
+    async def image_full(image_name: str) -> Response:
+        if image_name in fake.deleted:
+            raise HTTPException(status_code=404, detail=f"Image {image_name} not found")
+        return Response(_PNG, media_type="image/png")
+
+    @app.post("/api/v1/images/delete")
+    async def delete_images(request: Request) -> Dict[str, Any]:
+        names = list((await request.json()).get("image_names") or [])
+        fake.deleted.update(names)
+        return {"deleted_images": names, "affected_boards": []}
+
+    @app.get("/api/v1/boards/")
+    async def list_boards(all: bool = False) -> Any:
+        boards = list(fake.boards.values())
+        return boards if all else {"items": boards, "offset": 0, "limit": len(boards), "total": len(boards)}
+
+    @app.post("/api/v1/boards/")
+    async def create_board(board_name: str) -> Dict[str, Any]:
+        board = {"board_id": f"board-{len(fake.boards) + 1}", "board_name": board_name, "image_names": []}
+        fake.boards[board["board_id"]] = board
+        return board
+
+    @app.post("/api/v1/board_images/batch")
+    async def add_images_to_board(request: Request) -> Dict[str, Any]:
+        body = await request.json()
+        board = fake.boards.get(body.get("board_id"))
+        if board is None:
+            raise HTTPException(status_code=404, detail="Board not found")
+        board["image_names"].extend(body.get("image_names") or [])
+        return {"board_id": board["board_id"], "added_image_names": body.get("image_names") or []}
+
+    @app.get("/_fake/stats")
+    async def stats() -> Dict[str, Any]:
+        return {
+            "calls": dict(fake.calls),
+            "items": dict(collections.Counter(i["status"] for i in fake.items.values())),
+            "deleted_images": len(fake.deleted),
+            "boards": {b["board_name"]: len(b["image_names"]) for b in fake.boards.values()},
+        }
+
+    @app.get("/_fake/items")
+    async def items() -> List[Dict[str, Any]]:
+        return [
+            {k: item[k] for k in ("item_id", "status", "tag", "created_at", "started_at", "completed_at")}
+            for item in fake.items.values()
+        ]
+
+    @app.post("/_fake/reset")
+    async def reset() -> Dict[str, Any]:
+        fake.reset()
+        return {"ok": True}
+
+    if not args.events:
+        return app
+    if socketio is None:
+        raise SystemExit("--events needs python-socketio")
+    sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+    fake.sio = sio
+
+    @sio.on("subscribe_queue")
+    async def _subscribe(sid: str, data: Dict[str, Any]) -> None:
+        await sio.enter_room(sid, (data or {}).get("queue_id") or "default")
+
+    return socketio.ASGIApp(sio, other_asgi_app=app, socketio_path="/ws/socket.io")
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Simulated InvokeAI upstream for shim benchmarks")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=19090)
+    p.add_argument("--exec", default="const:0.5", help="Per-item execution time distribution (seconds)")
+    p.add_argument("--workers", type=int, default=1, help="Simulated GPUs executing queue items in parallel")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of items that finish as failed")
+    p.add_argument("--http-error-rate", type=float, default=0.0, help="Fraction of API calls answered with 503")
+    p.add_argument("--api-latency-ms", type=float, default=0.0, help="Added latency per API call")
+    p.add_argument("--events", action="store_true", help="Serve socket.io queue events")
+    p.add_argument(
+        "--models",
+        nargs="+",
+        default=["Juggernaut XL v9", "SDXL Turbo"],
+        help="Model names listed by /api/v1/models/",
+    )
+    return p
+
+
+def main() -> None:
+    args = _build_parser().parse_args()
+    parse_distribution(args.exec)
+    uvicorn.run(build_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
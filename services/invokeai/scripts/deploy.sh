@@ -69,6 +69,15 @@ if [ -f "$SERVICE_DIR/shim/openai_images_shim.py" ]; then
   fi
 fi
 
+# Ensure shim dependencies are present in the InvokeAI venv
+if [ -f "$SERVICE_DIR/shim/requirements.txt" ] && [ -x /var/lib/invokeai/venv/bin/pip ]; then
+  if ! $SUDO runuser -u invokeai -- /var/lib/invokeai/venv/bin/python -c "import httpx, yaml, socketio, websocket" 2>/dev/null; then
+    echo "  Installing OpenAI images shim dependencies..."
+    $SUDO runuser -u invokeai -- /var/lib/invokeai/venv/bin/pip install -q -r "$SERVICE_DIR/shim/requirements.txt"
+    echo "  ✓ Shim dependencies installed"
+  fi
+fi
+
 # Provision shim env file (do not overwrite local changes)
 if [ -f "$SERVICE_DIR/shim/shim.env.example" ]; then
   $SUDO mkdir -p /var/lib/invokeai/openai_images_shim
@@ -113,6 +113,11 @@ if [ -f "$SCRIPT_DIR/../shim/shim.env.example" ]; then
 fi
 
 chown -R invokeai:invokeai /var/lib/invokeai/openai_images_shim
+
+# Shim dependencies (mostly already present in the InvokeAI venv)
+if [ -f "$SCRIPT_DIR/../shim/requirements.txt" ]; then
+  sudo -u invokeai /var/lib/invokeai/venv/bin/pip install -q -r "$SCRIPT_DIR/../shim/requirements.txt"
+fi
 echo "✓ Shim installed at /var/lib/invokeai/openai_images_shim"
 echo ""
 
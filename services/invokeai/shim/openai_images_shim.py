@@ -1,7 +1,8 @@
 """OpenAI Images API shim for InvokeAI.
 
 Purpose
-- Expose POST /v1/images/generations with an OpenAI-ish response body containing data[].b64_json.
+- Expose POST /v1/images/generations with an OpenAI-ish response body containing data[].b64_json
+    (streamed), or data[].url with response_format=url (served by GET /v1/images/files/{name}).
 - Designed to sit behind nginx on ada2 and translate requests into InvokeAI's queue + images APIs.
 
 Modes
@@ -14,6 +15,9 @@ Graph templates
 - Provide SHIM_OUTPUT_NODE_ID identifying the output node id in that graph.
 - Template supports simple placeholders in any string field:
     - {{prompt}}, {{negative_prompt}}
+- Templates are compiled once (and recompiled when the file changes) into a ready-to-enqueue
+    API graph plus the JSON paths of every per-request value; requests only clone and patch it.
+- Presets in SHIM_MODEL_PRESETS_JSON may name their own "template" (and "output_node_id").
 
 Notes
 - Many InvokeAI “workflow export” JSON files store width/height/seed as numbers, not strings.
@@ -24,25 +28,62 @@ Notes
 
 from __future__ import annotations
 
+import asyncio
 import base64
+import contextlib
+import contextvars
+import copy
+import dataclasses
+import datetime
 import hashlib
+import io
 import json
 import logging
 import os
+import random
+import socket
+import threading
 import time
-import urllib.error
 import urllib.parse
-import urllib.request
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple, TypeVar
 
-from fastapi import FastAPI, HTTPException
+import httpx
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+
+# Optional: python-socketio (installed alongside InvokeAI) lets us wait on queue events instead of polling.
+try:
+    import socketio  # type: ignore
+except Exception:
+    socketio = None
+
+# Optional: Pillow (installed alongside InvokeAI) re-encodes/downscales outputs (output_format, output_size).
+try:
+    from PIL import Image  # type: ignore
+except Exception:
+    Image = None
+else:
+    # Pillow < 11.3 only writes AVIF with this plugin.
+    with contextlib.suppress(Exception):
+        import pillow_avif  # type: ignore  # noqa: F401
+
+# Optional: PyYAML, only needed to read upstreams from hosts.yaml (SHIM_HOSTS_YAML).
+try:
+    import yaml  # type: ignore
+except Exception:
+    yaml = None
 
 
 app = FastAPI(title="InvokeAI OpenAI Images Shim", version="0.1")
 logger = logging.getLogger("uvicorn.error")
-_SHIM_BUILD = "2026-01-16i"
+_SHIM_BUILD = "2026-10-17z"
 
 
 def _shim_file_sha256_prefix() -> Optional[str]:
@@ -58,7 +99,7 @@ class ImagesGenerationsRequest(BaseModel):
     prompt: str = Field(min_length=1)
     n: int = Field(default=1, ge=1, le=10)
     size: Optional[str] = None  # e.g. "1024x1024"
-    response_format: Optional[str] = None  # expected: "b64_json"
+    response_format: Optional[str] = None  # "b64_json" (default) or "url"
     model: Optional[str] = None
     user: Optional[str] = None
     seed: Optional[int] = None
@@ -66,6 +107,10 @@ class ImagesGenerationsRequest(BaseModel):
     steps: Optional[int] = None
     cfg_scale: Optional[float] = None
     scheduler: Optional[str] = None
+    priority: Optional[str] = None  # "interactive" (front of InvokeAI's queue) or "batch" (back)
+    output_format: Optional[str] = None  # png (default), jpeg, webp or avif
+    output_compression: Optional[int] = Field(default=None, ge=0, le=100)  # jpeg/webp/avif quality
+    output_size: Optional[str] = None  # downscale to fit within WxH (never upscales)
 
 
 def _parse_model_presets(raw: Optional[str]) -> Dict[str, Dict[str, Any]]:
@@ -74,7 +119,8 @@ def _parse_model_presets(raw: Optional[str]) -> Dict[str, Dict[str, Any]]:
     Expected shape (single-line JSON):
       {
         "gpu_fast": {"model": "Some Model", "steps": 4, "cfg_scale": 0, "scheduler": "..."},
-        "gpu_slow": {"model": "Other Model", "steps": 30, "cfg_scale": 6}
+        "gpu_slow": {"model": "Other Model", "steps": 30, "cfg_scale": 6, "template": "/path/to/graph.json",
+                     "priority": "batch"}
       }
 
     Values may also be strings (shorthand for {"model": "..."}).
@@ -143,6 +189,40 @@ class ShimConfig:
     strict_model: bool
     model_presets_json: Optional[str]
     enable_debug_endpoints: bool
+    openapi_cache_ttl_s: float
+    route_table_path: Optional[str]
+    poll_max_interval_s: float
+    queue_events: str
+    events_path: str
+    event_repoll_s: float
+    http_max_connections: int
+    http_max_keepalive: int
+    http_connect_timeout_s: float
+    model_cache_ttl_s: float
+    result_cache_dir: Optional[str]
+    result_cache_max_mb: float
+    max_inflight: int
+    max_queue_depth: int
+    queue_status_ttl_s: float
+    default_priority: str
+    job_ttl_s: float
+    max_jobs: int
+    affinity_max_wait_s: float
+    warmup_presets: Tuple[str, ...]
+    warmup_size: str
+    warmup_steps: int
+    keep_warm_idle_s: float
+    upstream_urls: Tuple[str, ...]
+    hosts_yaml_path: Optional[str]
+    upstream_health_interval_s: float
+    default_output_format: str
+    output_quality: int
+    encode_workers: int
+    gallery_cleanup: str
+    gallery_retention_s: float
+    gallery_board: str
+    gallery_cleanup_batch: int
+    ready_max_age_s: float
 
 
 def _get_config() -> ShimConfig:
@@ -151,6 +231,8 @@ def _get_config() -> ShimConfig:
         invokeai_base_url=os.getenv("INVOKEAI_BASE_URL", "http://127.0.0.1:9090").rstrip("/"),
         queue_id=os.getenv("INVOKEAI_QUEUE_ID", "default"),
         shim_port=int(os.getenv("SHIM_PORT", "9091")),
+        # Initial poll interval; it backs off towards SHIM_POLL_MAX_INTERVAL_S while a job runs.
+        # Only used when queue events are unavailable.
         poll_interval_s=float(os.getenv("SHIM_POLL_INTERVAL_S", "0.25")),
         timeout_s=float(os.getenv("SHIM_TIMEOUT_S", "300")),
         graph_template_path=os.getenv("SHIM_GRAPH_TEMPLATE_PATH"),
@@ -169,9 +251,196 @@ def _get_config() -> ShimConfig:
         strict_model=os.getenv("SHIM_STRICT_MODEL", "false").strip().lower() in {"1", "true", "yes"},
         model_presets_json=os.getenv("SHIM_MODEL_PRESETS_JSON"),
         enable_debug_endpoints=os.getenv("SHIM_ENABLE_DEBUG_ENDPOINTS", "false").strip().lower() in {"1", "true", "yes"},
+        # The upstream OpenAPI schema is multi-MB and only changes when InvokeAI is upgraded.
+        openapi_cache_ttl_s=float(os.getenv("SHIM_OPENAPI_CACHE_TTL_S", "600")),
+        # Learned upstream routes survive restarts; set to an empty string to keep them in memory only.
+        route_table_path=os.getenv("SHIM_ROUTE_TABLE_PATH", "/var/lib/invokeai/openai_images_shim/routes.json").strip()
+        or None,
+        poll_max_interval_s=float(os.getenv("SHIM_POLL_MAX_INTERVAL_S", "2.0")),
+        # auto: subscribe to InvokeAI's socket.io queue events when python-socketio is available.
+        # off: always poll.
+        queue_events=os.getenv("SHIM_QUEUE_EVENTS", "auto").strip().lower(),
+        events_path=os.getenv("SHIM_EVENTS_PATH", "/ws/socket.io").strip() or "/ws/socket.io",
+        # Safety net: re-check the queue item this often even while waiting on events.
+        event_repoll_s=float(os.getenv("SHIM_EVENT_REPOLL_S", "5")),
+        # Shared upstream HTTP client (keep-alive pool). Read/write timeouts are set per operation.
+        http_max_connections=int(os.getenv("SHIM_HTTP_MAX_CONNECTIONS", "64")),
+        http_max_keepalive=int(os.getenv("SHIM_HTTP_MAX_KEEPALIVE", "16")),
+        http_connect_timeout_s=float(os.getenv("SHIM_HTTP_CONNECT_TIMEOUT_S", "5")),
+        # Upstream model list (and the name -> model resolutions derived from it).
+        model_cache_ttl_s=float(os.getenv("SHIM_MODEL_CACHE_TTL_S", "300")),
+        # Seeded requests are deterministic; their PNGs are cached here. Empty string disables the cache.
+        result_cache_dir=os.getenv("SHIM_RESULT_CACHE_DIR", "/var/lib/invokeai/openai_images_shim/result_cache").strip()
+        or None,
+        result_cache_max_mb=float(os.getenv("SHIM_RESULT_CACHE_MAX_MB", "2048")),
+        # Admission control (0 disables a limit): queue items this shim has in flight, and
+        # InvokeAI's pending + in-progress count (read from the queue status endpoint).
+        max_inflight=int(os.getenv("SHIM_MAX_INFLIGHT", "16")),
+        max_queue_depth=int(os.getenv("SHIM_MAX_QUEUE_DEPTH", "32")),
+        queue_status_ttl_s=float(os.getenv("SHIM_QUEUE_STATUS_TTL_S", "1.0")),
+        # interactive: prepend to InvokeAI's queue; batch: append. Requests/presets may override.
+        default_priority=os.getenv("SHIM_DEFAULT_PRIORITY", "interactive").strip().lower(),
+        # Async jobs keep their result (base64 PNGs, in memory) this long after finishing.
+        job_ttl_s=float(os.getenv("SHIM_JOB_TTL_S", "3600")),
+        max_jobs=int(os.getenv("SHIM_MAX_JOBS", "256")),
+        # Hold requests for another model up to this long so InvokeAI finishes the current model's
+        # work first (fewer VRAM swaps). 0 dispatches immediately.
+        affinity_max_wait_s=float(os.getenv("SHIM_AFFINITY_MAX_WAIT_S", "3")),
+        # Presets to load into InvokeAI at startup with a tiny generation ("*" = all presets).
+        warmup_presets=tuple(
+            p.strip().lower() for p in os.getenv("SHIM_WARMUP_PRESETS", "").split(",") if p.strip()
+        ),
+        warmup_size=os.getenv("SHIM_WARMUP_SIZE", "512x512"),
+        warmup_steps=int(os.getenv("SHIM_WARMUP_STEPS", "1")),
+        # Re-warm a warm-up preset whose model has been idle this long (0 = warm at startup only).
+        keep_warm_idle_s=float(os.getenv("SHIM_KEEP_WARM_IDLE_S", "900")),
+        # Additional InvokeAI instances to balance across (INVOKEAI_BASE_URL is always the first).
+        upstream_urls=tuple(
+            u.strip().rstrip("/") for u in os.getenv("SHIM_UPSTREAMS", "").split(",") if u.strip()
+        ),
+        hosts_yaml_path=os.getenv("SHIM_HOSTS_YAML") or None,
+        upstream_health_interval_s=float(os.getenv("SHIM_UPSTREAM_HEALTH_INTERVAL_S", "10")),
+        # Output encoding when the request/preset doesn't say (png = InvokeAI's bytes, untouched).
+        default_output_format=os.getenv("SHIM_DEFAULT_OUTPUT_FORMAT", "png").strip().lower(),
+        output_quality=int(os.getenv("SHIM_OUTPUT_QUALITY", "90")),
+        # Threads that re-encode and base64 outputs, off the event loop.
+        encode_workers=int(os.getenv("SHIM_ENCODE_WORKERS", "4")),
+        # What to do with delivered images in InvokeAI's gallery: off | delete | board (move to SHIM_GALLERY_BOARD).
+        gallery_cleanup=os.getenv("SHIM_GALLERY_CLEANUP", "off").strip().lower(),
+        gallery_retention_s=float(os.getenv("SHIM_GALLERY_RETENTION_S", "600")),
+        gallery_board=os.getenv("SHIM_GALLERY_BOARD", "openai-images-shim").strip(),
+        gallery_cleanup_batch=int(os.getenv("SHIM_GALLERY_CLEANUP_BATCH", "50")),
+        # /readyz probes inline once the background probe's last result is older than this.
+        ready_max_age_s=float(os.getenv("SHIM_READY_MAX_AGE_S", "60")),
     )
 
 
+_LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class _Metrics:
+    """Tiny in-process metrics registry rendered in the Prometheus text format (0.0.4).
+
+    Counters and histograms only; gauges are sampled from live state at scrape time. Kept
+    in-file so the shim stays a single copyable module without a client library.
+    """
+
+    TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}
+        self._counters: Dict[str, Dict[_LabelSet, float]] = {}
+        # name -> labels -> [bucket counts..., sum, count]
+        self._histograms: Dict[str, Dict[_LabelSet, List[float]]] = {}
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._meta[name] = ("counter", help_text, ())
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = TIME_BUCKETS) -> None:
+        self._meta[name] = ("histogram", help_text, buckets)
+        self._histograms.setdefault(name, {})
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        buckets = self._meta[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms[name]
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0.0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @staticmethod
+    def _fmt_labels(labels: _LabelSet, extra: Optional[Tuple[str, str]] = None) -> str:
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ""
+        def _escape(value: str) -> str:
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in items) + "}"
+
+    @staticmethod
+    def _fmt_value(value: float) -> str:
+        return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+    def render(self, gauges: List[Tuple[str, str, float]]) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in sorted(self._meta.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for labels, value in sorted(self._counters[name].items()):
+                        lines.append(f"{name}{self._fmt_labels(labels)} {self._fmt_value(value)}")
+                    continue
+                for labels, state in sorted(self._histograms[name].items()):
+                    for bound, count in zip(buckets, state):
+                        lines.append(f"{name}_bucket{self._fmt_labels(labels, ('le', repr(float(bound))))} {int(count)}")
+                    lines.append(f"{name}_bucket{self._fmt_labels(labels, ('le', '+Inf'))} {int(state[-1])}")
+                    lines.append(f"{name}_sum{self._fmt_labels(labels)} {self._fmt_value(state[-2])}")
+                    lines.append(f"{name}_count{self._fmt_labels(labels)} {int(state[-1])}")
+        for name, help_text, value in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {self._fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+_METRICS = _Metrics()
+_METRICS.histogram(
+    "shim_phase_seconds",
+    "Time spent per generation phase (template, model_resolution, openapi_discovery, affinity_wait, admission, enqueue, "
+    "queue_wait, execution, completion_detect, download, encode).",
+)
+_METRICS.histogram("shim_generation_seconds", "End-to-end /v1/images/generations latency by outcome.")
+_METRICS.counter("shim_generations_total", "Finished /v1/images/generations requests by outcome.")
+_METRICS.counter("shim_upstream_probe_misses_total", "Upstream candidate routes that missed (404/405), per operation.")
+_METRICS.counter("shim_upstream_failovers_total", "Generations retried on another upstream after theirs stopped answering.")
+_METRICS.counter("shim_gallery_cleanup_total", "Delivered images deleted or moved out of InvokeAI's gallery.")
+_METRICS.counter("shim_model_swaps_total", "Dispatches to InvokeAI whose model differs from the previous dispatch.")
+_METRICS.counter("shim_cache_lookups_total", "Cache lookups by cache (openapi, template, model_resolution, result) and result.")
+_METRICS.histogram(
+    "shim_invokeai_queue_depth",
+    "InvokeAI pending + in-progress queue items seen at admission.",
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+# Labels for metrics recorded while serving a generation (set once the preset/model is known).
+_METRIC_LABELS: "contextvars.ContextVar[Dict[str, str]]" = contextvars.ContextVar(
+    "shim_metric_labels", default={"preset": "", "model": ""}
+)
+
+
+def _labels(**extra: str) -> Dict[str, str]:
+    return {**_METRIC_LABELS.get(), **extra}
+
+
+@contextlib.contextmanager
+def _phase(name: str) -> Any:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _METRICS.observe("shim_phase_seconds", time.perf_counter() - start, **_labels(phase=name))
+
+
+def _cache_lookup(cache: str, hit: bool) -> None:
+    _METRICS.inc("shim_cache_lookups_total", **_labels(cache=cache, result="hit" if hit else "miss"))
+
+
 def _is_not_found(exc: HTTPException) -> bool:
     # _http_json formats 404s as: "Upstream HTTP error 404 calling <url>: <body>"
     try:
@@ -180,6 +449,30 @@ def _is_not_found(exc: HTTPException) -> bool:
         return False
 
 
+def _is_unknown_route(cfg: ShimConfig, method: str, path: str, exc: HTTPException) -> bool:
+    """Whether a learned route's miss means the route itself is gone, not just the resource it named.
+
+    FastAPI answers an unknown path with `{"detail": "Not Found"}`; a handler that can't find its
+    item or image usually says so in its own words. InvokeAI also raises a bare 404 for a missing
+    image, so a plain "Not Found" on a path the (cached) OpenAPI schema still lists is a resource miss.
+    """
+    detail = str(exc.detail)
+    if "HTTP error 404" not in detail:
+        return True
+    try:
+        body = json.loads(detail.partition(": ")[2])
+    except ValueError:
+        # Not FastAPI at all (e.g. a proxy's HTML page): the path isn't served.
+        return True
+    if not (isinstance(body, dict) and body.get("detail") == "Not Found"):
+        return False
+    entry = _SCHEMA_CACHE.peek(cfg.invokeai_base_url)
+    paths = (entry.schema or {}).get("paths") if entry is not None else None
+    # Schema keys carry no query string (candidates like "/api/v1/boards/?all=true" do).
+    route = urllib.parse.urlsplit(path).path
+    return not (isinstance(paths, dict) and method.lower() in (paths.get(route) or {}))
+
+
 def _is_probe_miss(exc: HTTPException) -> bool:
     # Treat 404/405 as "keep trying" when probing candidate endpoints.
     try:
@@ -189,7 +482,7 @@ def _is_probe_miss(exc: HTTPException) -> bool:
         return False
 
 
-def _fetch_openapi_schema(base_url: str) -> Optional[dict]:
+async def _fetch_openapi_schema(base_url: str) -> Optional[dict]:
     schema_urls = (
         f"{base_url}/openapi.json",
         f"{base_url}/api/v1/openapi.json",
@@ -199,7 +492,7 @@ def _fetch_openapi_schema(base_url: str) -> Optional[dict]:
     )
     for schema_url in schema_urls:
         try:
-            out = _http_json("GET", schema_url, payload=None, timeout=10)
+            out = await _http_json("GET", schema_url, payload=None, timeout=10)
         except HTTPException as exc:
             if _is_probe_miss(exc):
                 continue
@@ -209,18 +502,12 @@ def _fetch_openapi_schema(base_url: str) -> Optional[dict]:
     return None
 
 
-def _invokeai_queue_prefers_flat_inputs(base_url: str) -> Optional[bool]:
-    """Best-effort detection from OpenAPI: does an invocation schema include an `inputs` property?
+def _schema_prefers_flat_inputs(schema: dict) -> bool:
+    """Heuristic over an OpenAPI schema: does an invocation schema include an `inputs` property?
 
-    Returns:
-      - False if we see an invocation-like schema with an `inputs` property (prefer wrapper)
-      - True if we don't (assume flat)
-      - None if schema couldn't be fetched
+    Returns False if we see an invocation-like schema with an `inputs` property (prefer wrapper),
+    True otherwise (assume flat).
     """
-    schema = _fetch_openapi_schema(base_url)
-    if not isinstance(schema, dict):
-        return None
-
     components = schema.get("components")
     if not isinstance(components, dict):
         return True
@@ -242,6 +529,159 @@ def _invokeai_queue_prefers_flat_inputs(base_url: str) -> Optional[bool]:
     return True
 
 
+def _schema_enqueue_paths(schema: dict) -> List[Tuple[str, str]]:
+    """Return ranked (method, path template) pairs for enqueue endpoints in an OpenAPI schema."""
+    paths = schema.get("paths")
+    if not isinstance(paths, dict):
+        return []
+
+    discovered: List[Tuple[str, str]] = []
+    for path, ops in paths.items():
+        if not isinstance(path, str) or not path:
+            continue
+        if "enqueue" not in path.lower():
+            continue
+        if not isinstance(ops, dict):
+            continue
+        for method in ("post", "put", "patch"):
+            if method in ops:
+                discovered.append((method.upper(), path))
+
+    # Prefer v2-like paths and enqueue_batch first.
+    def _rank(item: Tuple[str, str]) -> Tuple[int, int, int, str]:
+        method, path = item
+        p = path.lower()
+        return (
+            0 if "/api/v2/" in p else 1,
+            0 if "enqueue_batch" in p else 1,
+            0 if method == "POST" else 1,
+            path,
+        )
+
+    return sorted(discovered, key=_rank)
+
+
+@dataclass(frozen=True)
+class _SchemaCacheEntry:
+    schema: Optional[dict]
+    fetched_at: float
+    expires_at: float
+    # Derived once per fetch so the request path never walks the schema.
+    prefers_flat_inputs: Optional[bool]
+    enqueue_paths: Tuple[Tuple[str, str], ...]
+
+
+class _OpenAPISchemaCache:
+    """Process-wide TTL cache of the upstream OpenAPI schema (keyed by base URL).
+
+    - Cold lookups fetch inline; concurrent cold lookups share one fetch.
+    - Expired entries keep being served while a background task refreshes them.
+    - A failed refresh keeps the previous schema and retries after a short back-off.
+    - `invalidate()` drops an entry, e.g. when a discovered endpoint starts returning 404.
+    """
+
+    _MISS_TTL_S = 30.0
+
+    def __init__(self) -> None:
+        self._fetch_lock = asyncio.Lock()
+        self._entries: Dict[str, _SchemaCacheEntry] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    async def _fetch(self, base_url: str, ttl_s: float) -> _SchemaCacheEntry:
+        schema = await _fetch_openapi_schema(base_url)
+        now = time.time()
+        if isinstance(schema, dict):
+            entry = _SchemaCacheEntry(
+                schema=schema,
+                fetched_at=now,
+                expires_at=now + ttl_s,
+                prefers_flat_inputs=_schema_prefers_flat_inputs(schema),
+                enqueue_paths=tuple(_schema_enqueue_paths(schema)),
+            )
+        else:
+            prior = self._entries.get(base_url)
+            retry_at = now + min(ttl_s, self._MISS_TTL_S)
+            if prior is not None and prior.schema is not None:
+                entry = dataclasses.replace(prior, expires_at=retry_at)
+            else:
+                entry = _SchemaCacheEntry(
+                    schema=None,
+                    fetched_at=now,
+                    expires_at=retry_at,
+                    prefers_flat_inputs=None,
+                    enqueue_paths=(),
+                )
+        self._entries[base_url] = entry
+        return entry
+
+    async def _refresh_unless_replaced(
+        self, base_url: str, seen: Optional[_SchemaCacheEntry], ttl_s: float
+    ) -> _SchemaCacheEntry:
+        async with self._fetch_lock:
+            # Another task may have replaced the entry while we waited for the fetch lock.
+            current = self._entries.get(base_url)
+            if current is not None and current is not seen:
+                return current
+            return await self._fetch(base_url, ttl_s)
+
+    def _refresh_in_background(self, base_url: str, seen: _SchemaCacheEntry, ttl_s: float) -> None:
+        if base_url in self._refreshing:
+            return
+
+        async def _run() -> None:
+            try:
+                await self._refresh_unless_replaced(base_url, seen, ttl_s)
+            except Exception:
+                logger.exception("Background OpenAPI schema refresh failed for %s", base_url)
+            finally:
+                self._refreshing.pop(base_url, None)
+
+        self._refreshing[base_url] = asyncio.create_task(_run())
+
+    async def get(self, base_url: str, *, ttl_s: float) -> _SchemaCacheEntry:
+        entry = self._entries.get(base_url)
+        if entry is None:
+            return await self._refresh_unless_replaced(base_url, None, ttl_s)
+        if time.time() >= entry.expires_at:
+            if entry.schema is None:
+                # Nothing useful to serve; retry inline.
+                return await self._refresh_unless_replaced(base_url, entry, ttl_s)
+            self._refresh_in_background(base_url, entry, ttl_s)
+        return entry
+
+    async def refresh(self, base_url: str, *, ttl_s: float) -> _SchemaCacheEntry:
+        async with self._fetch_lock:
+            return await self._fetch(base_url, ttl_s)
+
+    def peek(self, base_url: str) -> Optional[_SchemaCacheEntry]:
+        return self._entries.get(base_url)
+
+    def invalidate(self, base_url: str) -> None:
+        if self._entries.pop(base_url, None) is not None:
+            logger.info("Invalidated cached OpenAPI schema for %s", base_url)
+
+
+_SCHEMA_CACHE = _OpenAPISchemaCache()
+
+
+async def _cached_openapi(cfg: ShimConfig) -> _SchemaCacheEntry:
+    entry = _SCHEMA_CACHE.peek(cfg.invokeai_base_url)
+    _cache_lookup("openapi", entry is not None and entry.schema is not None)
+    with _phase("openapi_discovery"):
+        return await _SCHEMA_CACHE.get(cfg.invokeai_base_url, ttl_s=cfg.openapi_cache_ttl_s)
+
+
+async def _invokeai_queue_prefers_flat_inputs(cfg: ShimConfig) -> Optional[bool]:
+    """Best-effort detection from (cached) OpenAPI: does an invocation schema include an `inputs` property?
+
+    Returns:
+      - False if we see an invocation-like schema with an `inputs` property (prefer wrapper)
+      - True if we don't (assume flat)
+      - None if schema couldn't be fetched
+    """
+    return (await _cached_openapi(cfg)).prefers_flat_inputs
+
+
 def _strip_legacy_board_fields(obj: Any) -> None:
     """Strip legacy `board: "auto"` fields that fail strict queue validation.
 
@@ -267,49 +707,20 @@ def _strip_legacy_board_fields(obj: Any) -> None:
         return
 
 
-def _discover_queue_enqueue_endpoints(base_url: str, queue_id: str) -> List[Tuple[str, str]]:
-    """Return list of (method, url) for enqueue endpoints discovered via OpenAPI."""
-    schema = _fetch_openapi_schema(base_url)
-    if not isinstance(schema, dict):
-        return []
-    paths = schema.get("paths")
-    if not isinstance(paths, dict):
-        return []
+async def _discover_queue_enqueue_endpoints(cfg: ShimConfig) -> List[Tuple[str, str]]:
+    """Return list of (method, path template) for enqueue endpoints discovered via (cached) OpenAPI.
 
+    Queue id placeholder variants are normalized to `{queue_id}` (see `_route_call`).
+    """
     discovered: List[Tuple[str, str]] = []
-    for path, ops in paths.items():
-        if not isinstance(path, str) or not path:
-            continue
-        if "enqueue" not in path.lower():
-            continue
-        if not isinstance(ops, dict):
-            continue
-        for method in ("post", "put", "patch"):
-            if method not in ops:
-                continue
-            # Fill common placeholder variants.
-            url = f"{base_url}{path}"
-            url = url.replace("{queue_id}", urllib.parse.quote(queue_id))
-            url = url.replace("{queueId}", urllib.parse.quote(queue_id))
-            url = url.replace("{queue}", urllib.parse.quote(queue_id))
-            discovered.append((method.upper(), url))
-
-    # Prefer v2-like paths and enqueue_batch first.
-    def _rank(item: Tuple[str, str]) -> Tuple[int, int, int, str]:
-        method, url = item
-        u = url.lower()
-        return (
-            0 if "/api/v2/" in u else 1,
-            0 if "enqueue_batch" in u else 1,
-            0 if method == "POST" else 1,
-            url,
-        )
-
-    return sorted(discovered, key=_rank)
+    for method, path in (await _cached_openapi(cfg)).enqueue_paths:
+        path = path.replace("{queueId}", "{queue_id}").replace("{queue}", "{queue_id}")
+        discovered.append((method, path))
+    return discovered
 
 
 @app.on_event("startup")
-def _log_startup() -> None:
+async def _log_startup() -> None:
     cfg = _get_config()
     logger.info(
         "Shim startup build=%s mode=%s graph=%s output_node=%s debug_graph=%s save_last_image=%s model_mode=%s graph_inputs=%s",
@@ -323,6 +734,25 @@ def _log_startup() -> None:
         cfg.graph_inputs_format,
     )
 
+    if cfg.mode == "invokeai_queue":
+        # Warm the schema cache so the first image request doesn't pay for discovery.
+        _spawn(_SCHEMA_CACHE.refresh(cfg.invokeai_base_url, ttl_s=cfg.openapi_cache_ttl_s), name="openapi-prime")
+        _spawn(_MODELS.refresh(cfg), name="models-prime")
+        _upstream(cfg).events.start(cfg)
+        _spawn(_POOL.run(), name="upstream-health")
+        _spawn(_WARMER.run(), name="keep-warm")
+        _spawn(_JANITOR.run(), name="gallery-cleanup")
+
+
+@app.on_event("shutdown")
+async def _close_http_client() -> None:
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+    if _ENCODE_POOL is not None:
+        _ENCODE_POOL.shutdown(wait=False)
+
 
 def _best_effort_write_last_image(image_bytes: bytes, path: str) -> None:
     try:
@@ -338,6 +768,11 @@ def _best_effort_write_last_image(image_bytes: bytes, path: str) -> None:
         logger.exception("Failed to write SHIM_SAVE_LAST_IMAGE_PATH=%s", path)
 
 
+def _write_json(path: str, obj: Any) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+
+
 # 1x1 PNG (transparent)
 _STUB_PNG_B64 = (
     "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mP8/x8AAwMB"
@@ -358,37 +793,499 @@ def _parse_size(size: Optional[str]) -> Tuple[int, int]:
         raise HTTPException(status_code=400, detail=f"Invalid size '{size}' (expected WxH): {e}")
 
 
-def _http_json(method: str, url: str, payload: Optional[dict] = None, timeout: float = 30) -> Any:
-    data = None
-    headers = {"Accept": "application/json"}
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-        headers["Content-Type"] = "application/json"
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+_BACKGROUND_TASKS: set = set()
+
+
+def _spawn(coro: Awaitable[Any], *, name: str) -> "asyncio.Task[Any]":
+    """Run a fire-and-forget coroutine, keeping a reference so it isn't garbage collected mid-flight."""
+    task = asyncio.ensure_future(coro)
+
+    def _done(t: "asyncio.Task[Any]") -> None:
+        _BACKGROUND_TASKS.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logger.error("Background task %s failed", name, exc_info=t.exception())
+
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_done)
+    return task
+
+
+def _http_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for all upstream calls (created on first use)."""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        cfg = _get_config()
+        _HTTP_CLIENT = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=cfg.http_max_connections,
+                max_keepalive_connections=cfg.http_max_keepalive,
+            ),
+            timeout=httpx.Timeout(30, connect=cfg.http_connect_timeout_s),
+            # urllib followed redirects (e.g. /api/v1/models -> /api/v1/models/); keep that behavior.
+            follow_redirects=True,
+        )
+    return _HTTP_CLIENT
+
+
+def _op_timeout(timeout: float) -> httpx.Timeout:
+    return httpx.Timeout(timeout, connect=min(timeout, _get_config().http_connect_timeout_s))
+
 
-    req = urllib.request.Request(url, data=data, method=method.upper(), headers=headers)
+async def _http_request(method: str, url: str, *, payload: Optional[dict], timeout: float, accept: str) -> bytes:
+    headers = {"Accept": accept}
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            body = resp.read()
-            if not body:
-                return None
-            return json.loads(body)
-    except urllib.error.HTTPError as e:
-        raw = e.read().decode("utf-8", errors="replace") if hasattr(e, "read") else ""
-        raise HTTPException(status_code=502, detail=f"Upstream HTTP error {e.code} calling {url}: {raw}")
-    except urllib.error.URLError as e:
-        raise HTTPException(status_code=502, detail=f"Upstream URL error calling {url}: {e}")
+        resp = await _http_client().request(
+            method.upper(),
+            url,
+            json=payload,
+            headers=headers,
+            timeout=_op_timeout(timeout),
+        )
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Upstream URL error calling {url}: {e!r}")
+    if resp.status_code >= 400:
+        raise HTTPException(
+            status_code=502,
+            detail=f"Upstream HTTP error {resp.status_code} calling {url}: {resp.text}",
+        )
+    return resp.content
+
+
+async def _http_json(method: str, url: str, payload: Optional[dict] = None, timeout: float = 30) -> Any:
+    body = await _http_request(method, url, payload=payload, timeout=timeout, accept="application/json")
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=f"Upstream returned invalid JSON calling {url}: {e}")
+
+
+async def _http_bytes(url: str, timeout: float = 30) -> bytes:
+    return await _http_request("GET", url, payload=None, timeout=timeout, accept="*/*")
 
 
-def _http_bytes(url: str, timeout: float = 30) -> bytes:
-    req = urllib.request.Request(url, method="GET")
+async def _http_stream(url: str, timeout: float = 30) -> httpx.Response:
+    """GET `url` leaving the body unread; the caller streams it and must `aclose()` the response."""
+    client = _http_client()
+    request = client.build_request("GET", url, headers={"Accept": "*/*"}, timeout=_op_timeout(timeout))
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            return resp.read()
-    except urllib.error.HTTPError as e:
-        raw = e.read().decode("utf-8", errors="replace") if hasattr(e, "read") else ""
-        raise HTTPException(status_code=502, detail=f"Upstream HTTP error {e.code} calling {url}: {raw}")
-    except urllib.error.URLError as e:
-        raise HTTPException(status_code=502, detail=f"Upstream URL error calling {url}: {e}")
+        resp = await client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Upstream URL error calling {url}: {e!r}")
+    if resp.status_code >= 400:
+        body = await resp.aread()
+        await resp.aclose()
+        raise HTTPException(
+            status_code=502,
+            detail=f"Upstream HTTP error {resp.status_code} calling {url}: {body.decode('utf-8', 'replace')}",
+        )
+    return resp
+
+
+# Candidate upstream routes per operation, as (method, path template) pairs.
+# Templates are filled by `_route_call`; the first candidate that answers is learned.
+_ENQUEUE_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("POST", "/api/v2/queue/{queue_id}/enqueue_batch"),
+    ("POST", "/api/v2/queue/{queue_id}/enqueue"),
+    ("POST", "/api/v1/queue/{queue_id}/enqueue_batch"),
+    ("POST", "/api/v1/queue/{queue_id}/enqueue"),
+)
+_QUEUE_ITEM_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("GET", "/api/v2/queue/{queue_id}/i/{item_id}"),
+    ("GET", "/api/v2/queue/{queue_id}/items/{item_id}"),
+    ("GET", "/api/v1/queue/{queue_id}/i/{item_id}"),
+    ("GET", "/api/v1/queue/{queue_id}/items/{item_id}"),
+)
+_IMAGE_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("GET", "/api/v1/images/i/{image_name}/full"),
+    ("GET", "/api/v1/images/i/{image_name}"),
+)
+_VERSION_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("GET", "/api/v1/app/version"),
+    ("GET", "/api/v1/version"),
+    ("GET", "/api/v1/app"),
+)
+_DELETE_IMAGES_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("POST", "/api/v1/images/delete"),
+)
+_BOARDS_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("GET", "/api/v1/boards/?all=true"),
+)
+_CREATE_BOARD_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("POST", "/api/v1/boards/?board_name={board_name}"),
+)
+_BOARD_IMAGES_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("POST", "/api/v1/board_images/batch"),
+)
+_CANCEL_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("PUT", "/api/v2/queue/{queue_id}/i/{item_id}/cancel"),
+    ("PUT", "/api/v1/queue/{queue_id}/i/{item_id}/cancel"),
+    ("PUT", "/api/v1/queue/{queue_id}/items/{item_id}/cancel"),
+)
+_QUEUE_STATUS_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("GET", "/api/v2/queue/{queue_id}/status"),
+    ("GET", "/api/v1/queue/{queue_id}/status"),
+)
+_MODELS_ROUTES: Tuple[Tuple[str, str], ...] = (
+    ("GET", "/api/v1/models"),
+    ("GET", "/api/v1/model/list"),
+    ("GET", "/api/v1/model"),
+    ("GET", "/api/v1/models/list"),
+)
+
+
+class _RouteTable:
+    """Per-upstream record of which candidate route answered each operation.
+
+    Shape on disk (and in memory):
+      {"<base_url>": {"<operation>": {"method": "GET", "path": "/api/v1/...", "learned_at": 123.0}}}
+
+    Persistence is best-effort: a missing/unwritable file only costs a re-probe after restart.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # Serializes writers; each writes the latest table.
+        self._save_lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._path: Optional[str] = None
+        self._loaded = False
+
+    async def _ensure_loaded(self, path: Optional[str]) -> None:
+        # File I/O stays off the event loop; only the first lookup (or a changed path) reads.
+        if not (self._loaded and self._path == path):
+            await asyncio.to_thread(self._load, path)
+
+    def _load(self, path: Optional[str]) -> None:
+        with self._lock:
+            if not (self._loaded and self._path == path):
+                self._read(path)
+
+    def _read(self, path: Optional[str]) -> None:
+        # Caller holds the lock.
+        self._loaded = True
+        self._path = path
+        self._routes = {}
+        if not path:
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                obj = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception:
+            logger.warning("Ignoring unreadable route table %s", path)
+            return
+        if not isinstance(obj, dict):
+            return
+        for base_url, ops in obj.items():
+            if not isinstance(base_url, str) or not isinstance(ops, dict):
+                continue
+            for op, route in ops.items():
+                if (
+                    isinstance(op, str)
+                    and isinstance(route, dict)
+                    and isinstance(route.get("method"), str)
+                    and isinstance(route.get("path"), str)
+                ):
+                    self._routes.setdefault(base_url, {})[op] = dict(route)
+        logger.info("Loaded learned upstream routes from %s", path)
+
+    def _save(self) -> None:
+        # Runs on a worker thread (see learn/forget).
+        with self._save_lock:
+            with self._lock:
+                path = self._path
+                data = json.dumps(self._routes, indent=2, sort_keys=True)
+            if not path:
+                return
+            try:
+                parent = os.path.dirname(path)
+                if parent:
+                    os.makedirs(parent, exist_ok=True)
+                tmp_path = f"{path}.tmp.{os.getpid()}"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                logger.warning("Failed to persist route table to %s", path, exc_info=True)
+
+    async def get(self, cfg: ShimConfig, op: str) -> Optional[Tuple[str, str]]:
+        await self._ensure_loaded(cfg.route_table_path)
+        with self._lock:
+            route = self._routes.get(cfg.invokeai_base_url, {}).get(op)
+            if route is None:
+                return None
+            return (route["method"], route["path"])
+
+    async def learn(self, cfg: ShimConfig, op: str, method: str, path: str) -> None:
+        await self._ensure_loaded(cfg.route_table_path)
+        with self._lock:
+            ops = self._routes.setdefault(cfg.invokeai_base_url, {})
+            current = ops.get(op)
+            if current is not None and current.get("method") == method and current.get("path") == path:
+                return
+            ops[op] = {"method": method, "path": path, "learned_at": time.time()}
+        await asyncio.to_thread(self._save)
+        logger.info("Learned InvokeAI route %s -> %s %s", op, method, path)
+
+    async def forget(self, cfg: ShimConfig, op: str) -> None:
+        await self._ensure_loaded(cfg.route_table_path)
+        with self._lock:
+            if self._routes.get(cfg.invokeai_base_url, {}).pop(op, None) is None:
+                return
+        await asyncio.to_thread(self._save)
+        logger.info("Forgot InvokeAI route %s; re-probing", op)
+
+    async def snapshot(self, cfg: ShimConfig) -> Dict[str, str]:
+        await self._ensure_loaded(cfg.route_table_path)
+        with self._lock:
+            ops = self._routes.get(cfg.invokeai_base_url, {})
+            return {op: f"{r['method']} {r['path']}" for op, r in sorted(ops.items())}
+
+
+_ROUTES = _RouteTable()
+
+_T = TypeVar("_T")
+
+
+async def _aiter_sync(items: Iterable[Any]) -> Any:
+    for item in items:
+        yield item
+
+
+async def _route_call(
+    cfg: ShimConfig,
+    op: str,
+    candidates: Callable[[], Any],
+    call: Callable[[str, str], Awaitable[Optional[_T]]],
+    *,
+    params: Optional[Dict[str, str]] = None,
+    is_miss: Callable[[HTTPException], bool] = _is_probe_miss,
+    on_relearn: Optional[Callable[[], None]] = None,
+) -> Tuple[Optional[_T], Optional[HTTPException]]:
+    """Call an upstream operation via its learned route, probing candidates only when needed.
+
+    `call(method, url)` awaits a result, or None to mean "answered, but not usefully; keep probing".
+    HTTP errors matching `is_miss` also keep probing; anything else propagates. A learned route is
+    only forgotten when its miss looks like an unknown path (see `_is_unknown_route`); a 404 for a
+    missing resource is returned as `last_miss` without re-probing.
+    `candidates()` (a sync or async iterable) is only evaluated when there is no learned route or the learned route misses
+    (`on_relearn` runs in the latter case, e.g. to drop stale discovery caches).
+
+    Returns (result, last_miss). result is None when every candidate missed.
+    """
+    fill = {"{queue_id}": cfg.queue_id, **{f"{{{k}}}": v for k, v in (params or {}).items()}}
+
+    def _url(path: str) -> str:
+        for placeholder, value in fill.items():
+            path = path.replace(placeholder, urllib.parse.quote(str(value)))
+        return f"{cfg.invokeai_base_url}{path}"
+
+    last_miss: Optional[HTTPException] = None
+    learned = await _ROUTES.get(cfg, op)
+    if learned is not None:
+        method, path = learned
+        try:
+            result = await call(method, _url(path))
+        except HTTPException as exc:
+            if not is_miss(exc):
+                raise
+            if not _is_unknown_route(cfg, method, path, exc):
+                # The route answered; only the item/image it names is missing. Keep it learned.
+                return (None, exc)
+            _METRICS.inc("shim_upstream_probe_misses_total", **_labels(op=op))
+            last_miss = exc
+            result = None
+        if result is not None:
+            return (result, None)
+        await _ROUTES.forget(cfg, op)
+        if on_relearn is not None:
+            on_relearn()
+
+    seen = {learned} if learned is not None else set()
+    pending = candidates()
+    if not hasattr(pending, "__aiter__"):
+        pending = _aiter_sync(pending)
+    async for method, path in pending:
+        if (method, path) in seen:
+            continue
+        seen.add((method, path))
+        try:
+            result = await call(method, _url(path))
+        except HTTPException as exc:
+            if not is_miss(exc):
+                raise
+            _METRICS.inc("shim_upstream_probe_misses_total", **_labels(op=op))
+            last_miss = exc
+            continue
+        if result is not None:
+            await _ROUTES.learn(cfg, op, method, path)
+            return (result, None)
+
+    return (None, last_miss)
+
+
+class _QueueEventHub:
+    """One shared subscription to InvokeAI's queue event stream, fanned out to waiting requests.
+
+    InvokeAI publishes `queue_item_status_changed` over socket.io to subscribers of a queue.
+    Requests call `wait(item_id, ...)`, which returns as soon as that item reaches a terminal
+    status. Recently finished items are remembered so a job that completes before its request
+    starts waiting is not missed. Callers still confirm the status via the queue item API.
+
+    Async jobs additionally `listen(item_id, ...)` for status changes and denoise progress
+    (`invocation_progress`, or `invocation_denoise_progress` on older InvokeAI), including the
+    low-resolution step preview.
+    """
+
+    _TERMINAL = {"completed", "failed", "canceled"}
+    _RECENT_MAX = 2048
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = {}
+        self._listeners: Dict[str, Tuple[asyncio.AbstractEventLoop, Callable[[Dict[str, Any]], None]]] = {}
+        self._recent: "OrderedDict[str, str]" = OrderedDict()
+        self._started = False
+        self._connected = False
+        self._queue_id: Optional[str] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def state(self, cfg: ShimConfig) -> str:
+        if cfg.queue_events == "off":
+            return "off"
+        if socketio is None:
+            return "unavailable"
+        return "connected" if self._connected else "disconnected"
+
+    def start(self, cfg: ShimConfig) -> None:
+        if cfg.queue_events == "off" or socketio is None:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._queue_id = cfg.queue_id
+        threading.Thread(target=self._run, args=(cfg,), name="shim-queue-events", daemon=True).start()
+
+    def _run(self, cfg: ShimConfig) -> None:
+        delay = 1.0
+        while True:
+            client = socketio.Client(reconnection=True, handle_sigint=False)
+
+            def _on_connect() -> None:
+                self._connected = True
+                client.emit("subscribe_queue", {"queue_id": cfg.queue_id})
+                logger.info("Subscribed to InvokeAI queue events (queue_id=%s)", cfg.queue_id)
+
+            def _on_disconnect(*_: Any) -> None:
+                self._connected = False
+                logger.info("InvokeAI queue event stream disconnected; polling until it returns")
+
+            client.on("connect", _on_connect)
+            client.on("disconnect", _on_disconnect)
+            client.on("queue_item_status_changed", self._on_status_changed)
+            client.on("invocation_progress", self._on_progress)
+            client.on("invocation_denoise_progress", self._on_progress)
+            try:
+                client.connect(cfg.invokeai_base_url, socketio_path=cfg.events_path, wait_timeout=5)
+            except Exception as exc:
+                logger.info("InvokeAI queue events unavailable (%s); retrying in %.0fs", exc, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 60.0)
+                continue
+            delay = 1.0
+            # Returns once the client gives up reconnecting.
+            client.wait()
+            self._connected = False
+
+    def _on_status_changed(self, data: Any) -> None:
+        # Runs on the socket.io client thread; waiters live on the event loop.
+        if not isinstance(data, dict):
+            return
+        if data.get("queue_id") not in (None, self._queue_id):
+            return
+        status = data.get("status")
+        item_id = data.get("item_id")
+        if not isinstance(item_id, (int, str)):
+            return
+        key = str(item_id)
+        self._notify(key, {"type": "status", "item_id": key, "status": status})
+        if status not in self._TERMINAL:
+            return
+        with self._lock:
+            self._recent[key] = status
+            self._recent.move_to_end(key)
+            while len(self._recent) > self._RECENT_MAX:
+                self._recent.popitem(last=False)
+            waiter = self._waiters.get(key)
+        if waiter is not None:
+            loop, event = waiter
+            loop.call_soon_threadsafe(event.set)
+
+    def _on_progress(self, data: Any) -> None:
+        if not isinstance(data, dict) or data.get("queue_id") not in (None, self._queue_id):
+            return
+        item_id = data.get("item_id", data.get("queue_item_id"))
+        if not isinstance(item_id, (int, str)):
+            return
+        image = data.get("image") or data.get("progress_image")
+        event: Dict[str, Any] = {
+            "type": "progress",
+            "item_id": str(item_id),
+            "step": data.get("step"),
+            "total_steps": data.get("total_steps"),
+            "percentage": data.get("percentage"),
+            "message": data.get("message"),
+        }
+        if isinstance(image, dict) and isinstance(image.get("dataURL"), str):
+            event["preview"] = {
+                "data_url": image["dataURL"],
+                "width": image.get("width"),
+                "height": image.get("height"),
+            }
+        self._notify(str(item_id), event)
+
+    def _notify(self, item_id: str, event: Dict[str, Any]) -> None:
+        # Runs on the socket.io client thread; listeners run on their event loop.
+        with self._lock:
+            listener = self._listeners.get(item_id)
+        if listener is not None:
+            loop, callback = listener
+            loop.call_soon_threadsafe(callback, event)
+
+    def listen(self, item_id: str, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """Forward status/progress events for `item_id` to `callback` (on the caller's loop) until `release`."""
+        with self._lock:
+            self._listeners[item_id] = (asyncio.get_running_loop(), callback)
+
+    async def wait(self, item_id: str, timeout: float) -> Optional[str]:
+        """Wait until `item_id` reaches a terminal status (returned) or the timeout passes (None)."""
+        with self._lock:
+            status = self._recent.get(item_id)
+            if status is not None:
+                return status
+            waiter = self._waiters.get(item_id)
+            if waiter is None:
+                waiter = (asyncio.get_running_loop(), asyncio.Event())
+                self._waiters[item_id] = waiter
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout=max(0.0, timeout))
+        except asyncio.TimeoutError:
+            pass
+        with self._lock:
+            return self._recent.get(item_id)
+
+    def release(self, item_id: str) -> None:
+        with self._lock:
+            self._waiters.pop(item_id, None)
+            self._listeners.pop(item_id, None)
 
 
 def _collect_model_candidates(obj: Any) -> List[dict]:
@@ -418,30 +1315,55 @@ def _collect_model_candidates(obj: Any) -> List[dict]:
     return out
 
 
-def _list_invokeai_models(*, cfg: ShimConfig) -> Tuple[Optional[str], List[dict]]:
+async def _list_invokeai_models(*, cfg: ShimConfig) -> Tuple[Optional[str], List[dict]]:
     """Best-effort list of InvokeAI models.
 
     Returns:
       (source_url, models)
     """
 
-    models_urls = (
-        f"{cfg.invokeai_base_url}/api/v1/models",
-        f"{cfg.invokeai_base_url}/api/v1/model/list",
-        f"{cfg.invokeai_base_url}/api/v1/model",
-        f"{cfg.invokeai_base_url}/api/v1/models/list",
-    )
+    # Paths advertised by the OpenAPI schema are speculative: any error there just means "try the next one".
+    schema_urls: set[str] = set()
 
-    last_error: Optional[HTTPException] = None
+    async def _candidates() -> AsyncIterator[Tuple[str, str]]:
+        for route in _MODELS_ROUTES:
+            yield route
 
-    for models_url in models_urls:
-        try:
-            out = _http_json("GET", models_url, payload=None, timeout=20)
-        except HTTPException as exc:
-            last_error = exc
-            if _is_probe_miss(exc):
+        schema = (await _cached_openapi(cfg)).schema
+        if not isinstance(schema, dict):
+            return
+        paths = schema.get("paths")
+        if not isinstance(paths, dict):
+            return
+
+        probed: List[str] = []
+        for path, ops in paths.items():
+            if not isinstance(path, str) or not path or "{" in path:
+                continue
+            if "model" not in path.lower():
+                continue
+            if not isinstance(ops, dict) or "get" not in ops:
                 continue
-            # Unexpected upstream error: bubble it up.
+            probed.append(path)
+
+        probed = sorted(
+            set(probed),
+            key=lambda p: (
+                0 if p.endswith("models") or p.endswith("models/") else 1,
+                len(p),
+                p,
+            ),
+        )
+        for path in probed[:12]:
+            schema_urls.add(f"{cfg.invokeai_base_url}{path}")
+            yield ("GET", path)
+
+    async def _fetch(method: str, url: str) -> Optional[Tuple[str, List[dict]]]:
+        try:
+            out = await _http_json(method, url, payload=None, timeout=20)
+        except HTTPException:
+            if url in schema_urls:
+                return None
             raise
 
         candidates: List[dict] = []
@@ -456,141 +1378,38 @@ def _list_invokeai_models(*, cfg: ShimConfig) -> Tuple[Optional[str], List[dict]
 
         if not candidates:
             candidates = _collect_model_candidates(out)
-        if candidates:
-            return (models_url, candidates)
-
-    schema = _fetch_openapi_schema(cfg.invokeai_base_url)
-    if not isinstance(schema, dict):
-        if last_error is not None:
-            raise last_error
-        return (None, [])
-
-    paths = schema.get("paths")
-    if not isinstance(paths, dict):
-        if last_error is not None:
-            raise last_error
-        return (None, [])
-
-    probed: List[str] = []
-    for path, ops in paths.items():
-        if not isinstance(path, str) or not path or "{" in path:
-            continue
-        if "model" not in path.lower():
-            continue
-        if not isinstance(ops, dict) or "get" not in ops:
-            continue
-        probed.append(path)
-
-    probed = sorted(
-        set(probed),
-        key=lambda p: (
-            0 if p.endswith("models") or p.endswith("models/") else 1,
-            len(p),
-            p,
-        ),
-    )
-
-    for path in probed[:12]:
-        url = f"{cfg.invokeai_base_url}{path}"
-        try:
-            out = _http_json("GET", url, payload=None, timeout=20)
-        except HTTPException as exc:
-            last_error = exc
-            if _is_probe_miss(exc):
-                continue
-            continue
-        candidates = _collect_model_candidates(out)
-        if candidates:
+        if not candidates:
+            return None
+        if url in schema_urls:
             logger.info("Discovered InvokeAI model list via %s", url)
-            return (url, candidates)
+        return (url, candidates)
 
+    found, last_error = await _route_call(cfg, "models", _candidates, _fetch)
+    if found is not None:
+        return found
     if last_error is not None:
         raise last_error
     return (None, [])
 
 
-def _resolve_model_info(model: Optional[str], *, cfg: ShimConfig) -> Optional[dict]:
-    if not model:
-        return None
+_MODEL_STRING_FIELDS = ("key", "id", "model_key", "name", "model", "model_name", "modelName")
 
-    model = model.strip()
-    if not model:
-        return None
 
-    candidates: List[dict] = []
-    last_error: Optional[HTTPException] = None
-    try:
-        _, candidates = _list_invokeai_models(cfg=cfg)
-    except HTTPException as exc:
-        last_error = exc
-        candidates = []
+def _model_strings(item: dict) -> List[str]:
+    vals: List[str] = []
+    for k in _MODEL_STRING_FIELDS:
+        v = item.get(k)
+        if isinstance(v, str) and v.strip():
+            vals.append(v.strip())
+    return vals
 
-    if not candidates:
-        # If model listing is unavailable, leave the graph template's model as-is.
-        # Some InvokeAI deployments do not expose /api/v1/models.
-        if last_error is not None:
-            logger.warning("InvokeAI model list unavailable; proceeding with template model (%s)", last_error.detail)
-        else:
-            logger.warning("InvokeAI model list unavailable; proceeding with template model")
-        return None
-
-    needle = model.strip()
-    needle_l = needle.lower()
-
-    def _strings(item: dict) -> List[str]:
-        vals: List[str] = []
-        for k in (
-            "key",
-            "id",
-            "model_key",
-            "name",
-            "model",
-            "model_name",
-            "modelName",
-        ):
-            v = item.get(k)
-            if isinstance(v, str) and v.strip():
-                vals.append(v.strip())
-        return vals
-
-    def _score(item: dict) -> int:
-        svals = _strings(item)
-        best = 0
-        for v in svals:
-            if v == needle:
-                best = max(best, 100)
-            vl = v.lower()
-            if vl == needle_l:
-                best = max(best, 90)
-            if needle_l in vl or vl in needle_l:
-                best = max(best, 60)
-        return best
-
-    match = None
-    best_score = 0
-    for m in candidates:
-        if not isinstance(m, dict):
-            continue
-        sc = _score(m)
-        if sc > best_score:
-            match = m
-            best_score = sc
 
-    if best_score < 60:
-        match = None
+def _model_substring_key(value: str) -> str:
+    # "Juggernaut XL v9", "juggernaut-xl-v9" and "juggernaut_xl_v9" all normalize to "juggernautxlv9".
+    return "".join(ch for ch in value.casefold() if ch.isalnum())
 
-    if not match:
-        # In practice, callers (e.g. the gateway) may send a model name that doesn't match
-        # InvokeAI's internal registry keys. Default behavior is best-effort: keep the
-        # template's model unchanged.
-        if cfg.strict_model:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Model '{model}' not found in InvokeAI /api/v1/models",
-            )
-        logger.warning("Requested model %r not found in InvokeAI model list; proceeding with template model", model)
-        return None
 
+def _normalize_model_match(match: dict) -> dict:
     # Normalize to the minimal shape used by workflow exports.
     normalized: Dict[str, Any] = {}
     # Prefer a stable key/id.
@@ -611,56 +1430,195 @@ def _resolve_model_info(model: Optional[str], *, cfg: ShimConfig) -> Optional[di
         v = match.get(src)
         if dst not in normalized and isinstance(v, str) and v.strip():
             normalized[dst] = v.strip()
-
-    logger.info("Resolved InvokeAI model %r -> key=%r", model, normalized.get("key"))
     return normalized or match
 
 
-def _deep_replace_placeholders(value: Any, mapping: Dict[str, str]) -> Any:
-    if isinstance(value, str):
-        for k, v in mapping.items():
-            value = value.replace(f"{{{{{k}}}}}", v)
-        return value
-    if isinstance(value, list):
-        return [_deep_replace_placeholders(v, mapping) for v in value]
-    if isinstance(value, dict):
-        return {k: _deep_replace_placeholders(v, mapping) for k, v in value.items()}
-    return value
+@dataclass(frozen=True)
+class _ModelRegistrySnapshot:
+    source_url: Optional[str]
+    models: Tuple[dict, ...]
+    error: Optional[str]
+    fetched_at: float
+    expires_at: float
+    # Lookup indexes (string -> index of the first model carrying it), built once per fetch.
+    by_exact: Dict[str, int]
+    by_casefold: Dict[str, int]
+    by_substring: Tuple[Tuple[str, int], ...]
+    # Memoized resolutions (requested name or preset model -> normalized model, None = no match).
+    resolved: Dict[str, Optional[dict]] = dataclasses.field(default_factory=dict)
+
+    _MAX_RESOLVED = 1024
+
+    @classmethod
+    def build(
+        cls, source_url: Optional[str], models: List[dict], *, error: Optional[str], fetched_at: float, expires_at: float
+    ) -> "_ModelRegistrySnapshot":
+        by_exact: Dict[str, int] = {}
+        by_casefold: Dict[str, int] = {}
+        by_substring: List[Tuple[str, int]] = []
+        for idx, m in enumerate(models):
+            for v in _model_strings(m):
+                by_exact.setdefault(v, idx)
+                by_casefold.setdefault(v.casefold(), idx)
+                norm = _model_substring_key(v)
+                if norm:
+                    by_substring.append((norm, idx))
+        return cls(
+            source_url=source_url,
+            models=tuple(models),
+            error=error,
+            fetched_at=fetched_at,
+            expires_at=expires_at,
+            by_exact=by_exact,
+            by_casefold=by_casefold,
+            by_substring=tuple(by_substring),
+        )
 
+    def lookup(self, needle: str) -> Optional[dict]:
+        """Exact key/name, then case-insensitive, then normalized substring (either direction)."""
+        _cache_lookup("model_resolution", needle in self.resolved)
+        if needle in self.resolved:
+            return self.resolved[needle]
+
+        idx = self.by_exact.get(needle)
+        if idx is None:
+            idx = self.by_casefold.get(needle.casefold())
+        if idx is None:
+            norm = _model_substring_key(needle)
+            if norm:
+                idx = next((i for v, i in self.by_substring if norm in v or v in norm), None)
+
+        match = _normalize_model_match(self.models[idx]) if idx is not None else None
+        if match is not None:
+            logger.info("Resolved InvokeAI model %r -> key=%r", needle, match.get("key"))
+        if len(self.resolved) < self._MAX_RESOLVED:
+            self.resolved[needle] = match
+        return match
+
+
+class _ModelRegistry:
+    """Process-wide TTL cache of the upstream model list (keyed by base URL).
+
+    Same refresh policy as `_OpenAPISchemaCache`: cold lookups fetch inline, expired snapshots
+    are served while a background task refreshes them, and a failed refresh keeps the previous
+    list and retries after a short back-off. A lookup miss schedules an early refresh so newly
+    installed models show up without waiting for the TTL.
+    """
 
-def _load_graph_from_template(
-    path: str,
-    *,
-    prompt: str,
-    width: int,
-    height: int,
-    seed: Optional[int],
-    model_info: Optional[dict],
-    model_input_mode: str = "dict",
-) -> dict:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            graph = json.load(f)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to load graph template '{path}': {e}")
+    _MISS_TTL_S = 30.0
 
-    mapping = {
-        "prompt": prompt,
-        "negative_prompt": "",
-    }
+    def __init__(self) -> None:
+        self._fetch_lock = asyncio.Lock()
+        self._entries: Dict[str, _ModelRegistrySnapshot] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
 
-    out = _deep_replace_placeholders(graph, mapping)
-    _apply_invokeai_workflow_overrides(
-        out,
-        prompt=prompt,
-        negative_prompt="",
-        width=width,
-        height=height,
-        seed=seed,
-        model_info=model_info,
-        model_input_mode=model_input_mode,
-    )
-    return out
+    async def _fetch(self, cfg: ShimConfig) -> _ModelRegistrySnapshot:
+        base_url = cfg.invokeai_base_url
+        source_url: Optional[str] = None
+        models: List[dict] = []
+        error: Optional[str] = None
+        try:
+            source_url, models = await _list_invokeai_models(cfg=cfg)
+        except HTTPException as exc:
+            error = str(exc.detail)
+
+        now = time.time()
+        prior = self._entries.get(base_url)
+        if models:
+            snapshot = _ModelRegistrySnapshot.build(
+                source_url, models, error=None, fetched_at=now, expires_at=now + cfg.model_cache_ttl_s
+            )
+        elif prior is not None and prior.models:
+            snapshot = dataclasses.replace(prior, error=error, expires_at=now + min(cfg.model_cache_ttl_s, self._MISS_TTL_S))
+        else:
+            snapshot = _ModelRegistrySnapshot.build(
+                source_url, [], error=error, fetched_at=now, expires_at=now + min(cfg.model_cache_ttl_s, self._MISS_TTL_S)
+            )
+        self._entries[base_url] = snapshot
+        return snapshot
+
+    async def _refresh_unless_replaced(
+        self, cfg: ShimConfig, seen: Optional[_ModelRegistrySnapshot]
+    ) -> _ModelRegistrySnapshot:
+        async with self._fetch_lock:
+            current = self._entries.get(cfg.invokeai_base_url)
+            if current is not None and current is not seen:
+                return current
+            return await self._fetch(cfg)
+
+    def _refresh_in_background(self, cfg: ShimConfig, seen: _ModelRegistrySnapshot) -> None:
+        base_url = cfg.invokeai_base_url
+        if base_url in self._refreshing:
+            return
+
+        async def _run() -> None:
+            try:
+                await self._refresh_unless_replaced(cfg, seen)
+            except Exception:
+                logger.exception("Background model list refresh failed for %s", base_url)
+            finally:
+                self._refreshing.pop(base_url, None)
+
+        self._refreshing[base_url] = asyncio.create_task(_run())
+
+    async def get(self, cfg: ShimConfig) -> _ModelRegistrySnapshot:
+        snapshot = self._entries.get(cfg.invokeai_base_url)
+        if snapshot is None:
+            return await self._refresh_unless_replaced(cfg, None)
+        if time.time() >= snapshot.expires_at:
+            if not snapshot.models:
+                return await self._refresh_unless_replaced(cfg, snapshot)
+            self._refresh_in_background(cfg, snapshot)
+        return snapshot
+
+    async def refresh(self, cfg: ShimConfig) -> _ModelRegistrySnapshot:
+        async with self._fetch_lock:
+            return await self._fetch(cfg)
+
+    def refresh_after_miss(self, cfg: ShimConfig, seen: _ModelRegistrySnapshot) -> None:
+        if time.time() - seen.fetched_at >= self._MISS_TTL_S:
+            self._refresh_in_background(cfg, seen)
+
+    def peek(self, base_url: str) -> Optional[_ModelRegistrySnapshot]:
+        return self._entries.get(base_url)
+
+
+_MODELS = _ModelRegistry()
+
+
+async def _resolve_model_info(model: Optional[str], *, cfg: ShimConfig) -> Optional[dict]:
+    if not model:
+        return None
+
+    model = model.strip()
+    if not model:
+        return None
+
+    registry = await _MODELS.get(cfg)
+    if not registry.models:
+        # If model listing is unavailable, leave the graph template's model as-is.
+        # Some InvokeAI deployments do not expose /api/v1/models.
+        if registry.error is not None:
+            logger.warning("InvokeAI model list unavailable; proceeding with template model (%s)", registry.error)
+        else:
+            logger.warning("InvokeAI model list unavailable; proceeding with template model")
+        return None
+
+    match = registry.lookup(model)
+    if match is None:
+        _MODELS.refresh_after_miss(cfg, registry)
+        # In practice, callers (e.g. the gateway) may send a model name that doesn't match
+        # InvokeAI's internal registry keys. Default behavior is best-effort: keep the
+        # template's model unchanged.
+        if cfg.strict_model:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Model '{model}' not found in InvokeAI /api/v1/models",
+            )
+        logger.warning("Requested model %r not found in InvokeAI model list; proceeding with template model", model)
+        return None
+
+    return match
 
 
 def _detect_output_node_id(graph: dict) -> Optional[str]:
@@ -698,6 +1656,48 @@ def _detect_output_node_id(graph: dict) -> Optional[str]:
     return None
 
 
+def _normalize_model_value(value: Any, model_input_mode: str) -> Any:
+    # Workflow exports usually store model selection as an object with a "key".
+    # InvokeAI queue validation (6.x) can be strict; the most compatible representation
+    # tends to be the workflow-style object: {key, hash, name, base, type}.
+    if isinstance(value, dict):
+        key = value.get("key") or value.get("id") or value.get("model_key")
+        name = value.get("name") or value.get("model") or value.get("model_name")
+        hash_v = value.get("hash")
+        base = value.get("base") or value.get("base_model")
+        typ = value.get("type") or value.get("model_type")
+        if model_input_mode == "id":
+            if isinstance(key, str) and key.strip():
+                out: Dict[str, Any] = {"key": key.strip()}
+                if isinstance(hash_v, str) and hash_v.strip():
+                    out["hash"] = hash_v.strip()
+                if isinstance(name, str) and name.strip():
+                    out["name"] = name.strip()
+                if isinstance(base, str) and base.strip():
+                    out["base"] = base.strip()
+                if isinstance(typ, str) and typ.strip():
+                    out["type"] = typ.strip()
+                return out
+            if isinstance(name, str) and name.strip():
+                # Best-effort if we cannot resolve a key.
+                return {"name": name.strip()}
+            return value
+        if model_input_mode == "name":
+            if isinstance(name, str) and name.strip():
+                return name.strip()
+            if isinstance(key, str) and key.strip():
+                return key.strip()
+            return value
+        return value
+    if isinstance(value, str):
+        vv = value.strip()
+        if model_input_mode == "id":
+            # Best-effort: treat a raw string as a key.
+            return {"key": vv} if vv else value
+        return vv if vv else value
+    return value
+
+
 def _apply_invokeai_workflow_overrides(
     graph: dict,
     *,
@@ -767,56 +1767,15 @@ def _apply_invokeai_workflow_overrides(
             _set_input_value(inputs, "high", int(seed))
             continue
 
-        def _normalize_model_value(value: Any) -> Any:
-            # Workflow exports usually store model selection as an object with a "key".
-            # InvokeAI queue validation (6.x) can be strict; the most compatible representation
-            # tends to be the workflow-style object: {key, hash, name, base, type}.
-            if isinstance(value, dict):
-                key = value.get("key") or value.get("id") or value.get("model_key")
-                name = value.get("name") or value.get("model") or value.get("model_name")
-                hash_v = value.get("hash")
-                base = value.get("base") or value.get("base_model")
-                typ = value.get("type") or value.get("model_type")
-                if model_input_mode == "id":
-                    if isinstance(key, str) and key.strip():
-                        out: Dict[str, Any] = {"key": key.strip()}
-                        if isinstance(hash_v, str) and hash_v.strip():
-                            out["hash"] = hash_v.strip()
-                        if isinstance(name, str) and name.strip():
-                            out["name"] = name.strip()
-                        if isinstance(base, str) and base.strip():
-                            out["base"] = base.strip()
-                        if isinstance(typ, str) and typ.strip():
-                            out["type"] = typ.strip()
-                        return out
-                    if isinstance(name, str) and name.strip():
-                        # Best-effort if we cannot resolve a key.
-                        return {"name": name.strip()}
-                    return value
-                if model_input_mode == "name":
-                    if isinstance(name, str) and name.strip():
-                        return name.strip()
-                    if isinstance(key, str) and key.strip():
-                        return key.strip()
-                    return value
-                return value
-            if isinstance(value, str):
-                vv = value.strip()
-                if model_input_mode == "id":
-                    # Best-effort: treat a raw string as a key.
-                    return {"key": vv} if vv else value
-                return vv if vv else value
-            return value
-
         # Ensure the model loader has a concrete model value when provided.
         if ntype in ("sdxl_model_loader", "model_loader"):
             if isinstance(model_info, dict):
-                _set_input_value(inputs, "model", _normalize_model_value(model_info))
+                _set_input_value(inputs, "model", _normalize_model_value(model_info, model_input_mode))
             else:
                 model_field = inputs.get("model") if isinstance(inputs, dict) else None
                 if isinstance(model_field, dict) and "value" in model_field:
                     value = model_field.get("value")
-                    normalized = _normalize_model_value(value)
+                    normalized = _normalize_model_value(value, model_input_mode)
                     # Always write back the normalized form so the API graph conversion sees it.
                     if normalized is not None:
                         _set_input_value(inputs, "model", normalized)
@@ -830,7 +1789,7 @@ def _apply_invokeai_workflow_overrides(
                 pass
             vae_field = inputs.get("vae_model") if isinstance(inputs, dict) else None
             if isinstance(vae_field, dict) and "value" in vae_field:
-                normalized = _normalize_model_value(vae_field.get("value"))
+                normalized = _normalize_model_value(vae_field.get("value"), model_input_mode)
                 if normalized is not None:
                     _set_input_value(inputs, "vae_model", normalized)
             continue
@@ -937,21 +1896,22 @@ def _workflow_export_to_api_graph(workflow_export: dict, *, flatten_inputs: bool
     return {"nodes": nodes_out, "edges": edges_out}
 
 
-def _ensure_invokeai_api_graph(graph: dict) -> dict:
+async def _effective_flatten_inputs(cfg: ShimConfig) -> bool:
+    """Resolve SHIM_GRAPH_INPUTS_FORMAT (auto|inputs|flat) to whether invocation inputs are flattened."""
+    mode = (cfg.graph_inputs_format or "auto").strip().lower()
+    if mode == "flat":
+        return True
+    if mode == "inputs":
+        return False
+    detected = await _invokeai_queue_prefers_flat_inputs(cfg)
+    return bool(detected) if detected is not None else False
+
+
+def _ensure_invokeai_api_graph(graph: dict, *, flatten: bool) -> dict:
     """Return a Graph suitable for InvokeAI's queue API."""
     nodes = graph.get("nodes")
     edges = graph.get("edges")
     if isinstance(nodes, dict) and isinstance(edges, list):
-        cfg = _get_config()
-        mode = (cfg.graph_inputs_format or "auto").strip().lower()
-        if mode == "flat":
-            flatten = True
-        elif mode == "inputs":
-            flatten = False
-        else:
-            detected = _invokeai_queue_prefers_flat_inputs(cfg.invokeai_base_url)
-            flatten = bool(detected) if detected is not None else False
-
         if not flatten:
             return graph
 
@@ -986,19 +1946,284 @@ def _ensure_invokeai_api_graph(graph: dict) -> dict:
         new_graph["nodes"] = new_nodes
         return new_graph
     if isinstance(nodes, list) and isinstance(edges, list):
-        cfg = _get_config()
-        mode = (cfg.graph_inputs_format or "auto").strip().lower()
-        if mode == "flat":
-            flatten = True
-        elif mode == "inputs":
-            flatten = False
-        else:
-            detected = _invokeai_queue_prefers_flat_inputs(cfg.invokeai_base_url)
-            flatten = bool(detected) if detected is not None else False
         return _workflow_export_to_api_graph(graph, flatten_inputs=flatten)
     raise HTTPException(status_code=500, detail="Graph template must be an InvokeAI API Graph or a workflow export")
 
 
+_JsonPath = Tuple[Any, ...]
+
+# Request fields that compiled templates can patch.
+_TEMPLATE_SLOTS = ("prompt", "negative_prompt", "width", "height", "seed", "steps", "cfg_scale", "scheduler", "model")
+_TEMPLATE_PLACEHOLDERS = ("prompt", "negative_prompt")
+
+
+def _workflow_slot_rules(ntype: Any, label: str) -> List[Tuple[str, str]]:
+    """(input field, slot) pairs patched per request for a workflow-export node.
+
+    Mirrors `_apply_invokeai_workflow_overrides`, which is the reference for these rules.
+    """
+    if ntype == "string" and label == "Positive Prompt":
+        return [("value", "prompt")]
+    if ntype == "string" and label == "Negative Prompt":
+        return [("value", "negative_prompt")]
+    if ntype == "sdxl_compel_prompt":
+        return [
+            ("original_width", "width"),
+            ("original_height", "height"),
+            ("target_width", "width"),
+            ("target_height", "height"),
+        ]
+    if ntype == "noise":
+        return [("width", "width"), ("height", "height"), ("seed", "seed")]
+    if ntype == "rand_int" and label == "Random Seed":
+        return [("low", "seed"), ("high", "seed")]
+    if ntype in ("sdxl_model_loader", "model_loader"):
+        return [("model", "model")]
+    if ntype == "denoise_latents":
+        return [("steps", "steps"), ("cfg_scale", "cfg_scale"), ("scheduler", "scheduler")]
+    return []
+
+
+@dataclass(frozen=True)
+class _CompiledTemplate:
+    """A graph template reduced to a ready-to-enqueue API graph plus the paths to patch per request."""
+
+    path: str
+    mtime_ns: int
+    size: int
+    # Stable identity of the compiled graph (template bytes + settings that shape the output).
+    digest: str
+    api_graph: dict
+    output_node_id: str
+    slots: Dict[str, Tuple[_JsonPath, ...]]
+    # (path, original string) for strings containing {{prompt}} / {{negative_prompt}}.
+    placeholders: Tuple[Tuple[_JsonPath, str], ...]
+    # (node_id, path to the model input) for every model loader node; used for logging + preflight.
+    model_loaders: Tuple[Tuple[str, _JsonPath], ...]
+
+    def render(
+        self,
+        *,
+        prompt: str,
+        negative_prompt: str,
+        width: int,
+        height: int,
+        seed: Optional[int],
+        steps: Optional[int],
+        cfg_scale: Optional[float],
+        scheduler: Optional[str],
+        model_info: Optional[dict],
+        model_input_mode: str,
+    ) -> dict:
+        graph = copy.deepcopy(self.api_graph)
+
+        for path, template in self.placeholders:
+            value = template.replace("{{prompt}}", prompt).replace("{{negative_prompt}}", negative_prompt or "")
+            _set_json_path(graph, path, value)
+
+        values: Dict[str, Any] = {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt or "",
+            "width": int(width),
+            "height": int(height),
+        }
+        if seed is not None:
+            values["seed"] = int(seed)
+        if steps is not None:
+            values["steps"] = int(steps)
+        if cfg_scale is not None:
+            values["cfg_scale"] = float(cfg_scale)
+        if scheduler:
+            values["scheduler"] = str(scheduler)
+        if isinstance(model_info, dict):
+            values["model"] = _normalize_model_value(model_info, model_input_mode)
+
+        for slot, value in values.items():
+            for path in self.slots.get(slot, ()):
+                _set_json_path(graph, path, copy.deepcopy(value) if isinstance(value, dict) else value)
+        return graph
+
+
+    def batch_data(self, slot: str, items: List[Any]) -> List[Dict[str, Any]]:
+        """InvokeAI batch data (zipped BatchDatum list) that varies `slot` across queue items."""
+        data: List[Dict[str, Any]] = []
+        for path in self.slots.get(slot, ()):
+            # Slot paths are ("nodes", node_id, [ "inputs", ] field).
+            data.append({"node_path": path[1], "field_name": path[-1], "items": list(items)})
+        return data
+
+
+def _set_json_path(obj: Any, path: _JsonPath, value: Any) -> None:
+    for key in path[:-1]:
+        obj = obj[key]
+    obj[path[-1]] = value
+
+
+def _get_json_path(obj: Any, path: _JsonPath) -> Any:
+    for key in path:
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def _find_placeholders(value: Any, path: _JsonPath, out: List[Tuple[_JsonPath, str]]) -> None:
+    if isinstance(value, str):
+        if any(f"{{{{{k}}}}}" in value for k in _TEMPLATE_PLACEHOLDERS):
+            out.append((path, value))
+        return
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _find_placeholders(v, path + (k,), out)
+        return
+    if isinstance(value, list):
+        for i, v in enumerate(value):
+            _find_placeholders(v, path + (i,), out)
+
+
+def _compile_graph_template(
+    path: str,
+    *,
+    mtime_ns: int,
+    size: int,
+    flatten: bool,
+    model_input_mode: str,
+    output_node_id: Optional[str],
+) -> _CompiledTemplate:
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        graph = json.loads(raw)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load graph template '{path}': {e}")
+    if not isinstance(graph, dict):
+        raise HTTPException(status_code=500, detail=f"Graph template '{path}' must be a JSON object")
+
+    # Normalize template model values once (requested models are patched in at render time).
+    _apply_invokeai_workflow_overrides(
+        graph,
+        prompt="",
+        negative_prompt="",
+        width=1024,
+        height=1024,
+        seed=None,
+        model_info=None,
+        model_input_mode=model_input_mode,
+    )
+
+    resolved_output = (output_node_id or "").strip() or _detect_output_node_id(graph)
+    if not resolved_output:
+        raise HTTPException(status_code=500, detail="SHIM_OUTPUT_NODE_ID not set and could not auto-detect output node")
+
+    # Slot rules need workflow labels, which the API graph no longer carries.
+    workflow_rules: Dict[str, List[Tuple[str, str]]] = {}
+    if isinstance(graph.get("nodes"), list):
+        for node in graph["nodes"]:
+            if not isinstance(node, dict) or not isinstance(node.get("id"), str):
+                continue
+            data = node.get("data")
+            if not isinstance(data, dict):
+                continue
+            rules = _workflow_slot_rules(data.get("type"), (data.get("label") or "").strip())
+            if rules:
+                workflow_rules[node["id"]] = rules
+
+    api_graph = _ensure_invokeai_api_graph(graph, flatten=flatten)
+    # Normalize legacy fields that break strict queue validation.
+    _strip_legacy_board_fields(api_graph)
+
+    slots: Dict[str, List[_JsonPath]] = {k: [] for k in _TEMPLATE_SLOTS}
+    model_loaders: List[Tuple[str, _JsonPath]] = []
+    nodes_api = api_graph.get("nodes")
+    if isinstance(nodes_api, dict):
+        for node_id, node in nodes_api.items():
+            if not isinstance(node, dict):
+                continue
+            inputs = node.get("inputs")
+            base: _JsonPath = ("nodes", node_id, "inputs") if isinstance(inputs, dict) else ("nodes", node_id)
+            fields = inputs if isinstance(inputs, dict) else node
+            for field, slot in workflow_rules.get(node_id, ()):
+                if field in fields:
+                    slots[slot].append(base + (field,))
+            if node.get("type") in ("sdxl_model_loader", "model_loader"):
+                model_loaders.append((node_id, base + ("model",)))
+
+    placeholders: List[Tuple[_JsonPath, str]] = []
+    _find_placeholders(api_graph, (), placeholders)
+
+    digest = hashlib.sha256(raw)
+    digest.update(f"|flatten={flatten}|model_input_mode={model_input_mode}|output={resolved_output}".encode("utf-8"))
+
+    compiled = _CompiledTemplate(
+        path=path,
+        mtime_ns=mtime_ns,
+        size=size,
+        digest=digest.hexdigest(),
+        api_graph=api_graph,
+        output_node_id=resolved_output,
+        slots={k: tuple(v) for k, v in slots.items() if v},
+        placeholders=tuple(placeholders),
+        model_loaders=tuple(model_loaders),
+    )
+    logger.info(
+        "Compiled graph template %s digest=%s output_node=%s slots=%s",
+        path,
+        compiled.digest[:12],
+        resolved_output,
+        {k: len(v) for k, v in compiled.slots.items()},
+    )
+    return compiled
+
+
+class _TemplateRegistry:
+    """Compiled graph templates keyed by path and compile settings; recompiled when the file changes."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._compiled: Dict[Tuple[str, bool, str, str], _CompiledTemplate] = {}
+
+    async def get(
+        self, path: str, *, flatten: bool, cfg: ShimConfig, output_node_id: Optional[str]
+    ) -> _CompiledTemplate:
+        """The template compiled for `flatten` (see `_effective_flatten_inputs`), recompiling it if the file changed."""
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to load graph template '{path}': {e}")
+
+        key = (path, flatten, cfg.model_input_mode, (output_node_id or "").strip())
+        with self._lock:
+            compiled = self._compiled.get(key)
+        fresh = compiled is not None and compiled.mtime_ns == st.st_mtime_ns and compiled.size == st.st_size
+        _cache_lookup("template", fresh)
+        if compiled is not None and fresh:
+            return compiled
+
+        # Reading and compiling the file runs off the event loop.
+        compiled = await asyncio.to_thread(
+            _compile_graph_template,
+            path,
+            mtime_ns=st.st_mtime_ns,
+            size=st.st_size,
+            flatten=flatten,
+            model_input_mode=cfg.model_input_mode,
+            output_node_id=output_node_id,
+        )
+        with self._lock:
+            self._compiled[key] = compiled
+        return compiled
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"path": c.path, "digest": c.digest[:12], "output_node_id": c.output_node_id}
+                for c in self._compiled.values()
+            ]
+
+
+_TEMPLATES = _TemplateRegistry()
+
+
 def _extract_image_name_from_queue_item(queue_item: dict, output_node_id: str) -> str:
     def _find_first_image_name(obj: Any) -> Optional[str]:
         if isinstance(obj, dict):
@@ -1060,215 +2285,1739 @@ def _extract_image_name_from_queue_item(queue_item: dict, output_node_id: str) -
     return image_name
 
 
-def _invokeai_generate_b64(req: ImagesGenerationsRequest, *, cfg: ShimConfig) -> str:
-    if not cfg.graph_template_path:
-        raise HTTPException(status_code=500, detail="SHIM_GRAPH_TEMPLATE_PATH is required for invokeai_queue mode")
+class _ResultCache:
+    """Content-addressed on-disk cache of generated PNGs for fully seeded requests.
 
-    width, height = _parse_size(req.size)
+    Files live at `<dir>/<key[:2]>/<key>.png`, where the key hashes every input that determines
+    the image (see `_result_cache_key`). Recency is tracked in memory (rebuilt from file mtimes
+    on first use) and the least recently used files are evicted once the directory exceeds its
+    byte budget. Concurrent requests for the same key share one in-flight generation.
+    """
 
-    presets = _parse_model_presets(cfg.model_presets_json)
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._dir: Optional[str] = None
+        self._loaded = False
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._inflight: Dict[str, "asyncio.Future[bytes]"] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _file(self, key: str) -> str:
+        assert self._dir is not None
+        return os.path.join(self._dir, key[:2], f"{key}.png")
+
+    def _ensure_loaded(self, cache_dir: str) -> None:
+        # Caller holds the lock.
+        if self._loaded and self._dir == cache_dir:
+            return
+        self._loaded = True
+        self._dir = cache_dir
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        found: List[Tuple[float, str, int]] = []
+        try:
+            for root, _, files in os.walk(cache_dir):
+                for name in files:
+                    if not name.endswith(".png"):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, name[: -len(".png")], st.st_size))
+        except OSError:
+            return
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        if found:
+            logger.info("Loaded %d cached result(s) (%d bytes) from %s", len(found), self._total_bytes, cache_dir)
 
-    requested_model = (req.model or "").strip()
-    fallback_model = (cfg.default_model or "").strip()
-    requested_or_default = requested_model or fallback_model
+    def _read(self, cfg: ShimConfig, key: str) -> Optional[bytes]:
+        with self._lock:
+            self._ensure_loaded(cfg.result_cache_dir)
+            if key not in self._entries:
+                return None
+            path = self._file(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # mtime doubles as the persisted recency order.
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return data
+
+    def _write(self, cfg: ShimConfig, key: str, data: bytes) -> None:
+        max_bytes = int(cfg.result_cache_max_mb * 1024 * 1024)
+        with self._lock:
+            self._ensure_loaded(cfg.result_cache_dir)
+            path = self._file(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp.{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning("Failed to write result cache entry %s", path, exc_info=True)
+            return
 
-    preset = presets.get(requested_or_default.lower()) if requested_or_default else None
-    if preset is not None:
-        preset_model = (preset.get("model") or preset.get("upstream_model") or "").strip()
-        if preset_model:
-            model_name = preset_model
-        else:
-            model_name = requested_or_default
-    else:
-        model_name = requested_or_default
+        evict: List[str] = []
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._total_bytes > max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evict.append(self._file(old_key))
+        for old_path in evict:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
 
-    # Apply preset defaults only when request omits them.
-    steps = req.steps if req.steps is not None else _as_int(preset.get("steps") if preset else None)
-    cfg_scale = req.cfg_scale if req.cfg_scale is not None else _as_float(preset.get("cfg_scale") if preset else None)
-    scheduler = (req.scheduler or "").strip() or ((preset.get("scheduler") or "").strip() if preset else "")
-    scheduler = scheduler or None
+    async def fetch_or_generate(
+        self,
+        cfg: ShimConfig,
+        keys: List[str],
+        generate: Callable[[List[int]], Awaitable[List[bytes]]],
+    ) -> List[bytes]:
+        """Return one image per (distinct) key, calling `generate(indices)` only for keys nobody has yet."""
+        results: List[Optional[bytes]] = [None] * len(keys)
+        pending = list(range(len(keys)))
+        for i in pending:
+            results[i] = await asyncio.to_thread(self._read, cfg, keys[i])
+        for r in results:
+            if r is not None:
+                self.hits += 1
+                _cache_lookup("result", True)
+
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [i for i in range(len(keys)) if results[i] is None]
+            if not pending:
+                return [r for r in results if r is not None]
+
+            owned: Dict[int, "asyncio.Future[bytes]"] = {}
+            shared: Dict[int, "asyncio.Future[bytes]"] = {}
+            for i in pending:
+                fut = self._inflight.get(keys[i])
+                if fut is not None:
+                    shared[i] = fut
+                else:
+                    owned[i] = self._inflight[keys[i]] = loop.create_future()
 
-    model_info = _resolve_model_info(model_name, cfg=cfg) if model_name else None
+            if owned:
+                self.misses += len(owned)
+                for _ in owned:
+                    _cache_lookup("result", False)
+                try:
+                    images = await generate(sorted(owned))
+                    for i, data in zip(sorted(owned), images):
+                        results[i] = data
+                        owned[i].set_result(data)
+                        await asyncio.to_thread(self._write, cfg, keys[i], data)
+                except BaseException as exc:
+                    for fut in owned.values():
+                        if not fut.done():
+                            if isinstance(exc, asyncio.CancelledError):
+                                fut.cancel()
+                            else:
+                                fut.set_exception(exc)
+                                # Waiters re-raise it; don't warn when there are none.
+                                fut.exception()
+                    raise
+                finally:
+                    for i, fut in owned.items():
+                        if self._inflight.get(keys[i]) is fut:
+                            del self._inflight[keys[i]]
 
-    graph = _load_graph_from_template(
-        cfg.graph_template_path,
-        prompt=req.prompt,
-        width=width,
-        height=height,
-        seed=req.seed,
-        model_info=model_info,
-        model_input_mode=cfg.model_input_mode,
-    )
-    _apply_invokeai_workflow_overrides(
-        graph,
-        prompt=req.prompt,
-        negative_prompt=(req.negative_prompt or "").strip(),
-        width=width,
-        height=height,
-        seed=req.seed,
-        steps=steps,
-        cfg_scale=cfg_scale,
-        scheduler=scheduler,
-        model_info=model_info,
-        model_input_mode=cfg.model_input_mode,
-    )
+            for i, fut in shared.items():
+                try:
+                    results[i] = await asyncio.shield(fut)
+                    self.hits += 1
+                    _cache_lookup("result", True)
+                except asyncio.CancelledError:
+                    # The owning request went away; the next pass generates it here instead.
+                    if not fut.cancelled():
+                        raise
+
+    def snapshot(self, cfg: ShimConfig) -> Dict[str, Any]:
+        with self._lock:
+            self._ensure_loaded(cfg.result_cache_dir)
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "inflight": len(self._inflight),
+            }
 
-    output_node_id = (cfg.output_node_id or "").strip() or _detect_output_node_id(graph)
-    if not output_node_id:
-        raise HTTPException(status_code=500, detail="SHIM_OUTPUT_NODE_ID not set and could not auto-detect output node")
 
-    graph_api = _ensure_invokeai_api_graph(graph)
+_RESULTS = _ResultCache()
 
-    # Normalize legacy fields that break strict queue validation.
-    _strip_legacy_board_fields(graph_api)
 
-    nodes_api = graph_api.get("nodes")
-    if isinstance(nodes_api, dict):
-        for node_id, node in nodes_api.items():
-            if not isinstance(node, dict):
-                continue
-            if node.get("type") not in ("sdxl_model_loader", "model_loader"):
-                continue
-            inputs = node.get("inputs")
-            if isinstance(inputs, dict):
-                model_value = inputs.get("model")
-            else:
-                model_value = node.get("model")
-            logger.info("Model loader input node_id=%s model=%s", node_id, model_value)
+def _result_cache_key(compiled: _CompiledTemplate, **fields: Any) -> str:
+    payload = json.dumps({"template": compiled.digest, **fields}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    if cfg.debug_graph_path:
-        try:
-            logger.info("Writing debug graph to %s", cfg.debug_graph_path)
-            with open(cfg.debug_graph_path, "w", encoding="utf-8") as f:
-                json.dump(graph_api, f, indent=2)
-            logger.info("Debug graph written to %s", cfg.debug_graph_path)
-        except Exception as e:
-            logger.exception("Failed to write debug graph to %s", cfg.debug_graph_path)
-            raise HTTPException(status_code=500, detail=f"Failed to write SHIM_DEBUG_GRAPH_PATH: {e}")
 
-    # Preflight: ensure the model input is present for model loader nodes.
-    if isinstance(nodes_api, dict):
-        for node_id, node in nodes_api.items():
-            if not isinstance(node, dict):
-                continue
-            if node.get("type") not in ("sdxl_model_loader", "model_loader"):
-                continue
-            inputs = node.get("inputs")
-            if isinstance(inputs, dict):
-                model_value = inputs.get("model")
-            else:
-                model_value = node.get("model")
-            missing = False
-            if model_value is None:
-                missing = True
-            elif isinstance(model_value, str) and not model_value.strip():
-                missing = True
-            elif isinstance(model_value, dict):
-                if not model_value:
-                    missing = True
-                elif cfg.model_input_mode == "id":
-                    key = model_value.get("key") if isinstance(model_value.get("key"), str) else None
-                    if not key or not key.strip():
-                        missing = True
-
-            if missing:
-                raise HTTPException(
-                    status_code=500,
-                    detail=(
-                        "Preflight missing/empty model input in graph "
-                        f"(node_id={node_id}, model_input_mode={cfg.model_input_mode}, model={model_value!r})"
-                    ),
-                )
+def _parse_queue_depth(status: Any) -> Optional[int]:
+    # Shapes: {"queue": {"pending": 2, "in_progress": 1, ...}, "processor": {...}} or the inner object.
+    if not isinstance(status, dict):
+        return None
+    queue = status.get("queue") if isinstance(status.get("queue"), dict) else status
+    pending = _as_int(queue.get("pending"))
+    in_progress = _as_int(queue.get("in_progress"))
+    if pending is None and in_progress is None:
+        return None
+    return (pending or 0) + (in_progress or 0)
 
-    origin = f"openai-images-shim:{int(time.time() * 1000)}"
 
-    def _extract_item_id(enqueue_result: Any) -> str:
-        if not isinstance(enqueue_result, dict):
-            raise HTTPException(status_code=502, detail=f"InvokeAI enqueue returned non-object: {enqueue_result}")
+def _parse_invokeai_timestamp(value: Any) -> Optional[float]:
+    # InvokeAI stores timestamps as "YYYY-MM-DD HH:MM:SS[.ffffff]" (UTC) or ISO 8601.
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        ts = datetime.datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return ts.timestamp()
 
-        # Common shapes observed across versions:
-        # - {"item_ids": [123]}
-        # - {"item_ids": ["123"]}
-        # - {"item_id": 123}
-        for key in ("item_ids", "item_id"):
-            v = enqueue_result.get(key)
-            if isinstance(v, list) and v:
-                v0 = v[0]
-                if isinstance(v0, (int, str)):
-                    return str(v0)
-            if isinstance(v, (int, str)):
-                return str(v)
 
-        raise HTTPException(status_code=502, detail=f"InvokeAI enqueue returned unexpected payload: {enqueue_result}")
+class _AdmissionController:
+    """Backpressure in front of InvokeAI's queue.
 
-    enqueue_body = {
-        "prepend": True,
-        "batch": {
-            "graph": graph_api,
-            "origin": origin,
-            "destination": "openai-images",
-            "runs": 1,
-        },
-    }
+    New work is admitted only while both the shim's own in-flight queue items and InvokeAI's
+    queue depth (pending + in progress, cached for SHIM_QUEUE_STATUS_TTL_S and topped up with
+    whatever we enqueued since) stay within their limits. Rejections carry a Retry-After
+    derived from the observed per-item execution time.
+    """
 
-    discovered = _discover_queue_enqueue_endpoints(cfg.invokeai_base_url, cfg.queue_id)
-    if discovered:
-        enqueue_candidates: List[Tuple[str, str]] = discovered
-    else:
-        enqueue_candidates = [
-            ("POST", f"{cfg.invokeai_base_url}/api/v2/queue/{urllib.parse.quote(cfg.queue_id)}/enqueue_batch"),
-            ("POST", f"{cfg.invokeai_base_url}/api/v2/queue/{urllib.parse.quote(cfg.queue_id)}/enqueue"),
-            ("POST", f"{cfg.invokeai_base_url}/api/v1/queue/{urllib.parse.quote(cfg.queue_id)}/enqueue_batch"),
-            ("POST", f"{cfg.invokeai_base_url}/api/v1/queue/{urllib.parse.quote(cfg.queue_id)}/enqueue"),
-        ]
+    _DEFAULT_EXEC_S = 10.0
+    _EXEC_EWMA_ALPHA = 0.2
+
+    def __init__(self) -> None:
+        self._status_lock = asyncio.Lock()
+        self._status_depth: Optional[int] = None
+        self._status_at = 0.0
+        self._enqueued_since_status = 0
+        self.inflight = 0
+        self.rejected = 0
+        self.exec_s: Optional[float] = None
+
+    async def queue_depth(self, cfg: ShimConfig) -> Optional[int]:
+        if time.time() - self._status_at >= cfg.queue_status_ttl_s:
+            async with self._status_lock:
+                if time.time() - self._status_at >= cfg.queue_status_ttl_s:
+                    await self._refresh_status(cfg)
+        if self._status_depth is None:
+            return None
+        return self._status_depth + self._enqueued_since_status
 
-    enqueue_result: Any = None
-    last_exc: Optional[HTTPException] = None
-    used_enqueue: Optional[Tuple[str, str]] = None
-    for method, enqueue_url in enqueue_candidates:
+    async def _refresh_status(self, cfg: ShimConfig) -> None:
         try:
-            enqueue_result = _http_json(method, enqueue_url, enqueue_body, timeout=30)
-            last_exc = None
-            used_enqueue = (method, enqueue_url)
-            break
+            status, _ = await _route_call(
+                cfg,
+                "queue_status",
+                lambda: _QUEUE_STATUS_ROUTES,
+                lambda method, url: _http_json(method, url, payload=None, timeout=5),
+            )
         except HTTPException as exc:
-            last_exc = exc
-            if _is_probe_miss(exc):
+            logger.warning("InvokeAI queue status unavailable; admitting on local in-flight only (%s)", exc.detail)
+            status = None
+        self._status_depth = _parse_queue_depth(status)
+        self._status_at = time.time()
+        self._enqueued_since_status = 0
+
+    def retry_after_s(self, excess_items: int) -> int:
+        per_item = self.exec_s if self.exec_s is not None else self._DEFAULT_EXEC_S
+        return max(1, min(300, int(per_item * max(1, excess_items) + 0.999)))
+
+    def _reject(self, detail: str, excess_items: int) -> HTTPException:
+        self.rejected += 1
+        retry_after = self.retry_after_s(excess_items)
+        logger.warning("Rejecting generation (%s); Retry-After=%ss", detail, retry_after)
+        return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    async def admit(self, cfg: ShimConfig, items: int) -> None:
+        """Reserve `items` queue slots or raise 429. Pair with `release(items)`."""
+        depth = await self.queue_depth(cfg) if cfg.max_queue_depth > 0 else None
+        if depth is not None:
+            _METRICS.observe("shim_invokeai_queue_depth", depth, **_labels())
+        # No awaits past this point: check and reserve atomically.
+        if cfg.max_inflight > 0 and self.inflight + items > cfg.max_inflight:
+            raise self._reject(
+                f"Too many in-flight generations ({self.inflight}/{cfg.max_inflight} queue items)",
+                self.inflight + items - cfg.max_inflight,
+            )
+        if depth is not None and depth + items > cfg.max_queue_depth:
+            raise self._reject(
+                f"InvokeAI queue is full ({depth}/{cfg.max_queue_depth} pending or in progress)",
+                depth + items - cfg.max_queue_depth,
+            )
+        self.inflight += items
+        self._enqueued_since_status += items
+
+    def release(self, items: int) -> None:
+        self.inflight = max(0, self.inflight - items)
+
+    @property
+    def load(self) -> int:
+        """Queued + running items upstream as last sampled (plus ours since), without a status call."""
+        if self._status_depth is None:
+            return self.inflight
+        return max(self.inflight, self._status_depth + self._enqueued_since_status)
+
+    def observe(self, queue_item: dict) -> None:
+        started = _parse_invokeai_timestamp(queue_item.get("started_at"))
+        completed = _parse_invokeai_timestamp(queue_item.get("completed_at"))
+        if started is None or completed is None or completed < started:
+            return
+        took = completed - started
+        self.exec_s = took if self.exec_s is None else self.exec_s + self._EXEC_EWMA_ALPHA * (took - self.exec_s)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "inflight": self.inflight,
+            "queue_depth": self._status_depth,
+            "rejected": self.rejected,
+            "exec_s": round(self.exec_s, 3) if self.exec_s is not None else None,
+        }
+
+
+class _ModelAffinityScheduler:
+    """Groups dispatches to InvokeAI by model so alternating presets don't swap models on every job.
+
+    A request for a model other than the one InvokeAI is currently working on is held in a
+    per-model FIFO until the current model's in-flight requests drain, or until it has waited
+    SHIM_AFFINITY_MAX_WAIT_S, whichever comes first; then that model's whole queue is dispatched.
+    A dispatch whose model differs from the previous one counts as a swap (also counted with
+    the scheduler disabled, as a baseline).
+    """
+
+    def __init__(self) -> None:
+        self.current: Optional[str] = None
+        self._inflight: Dict[str, int] = {}
+        self._waiting: "OrderedDict[str, Deque[Tuple[float, asyncio.Future[bool]]]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.swaps = 0
+        self.dispatched = 0
+
+    def _dispatch(self, model: str) -> bool:
+        swapped = self.current is not None and model != self.current
+        if swapped:
+            self.swaps += 1
+        self.current = model
+        self._inflight[model] = self._inflight.get(model, 0) + 1
+        self.dispatched += 1
+        return swapped
+
+    def _oldest_waiter(self) -> Optional[Tuple[float, str]]:
+        oldest: Optional[Tuple[float, str]] = None
+        for model, queue in self._waiting.items():
+            while queue and queue[0][1].done():
+                queue.popleft()
+            if queue and (oldest is None or queue[0][0] < oldest[0]):
+                oldest = (queue[0][0], model)
+        return oldest
+
+    def _busy(self) -> bool:
+        return self.current is not None and self._inflight.get(self.current, 0) > 0
+
+    def _pump(self, max_wait_s: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while True:
+            oldest = self._oldest_waiter()
+            if oldest is None:
+                self._waiting.clear()
+                return
+            since, model = oldest
+            if self._busy() and time.monotonic() - since < max_wait_s:
+                break
+            for _, fut in self._waiting.pop(model):
+                if not fut.done():
+                    fut.set_result(self._dispatch(model))
+        self._timer = asyncio.get_running_loop().call_later(
+            max(0.0, since + max_wait_s - time.monotonic()), self._pump, max_wait_s
+        )
+
+    async def acquire(self, cfg: ShimConfig, model: str) -> None:
+        max_wait_s = cfg.affinity_max_wait_s
+        oldest = self._oldest_waiter()
+        if (
+            max_wait_s <= 0
+            or not self._busy()
+            # Same model as the one running: join it unless another model has waited long enough.
+            or (model == self.current and (oldest is None or time.monotonic() - oldest[0] < max_wait_s))
+        ):
+            swapped = self._dispatch(model)
+        else:
+            fut: "asyncio.Future[bool]" = asyncio.get_running_loop().create_future()
+            self._waiting.setdefault(model, deque()).append((time.monotonic(), fut))
+            self._pump(max_wait_s)
+            try:
+                swapped = await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # Dispatched just as the caller went away.
+                    self.release(cfg, model)
+                raise
+        if swapped:
+            _METRICS.inc("shim_model_swaps_total", **_labels())
+
+    def release(self, cfg: ShimConfig, model: str) -> None:
+        self._inflight[model] = max(0, self._inflight.get(model, 0) - 1)
+        if self._waiting:
+            self._pump(cfg.affinity_max_wait_s)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, cfg: ShimConfig, model: str) -> AsyncIterator[None]:
+        with _phase("affinity_wait"):
+            await self.acquire(cfg, model)
+        try:
+            yield
+        finally:
+            self.release(cfg, model)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "current_model": self.current,
+            "waiting": {m: sum(1 for _, f in q if not f.done()) for m, q in self._waiting.items()},
+            "inflight": {m: n for m, n in self._inflight.items() if n},
+            "dispatched": self.dispatched,
+            "swaps": self.swaps,
+        }
+
+
+_HOSTS_YAML_CACHE: Dict[str, Tuple[float, Tuple[str, ...]]] = {}
+
+
+def _hosts_yaml_upstreams(path: str) -> Tuple[str, ...]:
+    """InvokeAI base URLs of the `invokeai`-role hosts in hosts.yaml, re-read when the file changes.
+
+    A host may set `invokeai_url`; otherwise it is reached through its nginx front
+    (`http://<hostname>:<services.invokeai.port>`). This host is skipped: it is INVOKEAI_BASE_URL.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = -1.0
+    cached = _HOSTS_YAML_CACHE.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    urls: List[str] = []
+    doc: Any = None
+    if mtime < 0:
+        logger.warning("SHIM_HOSTS_YAML=%s not found; using INVOKEAI_BASE_URL/SHIM_UPSTREAMS only", path)
+    elif yaml is None:
+        logger.warning("SHIM_HOSTS_YAML is set but PyYAML is not installed; ignoring %s", path)
+    else:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                doc = yaml.safe_load(f)
+        except Exception as e:
+            logger.warning("Failed to read SHIM_HOSTS_YAML=%s: %s", path, e)
+    if isinstance(doc, dict):
+        service = (doc.get("services") or {}).get("invokeai") or {}
+        port = service.get("port") or 7860
+        local = socket.gethostname().split(".")[0].lower()
+        for name, host in (doc.get("hosts") or {}).items():
+            if not isinstance(host, dict) or "invokeai" not in (host.get("roles") or []):
                 continue
-            raise
+            url = str(host.get("invokeai_url") or "").strip()
+            if not url:
+                hostname = str(host.get("hostname") or name)
+                if hostname.split(".")[0].lower() == local:
+                    continue
+                url = f"http://{hostname}:{port}"
+            urls.append(url.rstrip("/"))
+        logger.info("Upstreams from %s: %s", path, urls)
+    _HOSTS_YAML_CACHE[path] = (mtime, tuple(urls))
+    return tuple(urls)
+
+
+def _upstream_urls(cfg: ShimConfig) -> List[str]:
+    """All InvokeAI instances to dispatch to, INVOKEAI_BASE_URL first."""
+    urls = [cfg.invokeai_base_url, *cfg.upstream_urls]
+    if cfg.hosts_yaml_path:
+        urls.extend(_hosts_yaml_upstreams(cfg.hosts_yaml_path))
+    return list(dict.fromkeys(urls))
+
+
+def _is_upstream_down(exc: HTTPException) -> bool:
+    """Whether `exc` means the upstream itself stopped answering (worth failing over)."""
+    detail = str(exc.detail)
+    return exc.status_code == 502 and (
+        detail.startswith("Upstream URL error")
+        or any(detail.startswith(f"Upstream HTTP error {code} ") for code in (502, 503, 504))
+    )
 
-    if last_exc is not None:
-        raise last_exc
 
-    if used_enqueue:
-        logger.info("Enqueued InvokeAI batch via %s %s", used_enqueue[0], used_enqueue[1])
+@dataclass
+class _Upstream:
+    """Per-InvokeAI-instance state. Routes, OpenAPI schema and models are cached per base URL elsewhere."""
+
+    url: str
+    events: _QueueEventHub = dataclasses.field(default_factory=_QueueEventHub)
+    admission: _AdmissionController = dataclasses.field(default_factory=_AdmissionController)
+    scheduler: _ModelAffinityScheduler = dataclasses.field(default_factory=_ModelAffinityScheduler)
+    # Images routed here and not finished yet (counted before admission, so bursts spread out).
+    routed: int = 0
+    healthy: bool = True
+    checked_at: Optional[float] = None
+    error: Optional[str] = None
+    # Status code /readyz answers with while the upstream is down.
+    error_status: int = 502
+    failovers: int = 0
+    # Last probe results, served by /readyz without touching InvokeAI.
+    version: Any = None
+    inputs_format: Optional[str] = None
+    probe_s: Optional[float] = None
+
+
+class _UpstreamPool:
+    """Health and dispatch across the InvokeAI upstreams.
+
+    Dispatch goes to the healthy upstream with the shortest queue (its last sampled queue depth,
+    or the images routed to it and not finished yet, whichever is larger),
+    skipping upstreams whose model registry lacks the requested model and preferring, by one
+    queue item, an upstream already running it. Each upstream is probed every
+    SHIM_UPSTREAM_HEALTH_INTERVAL_S (version, graph input format, queue status, models) and the
+    results are kept for /readyz; an upstream that stops answering mid-request is marked down at once.
+    """
+
+    def __init__(self) -> None:
+        self._upstreams: Dict[str, _Upstream] = {}
+        self._probing: Dict[str, "asyncio.Future[None]"] = {}
+
+    def get(self, url: str) -> _Upstream:
+        up = self._upstreams.get(url)
+        if up is None:
+            up = self._upstreams[url] = _Upstream(url)
+        return up
+
+    def mark_down(self, url: str, error: Any, *, status: int = 502) -> None:
+        up = self.get(url)
+        if up.healthy:
+            logger.warning("InvokeAI upstream %s marked down: %s", url, error)
+        up.healthy = False
+        up.error = str(error)
+        up.error_status = status
+
+    def _model_match(self, url: str, model_name: str) -> Any:
+        """The upstream's registry entry for `model_name`, False if it lacks it, None if unknown."""
+        snapshot = _MODELS.peek(url)
+        if not model_name or snapshot is None or not snapshot.models:
+            return None
+        return snapshot.lookup(model_name) or False
+
+    def pick(self, urls: List[str], *, model_name: str, exclude: Iterable[str] = ()) -> str:
+        candidates = [u for u in urls if u not in set(exclude)]
+        # With every upstream down, try them anyway: the health check may just be behind.
+        healthy = [u for u in candidates if self.get(u).healthy] or candidates
+        scored: List[Tuple[int, int, str]] = []
+        for index, url in enumerate(healthy):
+            up = self.get(url)
+            match = self._model_match(url, model_name)
+            if match is False:
+                continue
+            running = isinstance(match, dict) and match.get("key") == up.scheduler.current
+            scored.append((max(up.admission.load, up.routed) + (0 if running else 1), index, url))
+        # Nobody lists the model: let the first healthy upstream report it.
+        return min(scored)[2] if scored else healthy[0]
+
+    async def check(self, cfg: ShimConfig) -> None:
+        """Probe `cfg.invokeai_base_url`, sharing a probe that is already running for it."""
+        url = cfg.invokeai_base_url
+        probe = self._probing.get(url)
+        if probe is None:
+            probe = self._probing[url] = asyncio.ensure_future(self._check(cfg))
+            probe.add_done_callback(lambda _: self._probing.pop(url, None))
+        await asyncio.shield(probe)
+
+    async def _check(self, cfg: ShimConfig) -> None:
+        """Refresh version, graph input format, queue depth and model registry for one upstream."""
+        up = self.get(cfg.invokeai_base_url)
+        started = time.time()
+        try:
+            version, last_exc = await _route_call(
+                cfg,
+                "version",
+                lambda: _VERSION_ROUTES,
+                lambda method, url: _http_json(method, url, payload=None, timeout=5),
+                is_miss=_is_not_found,
+            )
+            if version is None and last_exc is not None:
+                raise last_exc
+        except HTTPException as exc:
+            self.mark_down(cfg.invokeai_base_url, exc.detail, status=exc.status_code)
+            up.checked_at = time.time()
+            up.probe_s = round(up.checked_at - started, 3)
+            return
+        if not up.healthy:
+            logger.info("InvokeAI upstream %s is answering again", cfg.invokeai_base_url)
+        up.version = version
+        up.healthy = True
+        up.error = None
+        try:
+            up.inputs_format = "flat" if await _effective_flatten_inputs(cfg) else "inputs"
+            await up.admission.queue_depth(cfg)
+            await _MODELS.get(cfg)
+            up.events.start(cfg)
+        except Exception:
+            logger.warning("Readiness probe of %s incomplete", cfg.invokeai_base_url, exc_info=True)
+        up.checked_at = time.time()
+        up.probe_s = round(up.checked_at - started, 3)
+
+    async def run(self) -> None:
+        while True:
+            cfg = _get_config()
+            await asyncio.gather(
+                *(self.check(dataclasses.replace(cfg, invokeai_base_url=url)) for url in _upstream_urls(cfg)),
+                return_exceptions=True,
+            )
+            await asyncio.sleep(max(1.0, cfg.upstream_health_interval_s))
+
+    def snapshot(self, cfg: ShimConfig) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for url in _upstream_urls(cfg):
+            up = self.get(url)
+            out.append(
+                {
+                    "url": url,
+                    "healthy": up.healthy,
+                    "error": up.error,
+                    "checked_age_s": round(time.time() - up.checked_at, 1) if up.checked_at else None,
+                    "load": max(up.admission.load, up.routed),
+                    "current_model": up.scheduler.current,
+                    "queue_events": "connected" if up.events.connected else "disconnected",
+                    "failovers": up.failovers,
+                }
+            )
+        return out
+
+
+_POOL = _UpstreamPool()
+
+
+def _upstream(cfg: ShimConfig) -> _Upstream:
+    return _POOL.get(cfg.invokeai_base_url)
+
+
+def _graph_model_key(compiled: _CompiledTemplate, graph_api: dict) -> str:
+    """The model InvokeAI will load for this graph (first model loader), for affinity scheduling."""
+    for _, path in compiled.model_loaders:
+        value = _get_json_path(graph_api, path)
+        key = (value.get("key") or value.get("name")) if isinstance(value, dict) else value
+        if isinstance(key, str) and key.strip():
+            return key.strip()
+    return f"template:{compiled.digest[:12]}"
+
+
+@dataclass
+class _Generation:
+    """An in-flight image generation (sync request or async job) and the InvokeAI queue items it owns."""
+
+    id: str
+    created_at: float = dataclasses.field(default_factory=time.time)
+    item_ids: List[str] = dataclasses.field(default_factory=list)
+    task: Optional["asyncio.Task[Any]"] = None
+    labels: Dict[str, str] = dataclasses.field(default_factory=lambda: {"preset": "", "model": ""})
+    # Receives normalized InvokeAI status/progress events for this generation's queue items.
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None
+    disconnected: bool = False
+
+
+_GENERATIONS: Dict[str, _Generation] = {}
+# Set inside a generation's task so the enqueue path can record item ids without threading them through.
+_CURRENT_GENERATION: "contextvars.ContextVar[Optional[_Generation]]" = contextvars.ContextVar(
+    "shim_generation", default=None
+)
+
+
+def _start_generation(
+    gen_id: str, work: Awaitable[Any], *, on_event: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> _Generation:
+    """Run `work` as a tracked, cancellable task registered under `gen_id`."""
+    if gen_id in _GENERATIONS:
+        if asyncio.iscoroutine(work):
+            work.close()
+        raise HTTPException(status_code=409, detail=f"Generation '{gen_id}' is already in flight")
+
+    gen = _Generation(id=gen_id, on_event=on_event)
+
+    async def _bound() -> Any:
+        _CURRENT_GENERATION.set(gen)
+        return await work
+
+    gen.task = asyncio.ensure_future(_bound())
+    _GENERATIONS[gen_id] = gen
+    gen.task.add_done_callback(lambda _: _finish_generation(gen))
+    return gen
+
+
+def _generation_outcome(gen: _Generation) -> str:
+    assert gen.task is not None
+    if gen.disconnected:
+        return "disconnected"
+    if gen.task.cancelled():
+        return "canceled"
+    exc = gen.task.exception()
+    if exc is None:
+        return "ok"
+    if isinstance(exc, HTTPException) and exc.status_code == 429:
+        return "rejected"
+    return "error"
+
+
+def _finish_generation(gen: _Generation) -> None:
+    if _GENERATIONS.get(gen.id) is gen:
+        del _GENERATIONS[gen.id]
+    outcome = _generation_outcome(gen)
+    _METRICS.inc("shim_generations_total", **gen.labels, outcome=outcome)
+    _METRICS.observe("shim_generation_seconds", time.time() - gen.created_at, **gen.labels, outcome=outcome)
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # The body has already been read, so the next ASGI message is the disconnect.
+    while True:
+        message = await request.receive()
+        if message.get("type") == "http.disconnect":
+            return
+
+
+async def _run_generation(request: Request, gen_id: str, work: Awaitable[_T]) -> _T:
+    """Run `work` as a cancellable generation, abandoning it when the client disconnects."""
+    gen = _start_generation(gen_id, work)
+    assert gen.task is not None
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({gen.task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if gen.task not in done:
+            gen.disconnected = True
+            logger.info("Client disconnected; abandoning generation %s (items=%s)", gen_id, gen.item_ids)
+            gen.task.cancel()
+            await asyncio.wait({gen.task})
+            # Nobody is listening; the status is for the access log.
+            raise HTTPException(status_code=499, detail="Client disconnected")
+        if gen.task.cancelled():
+            raise HTTPException(status_code=409, detail=f"Generation '{gen_id}' was canceled")
+        return gen.task.result()
+    finally:
+        watcher.cancel()
+        if not gen.task.done():
+            gen.task.cancel()
+        # The caller's remaining phases (encoding) are attributed to the same preset/model.
+        _METRIC_LABELS.set(gen.labels)
+
+
+async def _cancel_queue_items(cfg: ShimConfig, item_ids: List[str], *, reason: str) -> None:
+    """Best-effort InvokeAI cancel for queue items whose result nobody will fetch."""
+
+    async def _cancel(method: str, url: str) -> Any:
+        out = await _http_json(method, url, payload=None, timeout=10)
+        return out if out is not None else {}
+
+    async def _one(item_id: str) -> None:
+        try:
+            _, last_exc = await _route_call(
+                cfg, "cancel_queue_item", lambda: _CANCEL_ROUTES, _cancel, params={"item_id": item_id}
+            )
+        except HTTPException as exc:
+            logger.warning("Failed to cancel InvokeAI queue item %s: %s", item_id, exc.detail)
+            return
+        if last_exc is not None:
+            logger.warning("No InvokeAI cancel endpoint accepted queue item %s: %s", item_id, last_exc.detail)
+            return
+        logger.info("Canceled InvokeAI queue item %s (%s)", item_id, reason)
+
+    await asyncio.gather(*(_one(item_id) for item_id in item_ids))
+
+
+class _Job:
+    """An asynchronous generation: state for GET /v1/images/jobs/{id} plus SSE subscribers."""
+
+    _SUBSCRIBER_QUEUE = 64
+
+    def __init__(self, job_id: str) -> None:
+        self.id = job_id
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.status = "queued"
+        self.progress: Optional[Dict[str, Any]] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self._subscribers: List["asyncio.Queue[Tuple[str, Dict[str, Any]]]"] = []
+
+    @property
+    def done(self) -> bool:
+        return self.status in {"succeeded", "failed", "canceled"}
+
+    def public(self, *, include_result: bool = True) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "id": self.id,
+            "object": "image.generation.job",
+            "status": self.status,
+            "created": int(self.created_at),
+        }
+        if self.progress is not None:
+            out["progress"] = self.progress
+        if self.finished_at is not None:
+            out["finished"] = int(self.finished_at)
+        if self.error is not None:
+            out["error"] = self.error
+        if include_result and self.result is not None:
+            out["result"] = self.result
+        return out
+
+    def subscribe(self) -> "asyncio.Queue[Tuple[str, Dict[str, Any]]]":
+        queue: "asyncio.Queue[Tuple[str, Dict[str, Any]]]" = asyncio.Queue(maxsize=self._SUBSCRIBER_QUEUE)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: "asyncio.Queue[Tuple[str, Dict[str, Any]]]") -> None:
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def _publish(self, event: str, data: Dict[str, Any]) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                # Slow consumer: drop the oldest (progress) event rather than block generation.
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+    def on_event(self, event: Dict[str, Any]) -> None:
+        if self.done:
+            return
+        if event.get("type") == "progress":
+            self.progress = {k: v for k, v in event.items() if k != "type"}
+            if self.status == "queued":
+                self.status = "running"
+                self._publish("status", {"id": self.id, "status": self.status})
+            self._publish("progress", {"id": self.id, **self.progress})
+        elif event.get("type") == "status" and event.get("status") == "in_progress" and self.status == "queued":
+            self.status = "running"
+            self._publish("status", {"id": self.id, "status": self.status})
+
+    def finish(self, task: "asyncio.Task[Any]") -> None:
+        self.finished_at = time.time()
+        if task.cancelled():
+            self.status = "canceled"
+            self.error = {"status_code": 409, "detail": f"Generation '{self.id}' was canceled"}
+        elif task.exception() is not None:
+            exc = task.exception()
+            self.status = "failed"
+            if isinstance(exc, HTTPException):
+                self.error = {"status_code": exc.status_code, "detail": exc.detail}
+            else:
+                logger.error("Job %s failed", self.id, exc_info=exc)
+                self.error = {"status_code": 500, "detail": f"{type(exc).__name__}: {exc}"}
+        else:
+            self.status = "succeeded"
+            self.result = task.result()
+        self._publish("done", self.public())
+
+
+_JOBS: "OrderedDict[str, _Job]" = OrderedDict()
+
+
+def _prune_jobs(cfg: ShimConfig) -> None:
+    now = time.time()
+    for job_id, job in list(_JOBS.items()):
+        if job.finished_at is not None and now - job.finished_at > cfg.job_ttl_s:
+            del _JOBS[job_id]
+    # Over the cap: forget the oldest finished jobs first; running jobs are never dropped.
+    for job_id, job in list(_JOBS.items()):
+        if len(_JOBS) < cfg.max_jobs:
+            break
+        if job.done:
+            del _JOBS[job_id]
+    if len(_JOBS) >= cfg.max_jobs:
+        raise HTTPException(
+            status_code=429, detail=f"Too many unfinished jobs ({len(_JOBS)})", headers={"Retry-After": "5"}
+        )
+
+
+def _submit_job(cfg: ShimConfig, job_id: str, work: Awaitable[Dict[str, Any]]) -> _Job:
+    if job_id in _JOBS and not _JOBS[job_id].done:
+        if asyncio.iscoroutine(work):
+            work.close()
+        raise HTTPException(status_code=409, detail=f"Job '{job_id}' is already in flight")
+    try:
+        _prune_jobs(cfg)
+    except HTTPException:
+        if asyncio.iscoroutine(work):
+            work.close()
+        raise
+    job = _Job(job_id)
+    gen = _start_generation(job_id, work, on_event=job.on_event)
+    assert gen.task is not None
+    gen.task.add_done_callback(job.finish)
+    _JOBS[job_id] = job
+    return job
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class _PresetWarmer:
+    """Keeps the models behind SHIM_WARMUP_PRESETS loaded in InvokeAI.
+
+    Each warm-up preset gets a minimal generation (SHIM_WARMUP_SIZE, SHIM_WARMUP_STEPS) at startup,
+    and again whenever its model has been idle for SHIM_KEEP_WARM_IDLE_S. Re-warming only happens
+    while the shim has no generations in flight, so it never competes with real traffic.
+    Warmth is tracked per (upstream, model key), so presets sharing a model share it, and every
+    healthy upstream is warmed.
+    """
+
+    _TICK_S = 15.0
+
+    def __init__(self) -> None:
+        self._preset_models: Dict[Tuple[str, str], str] = {}
+        self._last_used: Dict[Tuple[str, str], float] = {}
+        self._errors: Dict[Tuple[str, str], str] = {}
+        self._warming: set = set()
+
+    def bind(self, url: str, preset: str, model_key: str) -> None:
+        self._preset_models[(url, preset)] = model_key
+
+    def touch(self, url: str, model_key: str) -> None:
+        self._last_used[(url, model_key)] = time.time()
+
+    def _idle_s(self, url: str, preset: str) -> Optional[float]:
+        last = self._last_used.get((url, self._preset_models.get((url, preset), "")))
+        return None if last is None else time.time() - last
+
+    def _is_warm(self, cfg: ShimConfig, url: str, preset: str) -> bool:
+        idle_s = self._idle_s(url, preset)
+        return idle_s is not None and (cfg.keep_warm_idle_s <= 0 or idle_s < cfg.keep_warm_idle_s)
+
+    def _targets(self, cfg: ShimConfig) -> List[str]:
+        presets = _parse_model_presets(cfg.model_presets_json)
+        if "*" in cfg.warmup_presets:
+            return sorted(presets)
+        for name in cfg.warmup_presets:
+            if name not in presets:
+                logger.warning("SHIM_WARMUP_PRESETS names unknown preset %r; ignoring", name)
+        return [name for name in cfg.warmup_presets if name in presets]
+
+    async def warm(self, cfg: ShimConfig, preset: str) -> None:
+        """Warm `preset` on `cfg.invokeai_base_url`."""
+        key = (cfg.invokeai_base_url, preset)
+        self._warming.add(key)
+        started = time.time()
+        try:
+            req = ImagesGenerationsRequest(
+                prompt="warm-up", model=preset, size=cfg.warmup_size, steps=cfg.warmup_steps, priority="batch"
+            )
+            await _invokeai_generate_images_on(req, cfg=cfg)
+            self._errors.pop(key, None)
+            logger.info(
+                "Warmed preset=%s model=%s upstream=%s in %.1fs",
+                preset,
+                self._preset_models.get(key),
+                cfg.invokeai_base_url,
+                time.time() - started,
+            )
+        except Exception as e:
+            self._errors[key] = str(getattr(e, "detail", None) or e)
+            logger.warning("Warm-up failed preset=%s upstream=%s: %s", preset, cfg.invokeai_base_url, self._errors[key])
+        finally:
+            self._warming.discard(key)
+
+    async def _warm_pass(self, cfg: ShimConfig, *, first: bool) -> None:
+        for url in _upstream_urls(cfg):
+            if not _POOL.get(url).healthy:
+                continue
+            ucfg = dataclasses.replace(cfg, invokeai_base_url=url)
+            for preset in self._targets(cfg):
+                if self._is_warm(cfg, url, preset):
+                    continue
+                # At startup warm everything; afterwards only refresh when nothing else is running,
+                # and stop the whole pass (every upstream) as soon as something is.
+                if not first and _GENERATIONS:
+                    return
+                await self.warm(ucfg, preset)
+
+    async def run(self) -> None:
+        first = True
+        while True:
+            await self._warm_pass(_get_config(), first=first)
+            first = False
+            await asyncio.sleep(self._TICK_S)
+
+    def snapshot(self, cfg: ShimConfig) -> Dict[str, Any]:
+        targets = set(self._targets(cfg))
+        urls = _upstream_urls(cfg)
+        out: Dict[str, Any] = {}
+        for preset in sorted(_parse_model_presets(cfg.model_presets_json)):
+            upstreams: Dict[str, Any] = {}
+            for url in urls:
+                idle_s = self._idle_s(url, preset)
+                upstreams[url] = {
+                    "warm": self._is_warm(cfg, url, preset),
+                    "model": self._preset_models.get((url, preset)),
+                    "idle_s": None if idle_s is None else round(idle_s, 1),
+                    "warming": (url, preset) in self._warming,
+                    "error": self._errors.get((url, preset)),
+                }
+            out[preset] = {
+                # Warm everywhere it can run right now.
+                "warm": all(u["warm"] for url, u in upstreams.items() if _POOL.get(url).healthy),
+                "keep_warm": preset in targets,
+                "upstreams": upstreams,
+            }
+        return out
+
+
+_WARMER = _PresetWarmer()
+
+
+class _GalleryJanitor:
+    """Removes delivered images from InvokeAI's gallery in the background.
+
+    The shim only downloads its outputs, so without this every image stays in InvokeAI's DB and
+    on disk. Each downloaded image is queued here; once it is SHIM_GALLERY_RETENTION_S old it is
+    deleted (SHIM_GALLERY_CLEANUP=delete) or moved to SHIM_GALLERY_BOARD (=board), in batches of
+    SHIM_GALLERY_CLEANUP_BATCH per upstream. Failed batches are retried a few times with backoff.
+    Pending images live in memory only: a restart leaves them in the gallery.
+    """
+
+    _TICK_S = 10.0
+    _MAX_ATTEMPTS = 5
+
+    def __init__(self) -> None:
+        # (due_at, base_url, image_name, attempts), in due order for first attempts.
+        self._pending: Deque[Tuple[float, str, str, int]] = deque()
+        self._boards: Dict[Tuple[str, str], str] = {}
+        self.done = 0
+        self.failed = 0
+
+    def add(self, cfg: ShimConfig, image_name: str) -> None:
+        if cfg.gallery_cleanup in ("delete", "board"):
+            self._pending.append((time.time() + cfg.gallery_retention_s, cfg.invokeai_base_url, image_name, 0))
+
+    async def _board_id(self, cfg: ShimConfig) -> str:
+        key = (cfg.invokeai_base_url, cfg.gallery_board)
+        if key in self._boards:
+            return self._boards[key]
+        boards, last_exc = await _route_call(
+            cfg,
+            "list_boards",
+            lambda: _BOARDS_ROUTES,
+            lambda method, url: _http_json(method, url, payload=None, timeout=10),
+        )
+        if boards is None and last_exc is not None:
+            raise last_exc
+        items = boards.get("items") if isinstance(boards, dict) else boards
+        for board in items if isinstance(items, list) else []:
+            if isinstance(board, dict) and board.get("board_name") == cfg.gallery_board and board.get("board_id"):
+                self._boards[key] = str(board["board_id"])
+                return self._boards[key]
+        created, last_exc = await _route_call(
+            cfg,
+            "create_board",
+            lambda: _CREATE_BOARD_ROUTES,
+            lambda method, url: _http_json(method, url, payload=None, timeout=10),
+            params={"board_name": cfg.gallery_board},
+        )
+        if not isinstance(created, dict) or not created.get("board_id"):
+            raise last_exc or HTTPException(status_code=502, detail=f"InvokeAI create_board returned {created!r}")
+        logger.info("Created InvokeAI board %r for delivered images", cfg.gallery_board)
+        self._boards[key] = str(created["board_id"])
+        return self._boards[key]
+
+    async def _apply(self, cfg: ShimConfig, image_names: List[str]) -> None:
+        if cfg.gallery_cleanup == "board":
+            payload = {"board_id": await self._board_id(cfg), "image_names": image_names}
+            op, routes = "add_images_to_board", _BOARD_IMAGES_ROUTES
+        else:
+            payload = {"image_names": image_names}
+            op, routes = "delete_images", _DELETE_IMAGES_ROUTES
+
+        async def _call(method: str, url: str) -> Any:
+            out = await _http_json(method, url, payload=payload, timeout=60)
+            return out if out is not None else {}
+
+        result, last_exc = await _route_call(cfg, op, lambda: routes, _call)
+        if result is None and last_exc is not None:
+            raise last_exc
+
+    async def sweep(self, cfg: ShimConfig) -> None:
+        now = time.time()
+        due: Dict[str, List[Tuple[str, int]]] = {}
+        kept: Deque[Tuple[float, str, str, int]] = deque()
+        while self._pending:
+            entry = self._pending.popleft()
+            if entry[0] <= now:
+                due.setdefault(entry[1], []).append((entry[2], entry[3]))
+            else:
+                kept.append(entry)
+        self._pending = kept
+
+        for url, entries in due.items():
+            ucfg = dataclasses.replace(cfg, invokeai_base_url=url)
+            size = max(1, cfg.gallery_cleanup_batch)
+            for start in range(0, len(entries), size):
+                batch = entries[start : start + size]
+                names = [name for name, _ in batch]
+                try:
+                    await self._apply(ucfg, names)
+                except HTTPException as exc:
+                    logger.warning(
+                        "Gallery cleanup (%s) of %d image(s) on %s failed: %s", cfg.gallery_cleanup, len(names), url, exc.detail
+                    )
+                    for name, attempts in batch:
+                        if attempts + 1 >= self._MAX_ATTEMPTS:
+                            self.failed += 1
+                            _METRICS.inc("shim_gallery_cleanup_total", action=cfg.gallery_cleanup, result="failed")
+                        else:
+                            self._pending.append((now + 60.0 * 2**attempts, url, name, attempts + 1))
+                    continue
+                self.done += len(names)
+                _METRICS.inc("shim_gallery_cleanup_total", len(names), action=cfg.gallery_cleanup, result="ok")
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self._TICK_S)
+            cfg = _get_config()
+            if self._pending and cfg.gallery_cleanup in ("delete", "board"):
+                await self.sweep(cfg)
+
+    def snapshot(self, cfg: ShimConfig) -> Dict[str, Any]:
+        return {
+            "mode": cfg.gallery_cleanup,
+            "pending": len(self._pending),
+            "done": self.done,
+            "failed": self.failed,
+        }
+
+
+_JANITOR = _GalleryJanitor()
+
+
+_PIL_FORMATS = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP", "avif": "AVIF"}
+
+
+@dataclass(frozen=True)
+class _OutputSpec:
+    """How generated PNGs are returned: format, quality (jpeg/webp/avif) and optional fit-within size."""
+
+    format: str
+    quality: int
+    max_size: Optional[Tuple[int, int]]
+
+    @property
+    def passthrough(self) -> bool:
+        return self.format == "png" and self.max_size is None
+
+
+def _output_spec(req: ImagesGenerationsRequest, cfg: ShimConfig) -> _OutputSpec:
+    """Resolve output_format/output_compression/output_size (request, then preset, then env); 400 if unusable."""
+    _, preset, _ = _select_preset(req, cfg)
+    preset = preset or {}
+    fmt = (req.output_format or str(preset.get("output_format") or "") or cfg.default_output_format).strip().lower()
+    fmt = "jpeg" if fmt == "jpg" else fmt
+    if fmt not in _PIL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown output_format '{fmt}' (expected png, jpeg, webp or avif)")
+    quality = req.output_compression
+    if quality is None:
+        quality = _as_int(preset.get("output_compression"))
+    if quality is None:
+        quality = cfg.output_quality
+    size = (req.output_size or str(preset.get("output_size") or "")).strip()
+    spec = _OutputSpec(format=fmt, quality=max(0, min(100, quality)), max_size=_parse_size(size) if size else None)
+
+    if not spec.passthrough:
+        if Image is None:
+            raise HTTPException(status_code=400, detail="output_format/output_size need Pillow in the shim's environment")
+        Image.init()
+        if _PIL_FORMATS[fmt] not in Image.SAVE:
+            raise HTTPException(status_code=400, detail=f"output_format '{fmt}' is not supported by this Pillow build")
+    return spec
+
+
+def _encode_image(png: bytes, spec: _OutputSpec) -> bytes:
+    if spec.passthrough:
+        return png
+    assert Image is not None
+    with Image.open(io.BytesIO(png)) as im:
+        im.load()
+        if spec.max_size is not None:
+            im.thumbnail(spec.max_size, Image.LANCZOS)
+        if spec.format == "jpeg" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        out = io.BytesIO()
+        if spec.format == "png":
+            im.save(out, "PNG")
+        elif spec.format == "webp":
+            im.save(out, "WEBP", quality=spec.quality, method=4)
+        else:
+            im.save(out, _PIL_FORMATS[spec.format], quality=spec.quality)
+        return out.getvalue()
+
+
+# What Pillow raises for a corrupt, truncated or oversized upstream image.
+_UNDECODABLE_IMAGE: Tuple[type, ...] = (OSError,) + ((Image.DecompressionBombError,) if Image is not None else ())
+
+
+def _encode_b64(png: bytes, spec: _OutputSpec) -> str:
+    return base64.b64encode(_encode_image(png, spec)).decode("ascii")
+
+
+_ENCODE_POOL: Optional[ThreadPoolExecutor] = None
+
+
+def _encode_pool(cfg: ShimConfig) -> ThreadPoolExecutor:
+    global _ENCODE_POOL
+    if _ENCODE_POOL is None:
+        _ENCODE_POOL = ThreadPoolExecutor(max_workers=max(1, cfg.encode_workers), thread_name_prefix="shim-encode")
+    return _ENCODE_POOL
+
+
+async def _encode_outputs(images: List[bytes], spec: _OutputSpec, *, cfg: ShimConfig) -> List[Dict[str, str]]:
+    """Re-encode and base64 `images` on the encode pool (Pillow and base64 of multi-MB images would stall the loop)."""
+    loop = asyncio.get_running_loop()
+    with _phase("encode"):
+        try:
+            encoded = await asyncio.gather(
+                *(loop.run_in_executor(_encode_pool(cfg), _encode_b64, image, spec) for image in images)
+            )
+        except _UNDECODABLE_IMAGE:
+            logger.warning("Failed to re-encode an InvokeAI image as %s", spec.format, exc_info=True)
+            raise HTTPException(status_code=502, detail="InvokeAI returned an undecodable image")
+    return [{"b64_json": b64} for b64 in encoded]
+
+
+async def _encode_images(images: List[bytes], spec: _OutputSpec, *, cfg: ShimConfig) -> List[bytes]:
+    """Re-encode `images` on the encode pool; PNG passthrough returns them untouched (base64 is streamed)."""
+    if spec.passthrough:
+        return images
+    loop = asyncio.get_running_loop()
+    with _phase("encode"):
+        try:
+            return list(
+                await asyncio.gather(
+                    *(loop.run_in_executor(_encode_pool(cfg), _encode_image, image, spec) for image in images)
+                )
+            )
+        except _UNDECODABLE_IMAGE:
+            logger.warning("Failed to re-encode an InvokeAI image as %s", spec.format, exc_info=True)
+            raise HTTPException(status_code=502, detail="InvokeAI returned an undecodable image")
+
+
+# Raw bytes per base64 chunk; a multiple of 3, so the chunks join into one valid base64 string.
+_B64_CHUNK = 3 * 16 * 1024
+
+
+async def _stream_images_json(
+    head: Dict[str, Any], images: List[bytes], *, labels: Dict[str, str]
+) -> AsyncIterator[bytes]:
+    """Yield `{**head, "data": [{"b64_json": ...}, ...]}` as JSON, base64-encoding each image chunk by chunk.
+
+    Only one chunk of base64 exists at a time (instead of a base64 copy of every image plus the
+    serialized body), and each image is dropped once it has been written. The encoding time
+    (excluding time spent waiting on the client) is observed as the "b64_stream" phase under
+    `labels`, captured by the caller since the body is produced after the handler returns.
+    """
+    pending = deque(images)
+    del images
+    encode_s = 0.0
+    try:
+        yield json.dumps(head)[:-1].encode("utf-8") + b', "data": ['
+        first = True
+        while pending:
+            view = memoryview(pending.popleft())
+            yield (b"" if first else b", ") + b'{"b64_json": "'
+            first = False
+            for start in range(0, len(view), _B64_CHUNK):
+                started = time.perf_counter()
+                chunk = base64.b64encode(view[start : start + _B64_CHUNK])
+                encode_s += time.perf_counter() - started
+                yield chunk
+            del view
+            yield b'"}'
+        yield b"]}"
+    finally:
+        _METRICS.observe("shim_phase_seconds", encode_s, **{**labels, "phase": "b64_stream"})
+
+
+class _ImageLinks:
+    """Image names handed out as response_format=url links, and the upstream holding each image.
+
+    A link stays valid for SHIM_GALLERY_RETENTION_S, the same delay after which gallery cleanup
+    may delete the image. Links live in memory only.
+    """
+
+    def __init__(self) -> None:
+        # image_name -> (base_url, expires_at), in expiry order.
+        self._links: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def _prune(self) -> None:
+        now = time.time()
+        while self._links:
+            name, (_, expires_at) = next(iter(self._links.items()))
+            if expires_at > now:
+                break
+            del self._links[name]
+
+    def add(self, cfg: ShimConfig, image_name: str) -> None:
+        self._prune()
+        self._links[image_name] = (cfg.invokeai_base_url, time.time() + cfg.gallery_retention_s)
+        self._links.move_to_end(image_name)
+
+    def get(self, image_name: str) -> Optional[str]:
+        self._prune()
+        link = self._links.get(image_name)
+        return link[0] if link else None
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+
+_LINKS = _ImageLinks()
 
-    item_id = _extract_item_id(enqueue_result)
 
-    # Poll queue item until completion
-    get_item_urls = (
-        f"{cfg.invokeai_base_url}/api/v2/queue/{urllib.parse.quote(cfg.queue_id)}/i/{urllib.parse.quote(str(item_id))}",
-        f"{cfg.invokeai_base_url}/api/v2/queue/{urllib.parse.quote(cfg.queue_id)}/items/{urllib.parse.quote(str(item_id))}",
-        f"{cfg.invokeai_base_url}/api/v1/queue/{urllib.parse.quote(cfg.queue_id)}/i/{urllib.parse.quote(str(item_id))}",
-        f"{cfg.invokeai_base_url}/api/v1/queue/{urllib.parse.quote(cfg.queue_id)}/items/{urllib.parse.quote(str(item_id))}",
+def _url_outputs(image_names: List[str], base_url: str) -> List[Dict[str, str]]:
+    return [{"url": f"{base_url.rstrip('/')}/v1/images/files/{urllib.parse.quote(name)}"} for name in image_names]
+
+
+async def _invokeai_generate_job_result(
+    req: ImagesGenerationsRequest, *, cfg: ShimConfig, spec: _OutputSpec, link_base_url: Optional[str] = None
+) -> Dict[str, Any]:
+    """An async job's result body; with `link_base_url` (response_format=url), links instead of base64."""
+    if link_base_url is not None:
+        names = await _invokeai_generate_images(req, cfg=cfg, as_links=True)
+        data = _url_outputs(names, link_base_url)
+    else:
+        images = await _invokeai_generate_images(req, cfg=cfg)
+        data = await _encode_outputs(images, spec, cfg=cfg)
+    return {"created": int(time.time()), "output_format": spec.format, "data": data}
+
+
+def _select_preset(req: ImagesGenerationsRequest, cfg: ShimConfig) -> Tuple[str, Optional[Dict[str, Any]], str]:
+    """Returns (requested model or SHIM_DEFAULT_MODEL, its preset if any, model name to resolve)."""
+    presets = _parse_model_presets(cfg.model_presets_json)
+
+    requested_model = (req.model or "").strip()
+    fallback_model = (cfg.default_model or "").strip()
+    requested_or_default = requested_model or fallback_model
+
+    preset = presets.get(requested_or_default.lower()) if requested_or_default else None
+    if preset is not None:
+        preset_model = (preset.get("model") or preset.get("upstream_model") or "").strip()
+        if preset_model:
+            model_name = preset_model
+        else:
+            model_name = requested_or_default
+    else:
+        model_name = requested_or_default
+    return requested_or_default, preset, model_name
+
+
+async def _invokeai_generate_images(
+    req: ImagesGenerationsRequest, *, cfg: ShimConfig, as_links: bool = False
+) -> List[Any]:
+    """Generate `req.n` images on the best upstream (`_POOL`); returns PNG bytes in batch order.
+
+    With `as_links` nothing is downloaded: the images' names are returned, linked for
+    GET /v1/images/files/{name}. If that upstream stops answering, the generation is retried
+    on the next best one.
+    """
+    urls = _upstream_urls(cfg)
+    if len(urls) == 1:
+        return await _invokeai_generate_images_on(req, cfg=cfg, as_links=as_links)
+
+    _, _, model_name = _select_preset(req, cfg)
+    tried: List[str] = []
+    while True:
+        url = _POOL.pick(urls, model_name=model_name, exclude=tried)
+        upstream = _POOL.get(url)
+        upstream.routed += req.n
+        try:
+            return await _invokeai_generate_images_on(
+                req, cfg=dataclasses.replace(cfg, invokeai_base_url=url), as_links=as_links
+            )
+        except HTTPException as exc:
+            if not _is_upstream_down(exc):
+                raise
+            _POOL.mark_down(url, exc.detail)
+            tried.append(url)
+            if len(tried) == len(urls):
+                raise
+            upstream.failovers += 1
+            _METRICS.inc("shim_upstream_failovers_total", **_labels(), upstream=url)
+            logger.warning("Failing over from upstream %s: %s", url, exc.detail)
+        finally:
+            upstream.routed -= req.n
+
+
+async def _invokeai_generate_images_on(
+    req: ImagesGenerationsRequest, *, cfg: ShimConfig, as_links: bool = False
+) -> List[Any]:
+    """Generate `req.n` images as a single InvokeAI batch on `cfg.invokeai_base_url`; returns PNG bytes in batch order."""
+    width, height = _parse_size(req.size)
+
+    requested_or_default, preset, model_name = _select_preset(req, cfg)
+
+    # Apply preset defaults only when request omits them.
+    steps = req.steps if req.steps is not None else _as_int(preset.get("steps") if preset else None)
+    cfg_scale = req.cfg_scale if req.cfg_scale is not None else _as_float(preset.get("cfg_scale") if preset else None)
+    scheduler = (req.scheduler or "").strip() or ((preset.get("scheduler") or "").strip() if preset else "")
+    scheduler = scheduler or None
+    priority = (req.priority or "").strip().lower() or (
+        (str(preset.get("priority") or "").strip().lower() if preset else "") or cfg.default_priority
     )
+    if priority not in {"interactive", "batch"}:
+        raise HTTPException(status_code=400, detail=f"Unknown priority '{priority}' (expected interactive or batch)")
+
+    # Metric labels stay bounded: known presets, and models only once resolved against InvokeAI.
+    preset_label = requested_or_default.lower() if preset is not None else ""
+    _METRIC_LABELS.set({"preset": preset_label, "model": ""})
+    with _phase("model_resolution"):
+        model_info = await _resolve_model_info(model_name, cfg=cfg) if model_name else None
+    labels = {
+        "preset": preset_label,
+        "model": str((model_info or {}).get("name") or (model_info or {}).get("key") or "template"),
+    }
+    _METRIC_LABELS.set(labels)
+    gen = _CURRENT_GENERATION.get()
+    if gen is not None:
+        gen.labels = labels
+
+    # Presets may carry their own workflow template (and output node); otherwise use the global one.
+    template_path = ((preset.get("template") or "").strip() if preset else "") or cfg.graph_template_path
+    if not template_path:
+        raise HTTPException(status_code=500, detail="SHIM_GRAPH_TEMPLATE_PATH is required for invokeai_queue mode")
+    template_output_node = ((preset.get("output_node_id") or "").strip() if preset else "") or cfg.output_node_id
+    # Resolved first so a (cached) OpenAPI discovery is timed as its own phase, not as "template".
+    flatten = await _effective_flatten_inputs(cfg)
+    with _phase("template"):
+        compiled = await _TEMPLATES.get(template_path, flatten=flatten, cfg=cfg, output_node_id=template_output_node)
+        graph_api = compiled.render(
+            prompt=req.prompt,
+            negative_prompt=(req.negative_prompt or "").strip(),
+            width=width,
+            height=height,
+            seed=req.seed,
+            steps=steps,
+            cfg_scale=cfg_scale,
+            scheduler=scheduler,
+            model_info=model_info,
+            model_input_mode=cfg.model_input_mode,
+        )
+
+    for node_id, model_path in compiled.model_loaders:
+        logger.info("Model loader input node_id=%s model=%s", node_id, _get_json_path(graph_api, model_path))
+    if preset is not None:
+        _WARMER.bind(cfg.invokeai_base_url, preset_label, _graph_model_key(compiled, graph_api))
+
+    if cfg.debug_graph_path:
+        try:
+            logger.info("Writing debug graph to %s", cfg.debug_graph_path)
+            await asyncio.to_thread(_write_json, cfg.debug_graph_path, graph_api)
+            logger.info("Debug graph written to %s", cfg.debug_graph_path)
+        except Exception as e:
+            logger.exception("Failed to write debug graph to %s", cfg.debug_graph_path)
+            raise HTTPException(status_code=500, detail=f"Failed to write SHIM_DEBUG_GRAPH_PATH: {e}")
+
+    # Preflight: ensure the model input is present for model loader nodes.
+    for node_id, model_path in compiled.model_loaders:
+        model_value = _get_json_path(graph_api, model_path)
+        missing = False
+        if model_value is None:
+            missing = True
+        elif isinstance(model_value, str) and not model_value.strip():
+            missing = True
+        elif isinstance(model_value, dict):
+            if not model_value:
+                missing = True
+            elif cfg.model_input_mode == "id":
+                key = model_value.get("key") if isinstance(model_value.get("key"), str) else None
+                if not key or not key.strip():
+                    missing = True
+
+        if missing:
+            raise HTTPException(
+                status_code=500,
+                detail=(
+                    "Preflight missing/empty model input in graph "
+                    f"(node_id={node_id}, model_input_mode={cfg.model_input_mode}, model={model_value!r})"
+                ),
+            )
+
+    # Explicit seeds follow the OpenAI-ish convention seed, seed+1, ...
+    if req.seed is not None:
+        seeds = [int(req.seed) + i for i in range(req.n)]
+    elif req.n > 1:
+        seeds = [random.randint(0, 2**32 - 1) for _ in range(req.n)]
+    else:
+        seeds = []
+
+    async def _generate(indices: List[int]) -> List[Any]:
+        if not seeds:
+            return await _run_invokeai_batch(
+                cfg,
+                compiled=compiled,
+                graph_api=graph_api,
+                seeds=None,
+                runs=req.n,
+                prepend=priority == "interactive",
+                as_links=as_links,
+            )
+        wanted = [seeds[i] for i in indices]
+        # The rendered graph already carries req.seed; only vary it when that isn't enough.
+        return await _run_invokeai_batch(
+            cfg,
+            compiled=compiled,
+            graph_api=graph_api,
+            seeds=None if wanted == [req.seed] else wanted,
+            runs=len(wanted),
+            prepend=priority == "interactive",
+            as_links=as_links,
+        )
+
+    # A seeded request is deterministic (given a template that actually takes the seed), so its
+    # images can be served from / stored in the content-addressed result cache. Links aren't cached.
+    if cfg.result_cache_dir and req.seed is not None and compiled.slots.get("seed") and not as_links:
+        fields = {
+            "prompt": req.prompt,
+            "negative_prompt": (req.negative_prompt or "").strip(),
+            "width": width,
+            "height": height,
+            # The model the rendered graph actually loads, so a template-pinned model keys correctly.
+            "model": _graph_model_key(compiled, graph_api),
+            "steps": steps,
+            "cfg_scale": cfg_scale,
+            "scheduler": scheduler,
+        }
+        keys = [_result_cache_key(compiled, seed=seed, **fields) for seed in seeds]
+        return await _RESULTS.fetch_or_generate(cfg, keys, _generate)
+
+    return await _generate(list(range(req.n)))
+
+
+async def _run_invokeai_batch(
+    cfg: ShimConfig,
+    *,
+    compiled: _CompiledTemplate,
+    graph_api: dict,
+    seeds: Optional[List[int]],
+    runs: int,
+    prepend: bool,
+    as_links: bool = False,
+) -> List[Any]:
+    """Enqueue `graph_api` once and return `runs` PNGs (with `as_links`, image names) in batch order.
+
+    With `seeds`, each queue item gets its own seed via batch data (len(seeds) == runs).
+    Waits for its model's turn (the upstream's scheduler), then raises 429 (via its admission
+    controller) instead of enqueueing when InvokeAI is saturated.
+    """
+    upstream = _upstream(cfg)
+    model_key = _graph_model_key(compiled, graph_api)
+    async with upstream.scheduler.slot(cfg, model_key):
+        with _phase("admission"):
+            await upstream.admission.admit(cfg, runs)
+        try:
+            images = await _enqueue_and_wait(
+                cfg,
+                compiled=compiled,
+                graph_api=graph_api,
+                seeds=seeds,
+                runs=runs,
+                prepend=prepend,
+                as_links=as_links,
+            )
+        finally:
+            upstream.admission.release(runs)
+    _WARMER.touch(cfg.invokeai_base_url, model_key)
+    return images
+
+
+async def _enqueue_and_wait(
+    cfg: ShimConfig,
+    *,
+    compiled: _CompiledTemplate,
+    graph_api: dict,
+    seeds: Optional[List[int]],
+    runs: int,
+    prepend: bool,
+    as_links: bool = False,
+) -> List[Any]:
+    output_node_id = compiled.output_node_id
+    origin = f"openai-images-shim:{int(time.time() * 1000)}"
+
+    def _extract_item_ids(enqueue_result: Any) -> List[str]:
+        if not isinstance(enqueue_result, dict):
+            raise HTTPException(status_code=502, detail=f"InvokeAI enqueue returned non-object: {enqueue_result}")
+
+        # Common shapes observed across versions:
+        # - {"item_ids": [123]}
+        # - {"item_ids": ["123"]}
+        # - {"item_id": 123}
+        for key in ("item_ids", "item_id"):
+            v = enqueue_result.get(key)
+            if isinstance(v, list) and v and all(isinstance(x, (int, str)) for x in v):
+                return [str(x) for x in v]
+            if isinstance(v, (int, str)):
+                return [str(v)]
+
+        raise HTTPException(status_code=502, detail=f"InvokeAI enqueue returned unexpected payload: {enqueue_result}")
+
+    batch: Dict[str, Any] = {
+        "graph": graph_api,
+        "origin": origin,
+        "destination": "openai-images",
+        "runs": 1,
+    }
+    if seeds:
+        # One submission for all images; each queue item gets its own seed via batch data.
+        seed_data = compiled.batch_data("seed", seeds)
+        if seed_data:
+            batch["data"] = [seed_data]
+        else:
+            # Template has no seed inputs to vary; n copies is the best we can do.
+            batch["runs"] = runs
+    elif runs > 1:
+        batch["runs"] = runs
+
+    enqueue_body = {
+        "prepend": prepend,
+        "batch": batch,
+    }
+
+    async def _enqueue_candidates() -> AsyncIterator[Tuple[str, str]]:
+        for route in await _discover_queue_enqueue_endpoints(cfg):
+            yield route
+        for route in _ENQUEUE_ROUTES:
+            yield route
+
+    used_enqueue: List[str] = []
+
+    async def _enqueue(method: str, url: str) -> Any:
+        out = await _http_json(method, url, enqueue_body, timeout=30)
+        used_enqueue[:] = [method, url]
+        return out if out is not None else {}
+
+    with _phase("enqueue"):
+        enqueue_result, last_exc = await _route_call(
+            cfg,
+            "enqueue",
+            _enqueue_candidates,
+            _enqueue,
+            # The learned route stopped working: the cached schema is likely out of date too.
+            on_relearn=lambda: _SCHEMA_CACHE.invalidate(cfg.invokeai_base_url),
+        )
+    enqueued_at = time.time()
+    if enqueue_result is None:
+        raise last_exc or HTTPException(status_code=502, detail="No InvokeAI enqueue endpoint accepted the batch")
+
+    if used_enqueue:
+        logger.info("Enqueued InvokeAI batch via %s %s", used_enqueue[0], used_enqueue[1])
+
+    item_ids = _extract_item_ids(enqueue_result)
+    if len(item_ids) < runs:
+        raise HTTPException(
+            status_code=502,
+            detail=f"InvokeAI enqueued {len(item_ids)} item(s) for n={runs}: {enqueue_result}",
+        )
+    item_ids = item_ids[:runs]
+    gen = _CURRENT_GENERATION.get()
+    if gen is not None:
+        gen.item_ids.extend(item_ids)
+
+    # Wait for completion: event-driven when the queue event stream is up, otherwise
+    # adaptive polling. Either way the queue item API stays the source of truth.
+    # Items are awaited (and their images fetched) concurrently.
+    events = _upstream(cfg).events
+    events.start(cfg)
+    if gen is not None and gen.on_event is not None:
+        for item_id in item_ids:
+            events.listen(item_id, gen.on_event)
+    waits = [
+        asyncio.ensure_future(
+            _await_queue_item(
+                cfg,
+                item_id=item_id,
+                output_node_id=output_node_id,
+                graph_api=graph_api,
+                enqueued_at=enqueued_at,
+                as_links=as_links,
+            )
+        )
+        for item_id in item_ids
+    ]
+    try:
+        return list(await asyncio.gather(*waits))
+    except BaseException as exc:
+        # Timeout, failure of a sibling item, client disconnect or explicit cancel: nobody will
+        # fetch the remaining results, so stop them from occupying the GPU.
+        orphaned = [
+            item_id
+            for item_id, w in zip(item_ids, waits)
+            if not (w.done() and not w.cancelled() and w.exception() is None)
+        ]
+        for w in waits:
+            w.cancel()
+        if orphaned:
+            reason = "client disconnected or canceled" if isinstance(exc, asyncio.CancelledError) else "request failed"
+            _spawn(_cancel_queue_items(cfg, orphaned, reason=reason), name="cancel-queue-items")
+        raise
+    finally:
+        for item_id in item_ids:
+            events.release(item_id)
+
+
+def _record_queue_item_phases(queue_item: dict, *, enqueued_at: float) -> None:
+    # queue_wait/execution come from InvokeAI's own timestamps; completion_detect is how long the
+    # shim took to notice (the number to watch when tuning SHIM_POLL_INTERVAL_S / queue events).
+    started = _parse_invokeai_timestamp(queue_item.get("started_at"))
+    completed = _parse_invokeai_timestamp(queue_item.get("completed_at"))
+    if started is not None:
+        _METRICS.observe("shim_phase_seconds", max(0.0, started - enqueued_at), **_labels(phase="queue_wait"))
+    if started is not None and completed is not None and completed >= started:
+        _METRICS.observe("shim_phase_seconds", completed - started, **_labels(phase="execution"))
+    if completed is not None:
+        _METRICS.observe("shim_phase_seconds", max(0.0, time.time() - completed), **_labels(phase="completion_detect"))
+
+
+async def _await_queue_item(
+    cfg: ShimConfig, *, item_id: str, output_node_id: str, graph_api: dict, enqueued_at: float, as_links: bool = False
+) -> Any:
+    """Wait for `item_id` and return its image's bytes (with `as_links`, its linked image name instead)."""
     deadline = time.time() + cfg.timeout_s
     last_status = None
+    poll_delay = cfg.poll_interval_s
+    # Terminal status announced by the event stream, if any (the GET above may lag behind it).
+    event_status: Optional[str] = None
 
     while time.time() < deadline:
-        queue_item: Any = None
-        last_exc = None
-        for get_item_url in get_item_urls:
-            try:
-                queue_item = _http_json("GET", get_item_url, payload=None, timeout=30)
-                last_exc = None
-                break
-            except HTTPException as exc:
-                last_exc = exc
-                if _is_not_found(exc):
-                    continue
-                raise
-        if last_exc is not None:
+        queue_item, last_exc = await _route_call(
+            cfg,
+            "get_queue_item",
+            lambda: _QUEUE_ITEM_ROUTES,
+            lambda method, url: _http_json(method, url, payload=None, timeout=30),
+            params={"item_id": str(item_id)},
+            is_miss=_is_not_found,
+        )
+        if queue_item is None and last_exc is not None:
             raise last_exc
         if not isinstance(queue_item, dict):
             raise HTTPException(status_code=502, detail=f"InvokeAI get_queue_item returned non-object: {queue_item}")
@@ -1277,31 +4026,32 @@ def _invokeai_generate_b64(req: ImagesGenerationsRequest, *, cfg: ShimConfig) ->
         last_status = status
 
         if status == "completed":
+            _upstream(cfg).admission.observe(queue_item)
+            _record_queue_item_phases(queue_item, enqueued_at=enqueued_at)
             image_name = _extract_image_name_from_queue_item(queue_item, output_node_id)
-            image_urls = (
-                f"{cfg.invokeai_base_url}/api/v1/images/i/{urllib.parse.quote(image_name)}/full",
-                f"{cfg.invokeai_base_url}/api/v1/images/i/{urllib.parse.quote(image_name)}",
-            )
-            image_bytes: Optional[bytes] = None
-            last_exc = None
-            for image_url in image_urls:
-                try:
-                    image_bytes = _http_bytes(image_url, timeout=60)
-                    last_exc = None
-                    break
-                except HTTPException as exc:
-                    last_exc = exc
-                    if _is_not_found(exc):
-                        continue
-                    raise
+            if as_links:
+                # Served later by GET /v1/images/files/{name}, streamed straight from InvokeAI.
+                _LINKS.add(cfg, image_name)
+                _JANITOR.add(cfg, image_name)
+                return image_name
+            with _phase("download"):
+                image_bytes, last_exc = await _route_call(
+                    cfg,
+                    "image",
+                    lambda: _IMAGE_ROUTES,
+                    lambda method, url: _http_bytes(url, timeout=60),
+                    params={"image_name": image_name},
+                    is_miss=_is_not_found,
+                )
             if image_bytes is None and last_exc is not None:
                 raise last_exc
             if image_bytes is None:
                 raise HTTPException(status_code=502, detail="InvokeAI did not return image bytes")
+            _JANITOR.add(cfg, image_name)
 
             if cfg.save_last_image_path:
-                _best_effort_write_last_image(image_bytes, cfg.save_last_image_path)
-            return base64.b64encode(image_bytes).decode("ascii")
+                await asyncio.to_thread(_best_effort_write_last_image, image_bytes, cfg.save_last_image_path)
+            return image_bytes
 
         if status == "failed":
             error_type = queue_item.get("error_type")
@@ -1324,8 +4074,7 @@ def _invokeai_generate_b64(req: ImagesGenerationsRequest, *, cfg: ShimConfig) ->
                     dumped = (
                         f"/var/lib/invokeai/openai_images_shim/failed_graph_{int(time.time() * 1000)}.json"
                     )
-                    with open(dumped, "w", encoding="utf-8") as f:
-                        json.dump(graph_api, f, indent=2)
+                    await asyncio.to_thread(_write_json, dumped, graph_api)
                 except Exception:
                     dumped = None
 
@@ -1341,7 +4090,16 @@ def _invokeai_generate_b64(req: ImagesGenerationsRequest, *, cfg: ShimConfig) ->
         if status == "canceled":
             raise HTTPException(status_code=502, detail="InvokeAI generation canceled")
 
-        time.sleep(cfg.poll_interval_s)
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        events = _upstream(cfg).events
+        if events.connected and event_status is None:
+            event_status = await events.wait(item_id, timeout=min(remaining, cfg.event_repoll_s))
+        else:
+            # No events, or the event arrived before InvokeAI committed the row: poll with backoff.
+            await asyncio.sleep(min(poll_delay, remaining))
+            poll_delay = min(poll_delay * 1.5, max(cfg.poll_interval_s, cfg.poll_max_interval_s))
 
     raise HTTPException(status_code=504, detail=f"Timed out waiting for InvokeAI completion (last_status={last_status})")
 
@@ -1352,40 +4110,28 @@ def healthz() -> Dict[str, str]:
 
 
 @app.get("/readyz")
-def readyz() -> Dict[str, Any]:
+async def readyz() -> Dict[str, Any]:
     cfg = _get_config()
-    # If InvokeAI isn't reachable, we are not ready.
-    version_urls = (
-        f"{cfg.invokeai_base_url}/api/v1/app/version",
-        f"{cfg.invokeai_base_url}/api/v1/version",
-        f"{cfg.invokeai_base_url}/api/v1/app",
-    )
-
-    version: Any = None
-    last_exc: Optional[HTTPException] = None
-    for version_url in version_urls:
-        try:
-            version = _http_json("GET", version_url, payload=None, timeout=5)
-            last_exc = None
-            break
-        except HTTPException as exc:
-            last_exc = exc
-            if _is_not_found(exc):
-                continue
-            raise
-
-    if last_exc is not None:
-        raise last_exc
-
-    fmt = (cfg.graph_inputs_format or "auto").strip().lower()
-    if fmt in {"flat", "inputs"}:
-        effective_fmt = fmt
-    else:
-        detected = _invokeai_queue_prefers_flat_inputs(cfg.invokeai_base_url)
-        if detected is None:
-            effective_fmt = "inputs"
-        else:
-            effective_fmt = "flat" if detected else "inputs"
+    # Served from the background probe (_POOL.run). Probe inline only before its first result, or
+    # when it has gone stale (stub mode runs no prober); concurrent callers share that probe.
+    urls = _upstream_urls(cfg)
+    now = time.time()
+    stale = [u for u in urls if now - (_POOL.get(u).checked_at or 0.0) > cfg.ready_max_age_s]
+    if stale:
+        await asyncio.gather(*(_POOL.check(dataclasses.replace(cfg, invokeai_base_url=u)) for u in stale))
+    # Ready while any upstream answers: generations fail over to it (_invokeai_generate_images).
+    healthy = [u for u in urls if _POOL.get(u).healthy]
+    if not healthy:
+        primary = _POOL.get(urls[0])
+        raise HTTPException(status_code=primary.error_status, detail=primary.error)
+    up = _POOL.get(healthy[0])
+
+    schema_entry = _SCHEMA_CACHE.peek(up.url)
+    schema_age_s = round(time.time() - schema_entry.fetched_at, 1) if schema_entry and schema_entry.schema else None
+    models_entry = _MODELS.peek(up.url)
+
+    def _per_upstream(snapshot: Callable[[_Upstream], Any]) -> Dict[str, Any]:
+        return {url: snapshot(_POOL.get(url)) for url in urls}
 
     return {
         "status": "ok",
@@ -1394,27 +4140,75 @@ def readyz() -> Dict[str, Any]:
         "shim_file_sha256": _shim_file_sha256_prefix(),
         "shim_model_input_mode": cfg.model_input_mode,
         "shim_graph_inputs_format": cfg.graph_inputs_format,
-        "shim_graph_inputs_effective": effective_fmt,
+        "shim_graph_inputs_effective": up.inputs_format,
+        "shim_openapi_cache_age_s": schema_age_s,
+        "shim_model_registry": (
+            {
+                "models": len(models_entry.models),
+                "age_s": round(time.time() - models_entry.fetched_at, 1),
+                "resolved": len(models_entry.resolved),
+            }
+            if models_entry
+            else None
+        ),
+        "shim_learned_routes": await _ROUTES.snapshot(dataclasses.replace(cfg, invokeai_base_url=up.url)),
+        "shim_result_cache": await asyncio.to_thread(_RESULTS.snapshot, cfg) if cfg.result_cache_dir else None,
+        "shim_admission": _per_upstream(lambda u: u.admission.snapshot()),
+        "shim_model_affinity": _per_upstream(lambda u: u.scheduler.snapshot()),
+        "shim_upstreams": _POOL.snapshot(cfg),
+        "shim_healthy_upstreams": healthy,
+        "shim_warm_presets": _WARMER.snapshot(cfg),
+        "shim_gallery_cleanup": _JANITOR.snapshot(cfg),
+        "shim_compiled_templates": _TEMPLATES.snapshot(),
+        "shim_queue_events": _per_upstream(lambda u: u.events.state(cfg)),
         "shim_save_last_image_path": cfg.save_last_image_path,
-        "invokeai_version": version,
+        "shim_ready_probe": _per_upstream(
+            lambda u: {
+                "age_s": round(time.time() - u.checked_at, 1) if u.checked_at else None,
+                "duration_s": u.probe_s,
+            }
+        ),
+        "invokeai_version": up.version,
     }
 
 
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    cfg = _get_config()
+    upstreams = [_POOL.get(url) for url in _upstream_urls(cfg)]
+    gauges: List[Tuple[str, str, float]] = [
+        ("shim_inflight_requests", "Generations currently being served.", len(_GENERATIONS)),
+        (
+            "shim_inflight_queue_items",
+            "InvokeAI queue items enqueued by this shim and not yet collected.",
+            sum(up.admission.inflight for up in upstreams),
+        ),
+        (
+            "shim_queue_events_connected",
+            "Upstreams whose InvokeAI queue event stream is connected.",
+            sum(1 for up in upstreams if up.events.connected),
+        ),
+        ("shim_upstreams_healthy", "InvokeAI upstreams currently answering.", sum(1 for up in upstreams if up.healthy)),
+    ]
+    depths = [d for d in (up.admission.snapshot()["queue_depth"] for up in upstreams) if d is not None]
+    if depths:
+        gauges.append(("shim_invokeai_queue_depth_last", "Last sampled InvokeAI pending + in-progress count (all upstreams).", sum(depths)))
+    if cfg.result_cache_dir:
+        gauges.append(("shim_result_cache_bytes", "Bytes held by the on-disk result cache.", _RESULTS.snapshot(cfg)["bytes"]))
+    return PlainTextResponse(_METRICS.render(gauges), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/v1/models")
-def list_models(raw: bool = False) -> Dict[str, Any]:
+async def list_models(raw: bool = False) -> Dict[str, Any]:
     cfg = _get_config()
 
     presets = _parse_model_presets(cfg.model_presets_json)
     preset_names = sorted(presets.keys())
 
-    source_url: Optional[str] = None
-    upstream: List[dict] = []
-    upstream_error: Optional[str] = None
-    try:
-        source_url, upstream = _list_invokeai_models(cfg=cfg)
-    except HTTPException as exc:
-        upstream_error = str(exc.detail)
-        upstream = []
+    registry = await _MODELS.get(cfg)
+    source_url = registry.source_url
+    upstream = list(registry.models)
+    upstream_error = registry.error
 
     seen: set[str] = set()
     data: List[Dict[str, Any]] = []
@@ -1480,42 +4274,158 @@ def list_models(raw: bool = False) -> Dict[str, Any]:
             "source_url": source_url,
             "upstream_error": upstream_error,
             "upstream_models_raw": upstream,
+            "cache_age_s": round(time.time() - registry.fetched_at, 1),
             "preset_names": preset_names,
         }
     return resp
 
 
 @app.get("/__debug/upstream/openapi")
-def debug_upstream_openapi() -> Any:
+async def debug_upstream_openapi() -> Any:
     cfg = _get_config()
     if not cfg.enable_debug_endpoints:
         raise HTTPException(status_code=404, detail="Not Found")
 
-    schema = _fetch_openapi_schema(cfg.invokeai_base_url)
+    # Always re-fetch here (and refresh the cache) so this reflects the live upstream.
+    schema = (await _SCHEMA_CACHE.refresh(cfg.invokeai_base_url, ttl_s=cfg.openapi_cache_ttl_s)).schema
     if schema is None:
         raise HTTPException(status_code=502, detail="Failed to fetch upstream OpenAPI schema")
     return schema
 
 
 @app.post("/v1/images/generations")
-def images_generations(body: ImagesGenerationsRequest) -> Dict[str, Any]:
+async def images_generations(
+    body: ImagesGenerationsRequest,
+    request: Request,
+    response: Response,
+    async_: bool = Query(False, alias="async"),
+) -> Any:
     cfg = _get_config()
 
-    # Gateway forces this; be lenient but ensure output is always b64_json.
-    if body.response_format and body.response_format != "b64_json":
-        raise HTTPException(status_code=400, detail="Only response_format='b64_json' is supported")
+    # The gateway forces b64_json. url returns links served (streamed from InvokeAI) by the shim.
+    response_format = (body.response_format or "b64_json").strip().lower()
+    if response_format not in {"b64_json", "url"}:
+        raise HTTPException(status_code=400, detail="response_format must be 'b64_json' or 'url'")
 
     created = int(time.time())
 
     if cfg.mode == "stub":
+        if response_format == "url":
+            raise HTTPException(status_code=400, detail="response_format='url' needs SHIM_MODE=invokeai_queue")
         data = [{"b64_json": _STUB_PNG_B64} for _ in range(body.n)]
         return {"created": created, "data": data}
 
     if cfg.mode == "invokeai_queue":
-        outputs: List[Dict[str, str]] = []
-        for _ in range(body.n):
-            b64_json = _invokeai_generate_b64(body, cfg=cfg)
-            outputs.append({"b64_json": b64_json})
-        return {"created": created, "data": outputs}
+        spec = _output_spec(body, cfg)
+        # Links stream InvokeAI's own PNG, so there is nothing to re-encode.
+        link_base_url = str(request.base_url) if response_format == "url" else None
+        if link_base_url is not None and not spec.passthrough:
+            raise HTTPException(status_code=400, detail="response_format='url' only returns png at its original size")
+        # Callers that may want to cancel pass their own id (X-Request-Id); otherwise one is generated.
+        gen_id = (request.headers.get("x-request-id") or "").strip() or uuid.uuid4().hex
+        response.headers["X-Shim-Generation-Id"] = gen_id
+
+        # Async jobs (?async=true or "Prefer: respond-async") return immediately; poll
+        # GET /v1/images/jobs/{id} or stream GET /v1/images/jobs/{id}/events.
+        if async_ or "respond-async" in (request.headers.get("prefer") or "").lower():
+            job = _submit_job(
+                cfg, gen_id, _invokeai_generate_job_result(body, cfg=cfg, spec=spec, link_base_url=link_base_url)
+            )
+            response.status_code = 202
+            response.headers["Location"] = f"/v1/images/jobs/{job.id}"
+            return job.public()
+
+        if link_base_url is not None:
+            names = await _run_generation(request, gen_id, _invokeai_generate_images(body, cfg=cfg, as_links=True))
+            return {"created": created, "output_format": spec.format, "data": _url_outputs(names, link_base_url)}
+
+        images = await _run_generation(request, gen_id, _invokeai_generate_images(body, cfg=cfg))
+        images = await _encode_images(images, spec, cfg=cfg)
+        # Streamed: base64 is produced chunk by chunk rather than held as a second copy of every image.
+        return StreamingResponse(
+            _stream_images_json({"created": created, "output_format": spec.format}, images, labels=_labels()),
+            media_type="application/json",
+            headers={"X-Shim-Generation-Id": gen_id},
+        )
 
     raise HTTPException(status_code=500, detail=f"Unknown SHIM_MODE '{cfg.mode}'")
+
+
+@app.get("/v1/images/files/{image_name}")
+async def image_file(image_name: str) -> StreamingResponse:
+    """Stream a response_format=url image from its InvokeAI upstream, chunk by chunk."""
+    cfg = _get_config()
+    base_url = _LINKS.get(image_name)
+    if base_url is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired image '{image_name}'")
+    upstream_resp, last_exc = await _route_call(
+        dataclasses.replace(cfg, invokeai_base_url=base_url),
+        "image",
+        lambda: _IMAGE_ROUTES,
+        lambda method, url: _http_stream(url, timeout=60),
+        params={"image_name": image_name},
+        is_miss=_is_not_found,
+    )
+    if upstream_resp is None:
+        raise last_exc or HTTPException(status_code=502, detail="InvokeAI did not return image bytes")
+    headers = {k: upstream_resp.headers[k] for k in ("content-length", "content-encoding") if k in upstream_resp.headers}
+    return StreamingResponse(
+        upstream_resp.aiter_raw(),
+        media_type=upstream_resp.headers.get("content-type", "image/png"),
+        headers=headers,
+        background=BackgroundTask(upstream_resp.aclose),
+    )
+
+
+@app.post("/v1/images/generations/{gen_id}/cancel")
+@app.post("/v1/images/jobs/{gen_id}/cancel")
+async def cancel_generation(gen_id: str) -> Dict[str, Any]:
+    gen = _GENERATIONS.get(gen_id)
+    if gen is None or gen.task is None:
+        raise HTTPException(status_code=404, detail=f"No in-flight generation '{gen_id}'")
+    gen.task.cancel()
+    return {"id": gen.id, "status": "canceled", "item_ids": list(gen.item_ids)}
+
+
+@app.get("/v1/images/jobs/{job_id}")
+async def get_job(job_id: str) -> Dict[str, Any]:
+    job = _JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return job.public()
+
+
+@app.get("/v1/images/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    """Server-sent events: `status`, `progress` (with low-res `preview` when InvokeAI sends one) and a final `done`."""
+    job = _JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+
+    async def _stream() -> AsyncIterator[str]:
+        queue = job.subscribe()
+        try:
+            yield _sse("status", {"id": job.id, "status": job.status})
+            if job.progress is not None and not job.done:
+                yield _sse("progress", {"id": job.id, **job.progress})
+            if job.done:
+                yield _sse("done", job.public())
+                return
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream.
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse(event, data)
+                if event == "done":
+                    return
+        finally:
+            job.unsubscribe(queue)
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
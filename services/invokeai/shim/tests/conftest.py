@@ -0,0 +1,30 @@
+import dataclasses
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+# Import the shim via importlib to avoid package import issues in tests. Dataclasses resolve
+# their annotations through sys.modules, so register it there before executing it.
+_spec = importlib.util.spec_from_file_location(
+    "openai_images_shim", Path(__file__).resolve().parents[1] / "openai_images_shim.py"
+)
+_shim = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = _shim
+_spec.loader.exec_module(_shim)
+
+
+@pytest.fixture(scope="session")
+def shim_module():
+    return _shim
+
+
+@pytest.fixture
+def make_cfg(shim_module):
+    """ShimConfig from the environment defaults, with `overrides` applied."""
+
+    def _make(**overrides):
+        return dataclasses.replace(shim_module._get_config(), **overrides)
+
+    return _make
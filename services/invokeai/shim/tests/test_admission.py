@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+
+def test_admission_rejects_with_retry_after_once_inflight_limit_is_hit(shim_module, make_cfg):
+    cfg = make_cfg(max_inflight=2, max_queue_depth=0)
+    admission = shim_module._AdmissionController()
+    admission.exec_s = 3.0
+
+    async def run():
+        await admission.admit(cfg, 2)
+        with pytest.raises(HTTPException) as excinfo:
+            await admission.admit(cfg, 1)
+        return excinfo.value
+
+    exc = asyncio.run(run())
+    assert exc.status_code == 429
+    # One item over the limit at ~3s per item.
+    assert exc.headers == {"Retry-After": "3"}
+    assert admission.inflight == 2
+    assert admission.rejected == 1
+
+    admission.release(2)
+    asyncio.run(admission.admit(cfg, 2))
+    assert admission.inflight == 2
+
+
+def test_admission_counts_upstream_queue_depth(shim_module, make_cfg):
+    cfg = make_cfg(max_inflight=0, max_queue_depth=4, queue_status_ttl_s=3600.0)
+    admission = shim_module._AdmissionController()
+    # A fresh status sample: 3 items pending or running upstream.
+    admission._status_depth = 3
+    admission._status_at = time.time()
+
+    async def run():
+        await admission.admit(cfg, 1)
+        with pytest.raises(HTTPException) as excinfo:
+            await admission.admit(cfg, 2)
+        return excinfo.value
+
+    exc = asyncio.run(run())
+    assert exc.status_code == 429
+    assert "queue is full (4/4" in exc.detail
+    # Two items over the limit at the default per-item estimate.
+    assert exc.headers["Retry-After"] == str(int(2 * shim_module._AdmissionController._DEFAULT_EXEC_S))
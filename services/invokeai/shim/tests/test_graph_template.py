@@ -0,0 +1,101 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+
+TEMPLATE = Path(__file__).resolve().parents[1] / "graph_template.json"
+OUTPUT_NODE = "63e91020-83b2-4f35-b174-ad9692aabb48"
+NOISE_NODE = "55705012-79b9-4aac-9f26-c0b10309785b"
+DENOISE_NODE = "50a36525-3c0a-4cc5-977c-e4bfc3fd6dfb"
+MODEL_LOADER = "30d3289c-773c-4152-a9d2-bd8a99c8fd22"
+
+
+def _compile(shim, flatten):
+    st = os.stat(TEMPLATE)
+    return shim._compile_graph_template(
+        str(TEMPLATE), mtime_ns=st.st_mtime_ns, size=st.st_size, flatten=flatten, model_input_mode="key", output_node_id=None
+    )
+
+
+def _render(compiled, **overrides):
+    values = dict(
+        prompt="a red fox",
+        negative_prompt="blurry",
+        width=768,
+        height=512,
+        seed=42,
+        steps=4,
+        cfg_scale=2.5,
+        scheduler="euler",
+        model_info=None,
+        model_input_mode="key",
+    )
+    values.update(overrides)
+    return compiled.render(**values)
+
+
+@pytest.mark.parametrize("flatten", [False, True])
+def test_discovers_slots_and_output_node(shim_module, flatten):
+    compiled = _compile(shim_module, flatten)
+
+    assert compiled.output_node_id == OUTPUT_NODE
+    for slot in ("prompt", "negative_prompt", "width", "height", "seed", "steps", "cfg_scale", "scheduler", "model"):
+        assert compiled.slots.get(slot), slot
+    assert [node_id for node_id, _ in compiled.model_loaders] == [MODEL_LOADER]
+    # The flattened graph has no `inputs` wrapper, so neither do its slot paths.
+    assert all(("inputs" in path) != flatten for paths in compiled.slots.values() for path in paths)
+
+
+@pytest.mark.parametrize("flatten", [False, True])
+def test_render_patches_every_slot(shim_module, flatten):
+    compiled = _compile(shim_module, flatten)
+    graph = _render(compiled)
+
+    for slot, expected in (("prompt", "a red fox"), ("negative_prompt", "blurry"), ("steps", 4), ("cfg_scale", 2.5)):
+        for path in compiled.slots[slot]:
+            assert shim_module._get_json_path(graph, path) == expected, slot
+    noise = graph["nodes"][NOISE_NODE]
+    noise = noise.get("inputs", noise)
+    assert (noise["seed"], noise["width"], noise["height"]) == (42, 768, 512)
+    denoise = graph["nodes"][DENOISE_NODE]
+    assert denoise.get("inputs", denoise)["scheduler"] == "euler"
+
+
+def test_render_does_not_mutate_the_compiled_graph(shim_module):
+    compiled = _compile(shim_module, False)
+    before = repr(compiled.api_graph)
+
+    _render(compiled, prompt="first")
+    graph = _render(compiled, prompt="second", seed=None)
+
+    assert repr(compiled.api_graph) == before
+    assert shim_module._get_json_path(graph, compiled.slots["prompt"][0]) == "second"
+    # seed=None keeps the template's own seed.
+    assert graph["nodes"][NOISE_NODE]["inputs"]["seed"] == compiled.api_graph["nodes"][NOISE_NODE]["inputs"]["seed"]
+
+
+def test_model_key_prefers_the_requested_model(shim_module):
+    compiled = _compile(shim_module, False)
+
+    pinned = shim_module._graph_model_key(compiled, _render(compiled))
+    assert pinned == "2cbc1399-aac4-49a5-a6cf-11b2a3fd2e0f"
+
+    model = {"key": "k-turbo", "hash": "h", "name": "SDXL Turbo", "base": "sdxl", "type": "main"}
+    requested = shim_module._graph_model_key(compiled, _render(compiled, model_info=model))
+    assert requested == "k-turbo"
+
+
+def test_registry_recompiles_when_the_file_changes(shim_module, make_cfg, tmp_path):
+    path = tmp_path / "graph.json"
+    path.write_bytes(TEMPLATE.read_bytes())
+    cfg = make_cfg(model_input_mode="key")
+    registry = shim_module._TemplateRegistry()
+
+    first = asyncio.run(registry.get(str(path), flatten=False, cfg=cfg, output_node_id=None))
+    assert asyncio.run(registry.get(str(path), flatten=False, cfg=cfg, output_node_id=None)) is first
+
+    path.write_bytes(path.read_bytes() + b"\n")
+    second = asyncio.run(registry.get(str(path), flatten=False, cfg=cfg, output_node_id=None))
+    assert second is not first
+    assert second.digest != first.digest
@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+
+def test_affinity_groups_requests_by_model(shim_module, make_cfg):
+    cfg = make_cfg(affinity_max_wait_s=10.0)
+    scheduler = shim_module._ModelAffinityScheduler()
+    order = []
+
+    async def request(model, hold_s):
+        async with scheduler.slot(cfg, model):
+            order.append(model)
+            await asyncio.sleep(hold_s)
+
+    async def run():
+        first = asyncio.ensure_future(request("a", 0.05))
+        await asyncio.sleep(0)
+        # "b" has to wait for "a" to drain, but the later "a" joins the running model.
+        others = [asyncio.ensure_future(request(m, 0.0)) for m in ("b", "a", "b")]
+        await asyncio.gather(first, *others)
+
+    asyncio.run(run())
+    assert order == ["a", "a", "b", "b"]
+    assert scheduler.swaps == 1
+
+
+def test_affinity_wait_is_bounded(shim_module, make_cfg):
+    cfg = make_cfg(affinity_max_wait_s=0.1)
+    scheduler = shim_module._ModelAffinityScheduler()
+    dispatched = {}
+
+    async def request(model, hold_s):
+        async with scheduler.slot(cfg, model):
+            dispatched.setdefault(model, time.monotonic())
+            await asyncio.sleep(hold_s)
+
+    async def run():
+        started = time.monotonic()
+        # "a" stays busy well past the bound.
+        busy = asyncio.ensure_future(request("a", 1.0))
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(request("b", 0.0))
+        await asyncio.sleep(0.05)
+        assert "b" not in dispatched
+        await asyncio.sleep(0.15)
+        # Dispatched once it had waited SHIM_AFFINITY_MAX_WAIT_S, although "a" is still running.
+        assert "b" in dispatched
+        assert not busy.done()
+        assert scheduler.snapshot()["waiting"] == {}
+        await asyncio.gather(busy, waiting)
+        return started
+
+    started = asyncio.run(run())
+    assert 0.1 <= dispatched["b"] - started < 0.5
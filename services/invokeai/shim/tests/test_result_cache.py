@@ -0,0 +1,129 @@
+import asyncio
+
+from fastapi import HTTPException
+
+
+class FakeGenerator:
+    """Stands in for an InvokeAI batch: records which keys it was asked for."""
+
+    def __init__(self, keys, delay_s=0.0, error=None):
+        self.keys = keys
+        self.delay_s = delay_s
+        self.error = error
+        self.calls = []
+
+    async def __call__(self, indices):
+        self.calls.append([self.keys[i] for i in indices])
+        await asyncio.sleep(self.delay_s)
+        if self.error is not None:
+            raise self.error
+        return [f"png:{self.keys[i]}".encode() for i in indices]
+
+
+def test_miss_then_hit(shim_module, make_cfg, tmp_path):
+    cfg = make_cfg(result_cache_dir=str(tmp_path))
+    cache = shim_module._ResultCache()
+    keys = ["k1", "k2"]
+    generate = FakeGenerator(keys)
+
+    first = asyncio.run(cache.fetch_or_generate(cfg, keys, generate))
+    second = asyncio.run(cache.fetch_or_generate(cfg, keys, generate))
+
+    assert first == second == [b"png:k1", b"png:k2"]
+    assert generate.calls == [["k1", "k2"]]
+    assert (cache.misses, cache.hits) == (2, 2)
+    assert (tmp_path / "k1" / "k1.png").read_bytes() == b"png:k1"
+
+
+def test_only_missing_keys_are_generated(shim_module, make_cfg, tmp_path):
+    cfg = make_cfg(result_cache_dir=str(tmp_path))
+    cache = shim_module._ResultCache()
+    asyncio.run(cache.fetch_or_generate(cfg, ["k1"], FakeGenerator(["k1"])))
+
+    keys = ["k1", "k2"]
+    generate = FakeGenerator(keys)
+    assert asyncio.run(cache.fetch_or_generate(cfg, keys, generate)) == [b"png:k1", b"png:k2"]
+    assert generate.calls == [["k2"]]
+
+
+def test_survives_a_restart(shim_module, make_cfg, tmp_path):
+    cfg = make_cfg(result_cache_dir=str(tmp_path))
+    asyncio.run(shim_module._ResultCache().fetch_or_generate(cfg, ["k1"], FakeGenerator(["k1"])))
+
+    cache = shim_module._ResultCache()
+    generate = FakeGenerator(["k1"])
+    assert asyncio.run(cache.fetch_or_generate(cfg, ["k1"], generate)) == [b"png:k1"]
+    assert generate.calls == []
+    assert cache.snapshot(cfg)["entries"] == 1
+
+
+def test_concurrent_requests_share_one_generation(shim_module, make_cfg, tmp_path):
+    cfg = make_cfg(result_cache_dir=str(tmp_path))
+    cache = shim_module._ResultCache()
+    keys = ["k1"]
+    generate = FakeGenerator(keys, delay_s=0.05)
+
+    async def run():
+        return await asyncio.gather(*(cache.fetch_or_generate(cfg, keys, generate) for _ in range(3)))
+
+    assert asyncio.run(run()) == [[b"png:k1"]] * 3
+    assert generate.calls == [["k1"]]
+    assert (cache.misses, cache.hits) == (1, 2)
+    assert cache.snapshot(cfg)["inflight"] == 0
+
+
+def test_waiter_takes_over_when_the_owner_is_cancelled(shim_module, make_cfg, tmp_path):
+    cfg = make_cfg(result_cache_dir=str(tmp_path))
+    cache = shim_module._ResultCache()
+    keys = ["k1"]
+    generate = FakeGenerator(keys, delay_s=0.05)
+
+    async def run():
+        owner = asyncio.ensure_future(cache.fetch_or_generate(cfg, keys, generate))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(cache.fetch_or_generate(cfg, keys, generate))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        return await waiter
+
+    assert asyncio.run(run()) == [b"png:k1"]
+    assert generate.calls == [["k1"], ["k1"]]
+
+
+def test_failed_generation_reaches_every_waiter_and_is_not_cached(shim_module, make_cfg, tmp_path):
+    cfg = make_cfg(result_cache_dir=str(tmp_path))
+    cache = shim_module._ResultCache()
+    keys = ["k1"]
+    failing = FakeGenerator(keys, delay_s=0.05, error=HTTPException(status_code=502, detail="InvokeAI failed"))
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.fetch_or_generate(cfg, keys, failing) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert [getattr(r, "detail", r) for r in results] == ["InvokeAI failed"] * 3
+    assert failing.calls == [["k1"]]
+    assert cache.snapshot(cfg)["entries"] == 0
+    assert cache.snapshot(cfg)["inflight"] == 0
+
+    # The next request generates afresh.
+    generate = FakeGenerator(keys)
+    assert asyncio.run(cache.fetch_or_generate(cfg, keys, generate)) == [b"png:k1"]
+    assert generate.calls == [["k1"]]
+
+
+def test_evicts_least_recently_used_beyond_the_budget(shim_module, make_cfg, tmp_path):
+    # Room for two 6-byte entries.
+    cfg = make_cfg(result_cache_dir=str(tmp_path), result_cache_max_mb=13 / (1024 * 1024))
+    cache = shim_module._ResultCache()
+    for key in ("k1", "k2"):
+        asyncio.run(cache.fetch_or_generate(cfg, [key], FakeGenerator([key])))
+    # Touch k1, so k2 is the least recently used.
+    asyncio.run(cache.fetch_or_generate(cfg, ["k1"], FakeGenerator(["k1"])))
+    asyncio.run(cache.fetch_or_generate(cfg, ["k3"], FakeGenerator(["k3"])))
+
+    assert cache.snapshot(cfg)["entries"] == 2
+    assert not (tmp_path / "k2" / "k2.png").exists()
+    assert (tmp_path / "k1" / "k1.png").exists()
+    assert (tmp_path / "k3" / "k3.png").exists()
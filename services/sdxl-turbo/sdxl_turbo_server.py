@@ -1,20 +1,53 @@
+import asyncio
 import base64
+import contextlib
 import io
+import logging
 import os
+import threading
 import time
-from typing import Any, Dict, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 import torch
 from diffusers import StableDiffusionXLPipeline
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, Field
 
 
-app = FastAPI(title="SDXL Turbo Shim", version="0.1")
+logger = logging.getLogger(__name__)
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Start loading the pipeline in the background; on shutdown, stop a load that hasn't finished."""
+    load: Optional["asyncio.Future[None]"] = None
+    if _eager_load():
+        # Loading runs on the inference worker, so requests that arrive meanwhile simply queue behind it.
+        load = asyncio.get_running_loop().run_in_executor(_BATCHER.worker, _prepare_pipeline)
+    try:
+        yield
+    finally:
+        _STOP_LOADING.set()
+        if load is not None and not load.done():
+            # Drops a load that hasn't started; one that has stops before its next warm-up call.
+            load.cancel()
+        _BATCHER.worker.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="SDXL Turbo Shim", version="0.1", lifespan=_lifespan)
 
 _PIPELINE = None
 _PIPELINE_DEVICE = None
 _PIPELINE_MODEL_ID = None
+_PIPELINE_LOCK = threading.Lock()
+# Startup loading progress for /readyz: idle -> loading -> warming -> ready (or failed).
+_LOAD_STATE: Dict[str, Any] = {"state": "idle", "error": None, "load_s": None, "warmup_s": None}
+# Set at shutdown so a background load still warming up gives up between pipeline calls.
+_STOP_LOADING = threading.Event()
 
 
 class GenerateRequest(BaseModel):
@@ -107,6 +140,56 @@ def _default_seed() -> Optional[int]:
     return None if seed < 0 else seed
 
 
+def _batch_window_s() -> float:
+    return max(0.0, _float_env("SDXL_TURBO_BATCH_WINDOW_MS", 10.0)) / 1000.0
+
+
+def _max_batch_size() -> int:
+    return max(1, _int_env("SDXL_TURBO_MAX_BATCH_SIZE", 8))
+
+
+def _max_queue_images() -> int:
+    return _int_env("SDXL_TURBO_MAX_QUEUE", 32)
+
+
+def _prompt_cache_bytes() -> int:
+    return max(0, int(_float_env("SDXL_TURBO_PROMPT_CACHE_MB", 128) * 1024 * 1024))
+
+
+def _eager_load() -> bool:
+    return _bool_env("SDXL_TURBO_EAGER_LOAD", True)
+
+
+def _compile_targets() -> set[str]:
+    raw = (_env("SDXL_TURBO_COMPILE", "off") or "off").lower()
+    if raw in {"off", "false", "0", "no", "none"}:
+        return set()
+    if raw in {"on", "true", "1", "yes", "all"}:
+        return {"unet", "vae"}
+    return {part.strip() for part in raw.replace("+", ",").split(",") if part.strip() in {"unet", "vae"}}
+
+
+def _parse_sizes(raw: str) -> List[tuple[int, int]]:
+    sizes = []
+    for part in raw.split(","):
+        a, _, b = part.strip().lower().partition("x")
+        try:
+            sizes.append((int(a), int(b)))
+        except ValueError:
+            continue
+    return sizes
+
+
+def _warmup_sizes() -> List[tuple[int, int]]:
+    return _parse_sizes(_env("SDXL_TURBO_WARMUP_SIZES", f"{_default_width()}x{_default_height()}") or "")
+
+
+def _warmup_batch_sizes() -> List[int]:
+    raw = _env("SDXL_TURBO_WARMUP_BATCH_SIZES", "1") or ""
+    parts = [part.strip() for part in raw.split(",")]
+    return [int(part) for part in parts if part.isdigit() and int(part) > 0]
+
+
 def _parse_size(size: Optional[str]) -> tuple[int, int]:
     raw = (size or "").strip().lower()
     if not raw:
@@ -125,6 +208,14 @@ def _parse_size(size: Optional[str]) -> tuple[int, int]:
 
 
 def _ensure_pipeline() -> StableDiffusionXLPipeline:
+    if _PIPELINE is not None:
+        return _PIPELINE
+    # /readyz and the inference worker may both get here first; load once.
+    with _PIPELINE_LOCK:
+        return _load_pipeline()
+
+
+def _load_pipeline() -> StableDiffusionXLPipeline:
     global _PIPELINE, _PIPELINE_DEVICE, _PIPELINE_MODEL_ID
     if _PIPELINE is not None:
         return _PIPELINE
@@ -148,8 +239,15 @@ def _ensure_pipeline() -> StableDiffusionXLPipeline:
 
     if _bool_env("SDXL_TURBO_ENABLE_ATTENTION_SLICING", False):
         pipeline.enable_attention_slicing()
-    if _bool_env("SDXL_TURBO_ENABLE_XFORMERS", False):
-        pipeline.enable_xformers_memory_efficient_attention()
+    _select_attention(pipeline)
+
+    if device == "cuda":
+        # Let cuDNN pick the fastest kernels per shape (paid during warm-up).
+        torch.backends.cudnn.benchmark = True
+    if _bool_env("SDXL_TURBO_CHANNELS_LAST", device == "cuda"):
+        pipeline.unet.to(memory_format=torch.channels_last)
+        pipeline.vae.to(memory_format=torch.channels_last)
+    _compile_pipeline(pipeline)
 
     _PIPELINE = pipeline
     _PIPELINE_DEVICE = device
@@ -157,7 +255,461 @@ def _ensure_pipeline() -> StableDiffusionXLPipeline:
     return pipeline
 
 
-def _generate_image(
+def _select_attention(pipeline: StableDiffusionXLPipeline) -> None:
+    """SDXL_TURBO_ATTENTION: auto (SDPA when available), sdpa, xformers or default (classic processor)."""
+    mode = (_env("SDXL_TURBO_ATTENTION", "auto") or "auto").lower()
+    if _bool_env("SDXL_TURBO_ENABLE_XFORMERS", False):
+        mode = "xformers"
+    if mode == "xformers":
+        pipeline.enable_xformers_memory_efficient_attention()
+        return
+    if mode == "auto" and _bool_env("SDXL_TURBO_ENABLE_ATTENTION_SLICING", False):
+        return  # keep the sliced processor
+
+    from diffusers.models.attention_processor import AttnProcessor, AttnProcessor2_0
+
+    if mode in {"auto", "sdpa"}:
+        if not hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+            if mode == "sdpa":
+                raise RuntimeError("SDXL_TURBO_ATTENTION=sdpa needs PyTorch 2.0 or newer.")
+            return
+        processor: Any = AttnProcessor2_0()
+    elif mode == "default":
+        processor = AttnProcessor()
+    else:
+        raise RuntimeError(f"Unknown SDXL_TURBO_ATTENTION '{mode}' (expected auto, sdpa, xformers or default).")
+    pipeline.unet.set_attn_processor(processor)
+    pipeline.vae.set_attn_processor(processor)
+
+
+def _compile_pipeline(pipeline: StableDiffusionXLPipeline) -> None:
+    """torch.compile the UNet and/or VAE decoder (SDXL_TURBO_COMPILE), caching Inductor output on disk."""
+    targets = _compile_targets()
+    if not targets:
+        return
+    cache_dir = _env("SDXL_TURBO_COMPILE_CACHE_DIR") or os.path.join(
+        _env("SDXL_TURBO_CACHE_DIR", "cache") or "cache", "torch-compile"
+    )
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Inductor reads these when it is first imported; restarts then reuse the compiled kernels and graphs.
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    os.environ.setdefault("TORCHINDUCTOR_AUTOGRAD_CACHE", "1")
+    os.environ.setdefault("TRITON_CACHE_DIR", os.path.join(cache_dir, "triton"))
+    with contextlib.suppress(Exception):
+        import torch._inductor.config as inductor_config
+
+        inductor_config.fx_graph_cache = True
+
+    mode = _env("SDXL_TURBO_COMPILE_MODE", "default")
+    if "unet" in targets:
+        pipeline.unet = torch.compile(pipeline.unet, mode=mode)
+    if "vae" in targets:
+        pipeline.vae.decode = torch.compile(pipeline.vae.decode, mode=mode)
+    logger.info("torch.compile enabled for %s (mode=%s, cache=%s)", sorted(targets), mode, cache_dir)
+
+
+def _encode_png(image: Any) -> str:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+@dataclass(frozen=True)
+class _BatchKey:
+    """Requests can share a pipeline call only when these match."""
+
+    width: int
+    height: int
+    num_inference_steps: int
+    guidance_scale: float
+    # With CFG, a missing negative prompt (zeroed embeddings) and an empty one differ.
+    has_negative_prompt: bool
+
+
+@dataclass
+class _BatchItem:
+    prompt: str
+    negative_prompt: Optional[str]
+    seed: Optional[int]
+    n: int
+    future: Optional["asyncio.Future[List[tuple[str, Optional[int]]]]"] = None
+    submitted_at: float = field(default_factory=time.perf_counter)
+
+
+# (prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds)
+_Embeds = tuple[Any, Any, Any, Any]
+
+
+class _PromptCache:
+    """LRU cache of `encode_prompt` outputs, so repeated prompts skip both text encoders.
+
+    Keyed by prompt, negative prompt and whether classifier-free guidance is on (which decides
+    whether negative embeddings exist at all). Tensors stay on the pipeline's device and are
+    evicted least recently used first to keep them within SDXL_TURBO_PROMPT_CACHE_MB (0 disables).
+    Only the inference worker touches it.
+    """
+
+    def __init__(self) -> None:
+        self._entries: "OrderedDict[tuple[str, Optional[str], bool], tuple[_Embeds, int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(embeds: _Embeds) -> int:
+        return sum(t.numel() * t.element_size() for t in embeds if t is not None)
+
+    def get_many(
+        self,
+        pipeline: StableDiffusionXLPipeline,
+        prompts: List[tuple[str, Optional[str]]],
+        do_cfg: bool,
+        device: str,
+    ) -> List[_Embeds]:
+        """Embeddings for each (prompt, negative prompt), encoding all misses in one `encode_prompt` call.
+
+        Misses within one call must agree on whether a negative prompt is given (the batch key
+        guarantees it), since the pipeline takes either a list of negatives or none.
+        """
+        found: Dict[tuple[str, Optional[str], bool], _Embeds] = {}
+        missing: List[tuple[str, Optional[str], bool]] = []
+        for prompt, negative_prompt in prompts:
+            key = (prompt, negative_prompt, do_cfg)
+            if key in found or key in missing:
+                self.hits += 1
+                continue
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                missing.append(key)
+                continue
+            self.hits += 1
+            self._entries.move_to_end(key)
+            found[key] = entry[0]
+
+        if missing:
+            negatives = [negative_prompt for _, negative_prompt, _ in missing]
+            with torch.no_grad():
+                encoded = pipeline.encode_prompt(
+                    prompt=[prompt for prompt, _, _ in missing],
+                    device=device,
+                    num_images_per_prompt=1,
+                    do_classifier_free_guidance=do_cfg,
+                    negative_prompt=None if negatives[0] is None else negatives,
+                )
+            budget = _prompt_cache_bytes()
+            for row, key in enumerate(missing):
+                # Slice (not index) to keep the batch dimension; clone so an entry doesn't pin the whole batch.
+                embeds: _Embeds = tuple(
+                    t[row : row + 1].clone() if t is not None else None for t in encoded
+                )  # type: ignore[assignment]
+                found[key] = embeds
+                size = self._size(embeds)
+                if size <= budget:
+                    self._entries[key] = (embeds, size)
+                    self.bytes += size
+                    while self.bytes > budget:
+                        _, (_, evicted) = self._entries.popitem(last=False)
+                        self.bytes -= evicted
+        return [found[(prompt, negative_prompt, do_cfg)] for prompt, negative_prompt in prompts]
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+_PROMPT_CACHE = _PromptCache()
+
+
+def _batch_embeds(
+    pipeline: StableDiffusionXLPipeline, key: _BatchKey, items: List[_BatchItem], device: str
+) -> Dict[str, Any]:
+    """Pipeline kwargs carrying one (cached) embedding per image, in batch order."""
+    # Mirrors the pipeline's own rule; SDXL-Turbo checkpoints have no guidance embedding.
+    do_cfg = key.guidance_scale > 1.0
+    per_item = _PROMPT_CACHE.get_many(pipeline, [(item.prompt, item.negative_prompt) for item in items], do_cfg, device)
+    names = ("prompt_embeds", "negative_prompt_embeds", "pooled_prompt_embeds", "negative_pooled_prompt_embeds")
+    kwargs: Dict[str, Any] = {}
+    for index, name in enumerate(names):
+        tensors = [embeds[index] for embeds, item in zip(per_item, items) for _ in range(item.n)]
+        kwargs[name] = torch.cat(tensors, dim=0) if tensors[0] is not None else None
+    return kwargs
+
+
+def _generate_batch(key: _BatchKey, items: List[_BatchItem]) -> List[List[tuple[str, Optional[int]]]]:
+    """Run requests as one pipeline call and return each item's images; image i of an item uses seed + i.
+
+    One generator per image keeps every image identical to a single-image call with that seed,
+    while the UNet denoises the whole batch together.
+    """
+    pipeline = _ensure_pipeline()
+    device = _PIPELINE_DEVICE or "cpu"
+
+    seeds: List[Optional[int]] = [
+        item.seed + i if item.seed is not None else None for item in items for i in range(item.n)
+    ]
+    prompt_kwargs: Dict[str, Any]
+    if _prompt_cache_bytes() > 0:
+        prompt_kwargs = _batch_embeds(pipeline, key, items, device)
+    elif len(items) == 1:
+        # A single request: encode its prompt once and let the pipeline repeat the embeddings.
+        prompt_kwargs = {
+            "prompt": items[0].prompt,
+            "negative_prompt": items[0].negative_prompt,
+            "num_images_per_prompt": items[0].n,
+        }
+    else:
+        prompt_kwargs = {
+            "prompt": [item.prompt for item in items for _ in range(item.n)],
+            "negative_prompt": (
+                [item.negative_prompt or "" for item in items for _ in range(item.n)]
+                if key.has_negative_prompt
+                else None
+            ),
+        }
+
+    generator = None
+    if any(s is not None for s in seeds):
+        generator = [torch.Generator(device=device) for _ in seeds]
+        for g, s in zip(generator, seeds):
+            if s is not None:
+                g.manual_seed(s)
+            else:
+                # Unseeded images in a mixed batch still need their own, randomly seeded, generator.
+                g.seed()
+
+    result = pipeline(
+        num_inference_steps=key.num_inference_steps,
+        guidance_scale=key.guidance_scale,
+        width=key.width,
+        height=key.height,
+        generator=generator,
+        **prompt_kwargs,
+    )
+
+    encoded = [(_encode_png(image), s) for image, s in zip(result.images, seeds)]
+    out: List[List[tuple[str, Optional[int]]]] = []
+    offset = 0
+    for item in items:
+        out.append(encoded[offset : offset + item.n])
+        offset += item.n
+    return out
+
+
+class _Histogram:
+    """Prometheus-style cumulative histogram, rendered by /metrics."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+            for bound, count in zip(self.buckets, self._counts):
+                lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{le="+Inf"}} {self._count}')
+            lines.append(f"{self.name}_sum {self._sum:g}")
+            lines.append(f"{self.name}_count {self._count}")
+        return lines
+
+
+_BATCH_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+_BATCH_IMAGES = _Histogram("sdxl_turbo_batch_images", "Images per pipeline call.", _BATCH_SIZE_BUCKETS)
+_BATCH_REQUESTS = _Histogram("sdxl_turbo_batch_requests", "Requests merged into one pipeline call.", _BATCH_SIZE_BUCKETS)
+_BATCH_WAIT = _Histogram(
+    "sdxl_turbo_batch_wait_seconds",
+    "Time a request waited to be batched and reach the GPU.",
+    (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+class _MicroBatcher:
+    """Merges concurrent requests with the same _BatchKey into one pipeline call.
+
+    The first request for a key opens a window of SDXL_TURBO_BATCH_WINDOW_MS (closed early once
+    SDXL_TURBO_MAX_BATCH_SIZE images are waiting). Requests keep joining while an earlier batch
+    holds the GPU, so under load batches fill up without any extra wait. A request's images are
+    never split across calls.
+
+    Pipeline calls run one at a time on a dedicated inference thread, so the event loop stays free
+    for health checks and other requests. At most SDXL_TURBO_MAX_QUEUE images may be waiting or
+    rendering (0 = unbounded); beyond that requests get 429 with a Retry-After estimate.
+    """
+
+    def __init__(self) -> None:
+        self._pending: Dict[_BatchKey, List[_BatchItem]] = {}
+        self._full: Dict[_BatchKey, asyncio.Event] = {}
+        self._gpu: Optional[asyncio.Lock] = None
+        # Flush tasks in flight; the loop only keeps weak references to tasks.
+        self._tasks: "set[asyncio.Task[None]]" = set()
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sdxl-inference")
+        # Images accepted and not yet answered, and a moving average of one pipeline call.
+        self.queued = 0
+        self.rejected = 0
+        self._batch_s: Optional[float] = None
+
+    def _retry_after_s(self) -> int:
+        batches_ahead = self.queued / _max_batch_size() + 1
+        return max(1, min(60, int((self._batch_s or 1.0) * batches_ahead + 0.999)))
+
+    async def submit(self, key: _BatchKey, item: _BatchItem) -> List[tuple[str, Optional[int]]]:
+        limit = _max_queue_images()
+        if limit > 0 and self.queued + item.n > limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Inference queue is full ({self.queued} images waiting, limit {limit})",
+                headers={"Retry-After": str(self._retry_after_s())},
+            )
+        if self._gpu is None:
+            self._gpu = asyncio.Lock()
+        item.future = asyncio.get_running_loop().create_future()
+        items = self._pending.get(key)
+        if items is None:
+            items = self._pending[key] = []
+            self._full[key] = asyncio.Event()
+            task = asyncio.ensure_future(self._flush(key, self._full[key]))
+            self._tasks.add(task)
+            task.add_done_callback(self._flushed)
+        items.append(item)
+        if sum(i.n for i in items) >= _max_batch_size():
+            self._full[key].set()
+        self.queued += item.n
+        try:
+            return await item.future
+        finally:
+            self.queued -= item.n
+
+    def _flushed(self, task: "asyncio.Task[None]") -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Batch flush failed", exc_info=task.exception())
+
+    async def _flush(self, key: _BatchKey, full: asyncio.Event) -> None:
+        try:
+            await asyncio.wait_for(full.wait(), timeout=_batch_window_s())
+        except asyncio.TimeoutError:
+            pass
+        assert self._gpu is not None
+        async with self._gpu:
+            # Take everything that arrived, including while the previous batch ran; later
+            # requests for this key start a new window.
+            items = [i for i in self._pending.pop(key, []) if i.future is not None and not i.future.done()]
+            self._full.pop(key, None)
+            try:
+                for chunk in self._chunks(items):
+                    await self._run(key, chunk)
+            except asyncio.CancelledError:
+                # The inference worker was shut down under us: answer every request still waiting.
+                unavailable = HTTPException(status_code=503, detail="Server is shutting down")
+                for item in items:
+                    if item.future is not None and not item.future.done():
+                        item.future.set_exception(unavailable)
+                raise
+
+    @staticmethod
+    def _chunks(items: List[_BatchItem]) -> List[List[_BatchItem]]:
+        limit = _max_batch_size()
+        chunks: List[List[_BatchItem]] = []
+        current: List[_BatchItem] = []
+        images = 0
+        for item in items:
+            if current and images + item.n > limit:
+                chunks.append(current)
+                current, images = [], 0
+            current.append(item)
+            images += item.n
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def _run(self, key: _BatchKey, items: List[_BatchItem]) -> None:
+        now = time.perf_counter()
+        for item in items:
+            _BATCH_WAIT.observe(now - item.submitted_at)
+        _BATCH_IMAGES.observe(sum(item.n for item in items))
+        _BATCH_REQUESTS.observe(len(items))
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.worker, _generate_batch, key, items)
+        except Exception as exc:
+            for item in items:
+                if item.future is not None and not item.future.done():
+                    item.future.set_exception(exc)
+            return
+        elapsed = time.perf_counter() - started
+        self._batch_s = elapsed if self._batch_s is None else 0.8 * self._batch_s + 0.2 * elapsed
+        for item, result in zip(items, results):
+            if item.future is not None and not item.future.done():
+                item.future.set_result(result)
+
+
+_BATCHER = _MicroBatcher()
+
+
+def _warm_up() -> None:
+    """Run every warm-up size and batch size once, so compilation and autotuning happen before ready."""
+    for width, height in _warmup_sizes():
+        for batch_size in _warmup_batch_sizes():
+            if _STOP_LOADING.is_set():
+                return
+            key = _BatchKey(
+                width=width,
+                height=height,
+                num_inference_steps=_default_steps(),
+                guidance_scale=_default_guidance(),
+                has_negative_prompt=False,
+            )
+            started = time.perf_counter()
+            _generate_batch(key, [_BatchItem(prompt="warm-up", negative_prompt=None, seed=0, n=batch_size)])
+            logger.info("Warm-up %dx%d x%d took %.2fs", width, height, batch_size, time.perf_counter() - started)
+
+
+def _prepare_pipeline() -> None:
+    """Load, optimize and warm the pipeline (runs on the inference worker at startup)."""
+    try:
+        _LOAD_STATE.update(state="loading", error=None)
+        started = time.perf_counter()
+        _ensure_pipeline()
+        _LOAD_STATE["load_s"] = round(time.perf_counter() - started, 2)
+        if _STOP_LOADING.is_set():
+            return
+        _LOAD_STATE["state"] = "warming"
+        started = time.perf_counter()
+        _warm_up()
+        if _STOP_LOADING.is_set():
+            return
+        _LOAD_STATE["warmup_s"] = round(time.perf_counter() - started, 2)
+        _LOAD_STATE["state"] = "ready"
+        logger.info("SDXL Turbo ready (load %ss, warm-up %ss)", _LOAD_STATE["load_s"], _LOAD_STATE["warmup_s"])
+    except Exception as exc:
+        _LOAD_STATE.update(state="failed", error=str(exc))
+        logger.exception("Failed to prepare SDXL Turbo pipeline")
+
+
+async def _generate_image(
     *,
     prompt: str,
     negative_prompt: Optional[str],
@@ -167,29 +719,15 @@ def _generate_image(
     height: int,
     seed: Optional[int],
 ) -> tuple[str, Optional[int]]:
-    pipeline = _ensure_pipeline()
-    device = _PIPELINE_DEVICE or "cpu"
-
-    generator = None
-    if seed is not None:
-        generator = torch.Generator(device=device).manual_seed(seed)
-
-    result = pipeline(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        num_inference_steps=num_inference_steps,
-        guidance_scale=guidance_scale,
+    key = _BatchKey(
         width=width,
         height=height,
-        generator=generator,
+        num_inference_steps=num_inference_steps,
+        guidance_scale=guidance_scale,
+        has_negative_prompt=negative_prompt is not None,
     )
-
-    image = result.images[0]
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    encoded = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-    return encoded, seed
+    item = _BatchItem(prompt=prompt, negative_prompt=negative_prompt, seed=seed, n=1)
+    return (await _BATCHER.submit(key, item))[0]
 
 
 @app.get("/health")
@@ -204,6 +742,11 @@ def healthz() -> Dict[str, Any]:
 
 @app.get("/readyz")
 def readyz() -> Dict[str, Any]:
+    if _eager_load():
+        # Not ready until the startup load and warm-up have finished.
+        if _LOAD_STATE["state"] != "ready":
+            raise HTTPException(status_code=503, detail={"state": _LOAD_STATE["state"], "error": _LOAD_STATE["error"]})
+        return {"ok": True, "time": _now(), **_LOAD_STATE, "prompt_cache": _PROMPT_CACHE.snapshot()}
     try:
         _ensure_pipeline()
     except Exception as exc:
@@ -216,6 +759,33 @@ def ready() -> Dict[str, Any]:
     return readyz()
 
 
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    lines: List[str] = []
+    for histogram in (_BATCH_IMAGES, _BATCH_REQUESTS, _BATCH_WAIT):
+        lines.extend(histogram.render())
+    lines.extend(
+        [
+            "# HELP sdxl_turbo_queue_images Images accepted and not yet returned.",
+            "# TYPE sdxl_turbo_queue_images gauge",
+            f"sdxl_turbo_queue_images {_BATCHER.queued}",
+            "# HELP sdxl_turbo_rejected_total Requests rejected with 429 because the queue was full.",
+            "# TYPE sdxl_turbo_rejected_total counter",
+            f"sdxl_turbo_rejected_total {_BATCHER.rejected}",
+            "# HELP sdxl_turbo_prompt_cache_hits_total Prompt embedding cache hits (text encoders skipped).",
+            "# TYPE sdxl_turbo_prompt_cache_hits_total counter",
+            f"sdxl_turbo_prompt_cache_hits_total {_PROMPT_CACHE.hits}",
+            "# HELP sdxl_turbo_prompt_cache_misses_total Prompt embedding cache misses (prompt encoded).",
+            "# TYPE sdxl_turbo_prompt_cache_misses_total counter",
+            f"sdxl_turbo_prompt_cache_misses_total {_PROMPT_CACHE.misses}",
+            "# HELP sdxl_turbo_prompt_cache_bytes Bytes of cached prompt embeddings.",
+            "# TYPE sdxl_turbo_prompt_cache_bytes gauge",
+            f"sdxl_turbo_prompt_cache_bytes {_PROMPT_CACHE.bytes}",
+        ]
+    )
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
 @app.get("/v1/models")
 def models() -> Dict[str, Any]:
     model_id = _env("SDXL_TURBO_MODEL_ID", "stabilityai/sdxl-turbo")
@@ -232,9 +802,9 @@ def models() -> Dict[str, Any]:
 
 
 @app.post("/v1/generate")
-def generate(payload: GenerateRequest) -> Dict[str, Any]:
+async def generate(payload: GenerateRequest) -> Dict[str, Any]:
     seed = payload.seed if payload.seed is not None else _default_seed()
-    encoded, _ = _generate_image(
+    encoded, _ = await _generate_image(
         prompt=payload.prompt,
         negative_prompt=payload.negative_prompt,
         num_inference_steps=payload.num_inference_steps or _default_steps(),
@@ -311,19 +881,16 @@ async def openai_images(req: Request) -> Dict[str, Any]:
     except Exception:
         seed = _default_seed()
 
-    data = []
-    for i in range(n):
-        seed_i = seed + i if isinstance(seed, int) else seed
-        encoded, used_seed = _generate_image(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=steps,
-            guidance_scale=guidance,
-            width=w,
-            height=h,
-            seed=seed_i,
-        )
-        data.append({"b64_json": encoded, "seed": used_seed})
+    key = _BatchKey(
+        width=w,
+        height=h,
+        num_inference_steps=steps,
+        guidance_scale=guidance,
+        has_negative_prompt=negative_prompt is not None,
+    )
+    item = _BatchItem(prompt=prompt, negative_prompt=negative_prompt, seed=seed, n=n)
+    images = await _BATCHER.submit(key, item)
+    data = [{"b64_json": encoded, "seed": used_seed} for encoded, used_seed in images]
 
     return {
         "created": _now(),
@@ -0,0 +1,165 @@
+import contextlib
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+# The cache only needs sizes, row slices and concatenation, so it is tested with a stand-in
+# tensor. Importing the server still needs `torch` and `diffusers`; provide bare modules for
+# whichever isn't installed so these tests run without the GPU stack.
+try:
+    import torch  # noqa: F401
+except ImportError:
+    fake_torch = types.ModuleType("torch")
+    fake_torch.dtype = object
+    fake_torch.float16 = fake_torch.float32 = fake_torch.bfloat16 = object()
+    sys.modules["torch"] = fake_torch
+try:
+    import diffusers  # noqa: F401
+except ImportError:
+    fake_diffusers = types.ModuleType("diffusers")
+
+    class StableDiffusionXLPipeline:
+        pass
+
+    fake_diffusers.StableDiffusionXLPipeline = StableDiffusionXLPipeline
+    sys.modules["diffusers"] = fake_diffusers
+
+spec = importlib.util.spec_from_file_location(
+    "sdxl_turbo_server", Path(__file__).resolve().parents[1] / "sdxl_turbo_server.py"
+)
+sdxl = importlib.util.module_from_spec(spec)
+# Dataclasses resolve their annotations through sys.modules.
+sys.modules[spec.name] = sdxl
+spec.loader.exec_module(sdxl)
+
+EMBED_WIDTH = 32
+POOLED_WIDTH = 8
+# Per prompt without guidance: prompt_embeds + pooled, 4 bytes per element.
+ENTRY_BYTES = (EMBED_WIDTH + POOLED_WIDTH) * 4
+
+
+class FakeTensor:
+    """A batch of labelled rows with a fixed number of 4-byte elements per row."""
+
+    def __init__(self, rows, width):
+        self.rows = list(rows)
+        self.width = width
+
+    def __getitem__(self, index):
+        return FakeTensor(self.rows[index], self.width)
+
+    def clone(self):
+        return FakeTensor(self.rows, self.width)
+
+    def numel(self):
+        return len(self.rows) * self.width
+
+    def element_size(self):
+        return 4
+
+
+def _cat(tensors, dim=0):
+    return FakeTensor([row for t in tensors for row in t.rows], tensors[0].width)
+
+
+class FakePipeline:
+    """Encodes each prompt as a row labelled with the prompt, recording every call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode_prompt(self, prompt, device, num_images_per_prompt, do_classifier_free_guidance, negative_prompt):
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        self.calls.append(list(prompts))
+        embeds = FakeTensor(prompts, EMBED_WIDTH)
+        pooled = FakeTensor(prompts, POOLED_WIDTH)
+        if not do_classifier_free_guidance:
+            return embeds, None, pooled, None
+        negatives = negative_prompt if isinstance(negative_prompt, list) else [negative_prompt] * len(prompts)
+        return embeds, FakeTensor(negatives, EMBED_WIDTH), pooled, FakeTensor(negatives, POOLED_WIDTH)
+
+
+@pytest.fixture(autouse=True)
+def fake_torch_ops(monkeypatch):
+    monkeypatch.setattr(sdxl, "torch", types.SimpleNamespace(no_grad=contextlib.nullcontext, cat=_cat))
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    # Room for exactly two entries.
+    monkeypatch.setenv("SDXL_TURBO_PROMPT_CACHE_MB", str(2 * ENTRY_BYTES / (1024 * 1024)))
+    return sdxl._PromptCache()
+
+
+def _get(cache, pipeline, *prompts):
+    return cache.get_many(pipeline, [(p, None) for p in prompts], False, "cpu")
+
+
+def test_misses_are_encoded_in_one_call(cache):
+    pipeline = FakePipeline()
+
+    embeds = _get(cache, pipeline, "a", "b", "a")
+
+    assert pipeline.calls == [["a", "b"]]
+    assert [e[0].rows for e in embeds] == [["a"], ["b"], ["a"]]
+    assert embeds[0][1] is None
+    assert (cache.misses, cache.hits) == (2, 1)
+    assert cache.bytes == 2 * ENTRY_BYTES
+
+
+def test_negative_prompts_are_encoded_with_their_prompts(cache):
+    pipeline = FakePipeline()
+
+    embeds = cache.get_many(pipeline, [("a", "x"), ("b", "y")], True, "cpu")
+
+    assert pipeline.calls == [["a", "b"]]
+    assert [(e[0].rows, e[1].rows) for e in embeds] == [(["a"], ["x"]), (["b"], ["y"])]
+    # Guidance is part of the key: the same prompt without it is a separate entry.
+    cache.get_many(pipeline, [("a", "x")], False, "cpu")
+    assert pipeline.calls[-1] == ["a"]
+
+
+def test_evicts_least_recently_used_within_the_byte_budget(cache):
+    pipeline = FakePipeline()
+    _get(cache, pipeline, "a", "b")
+    # Touch "a", so "b" is the least recently used.
+    _get(cache, pipeline, "a")
+    _get(cache, pipeline, "c")
+
+    assert cache.snapshot()["entries"] == 2
+    assert cache.bytes == 2 * ENTRY_BYTES
+
+    pipeline.calls.clear()
+    _get(cache, pipeline, "a", "b", "c")
+    assert pipeline.calls == [["b"]]
+
+
+def test_entries_larger_than_the_budget_are_returned_but_not_kept(monkeypatch, cache):
+    monkeypatch.setenv("SDXL_TURBO_PROMPT_CACHE_MB", str((ENTRY_BYTES - 1) / (1024 * 1024)))
+    pipeline = FakePipeline()
+
+    embeds = _get(cache, pipeline, "a")
+
+    assert embeds[0][0].rows == ["a"]
+    assert cache.snapshot()["entries"] == 0
+    assert cache.bytes == 0
+
+
+def test_batch_embeds_repeat_each_prompt_per_image(monkeypatch, cache):
+    pipeline = FakePipeline()
+    key = sdxl._BatchKey(width=512, height=512, num_inference_steps=1, guidance_scale=0.0, has_negative_prompt=False)
+    items = [
+        sdxl._BatchItem(prompt="a", negative_prompt=None, seed=1, n=2),
+        sdxl._BatchItem(prompt="b", negative_prompt=None, seed=2, n=1),
+    ]
+    monkeypatch.setattr(sdxl, "_PROMPT_CACHE", cache)
+
+    kwargs = sdxl._batch_embeds(pipeline, key, items, "cpu")
+
+    assert kwargs["prompt_embeds"].rows == ["a", "a", "b"]
+    assert kwargs["pooled_prompt_embeds"].rows == ["a", "a", "b"]
+    assert kwargs["negative_prompt_embeds"] is None
+    assert pipeline.calls == [["a", "b"]]